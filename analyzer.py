@@ -0,0 +1,805 @@
+import re
+import json
+import time
+import hashlib
+import queue
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from google import genai
+from google.genai import types
+from types import SimpleNamespace
+from db import get_cached_analysis, put_cached_analysis, record_model_call
+from pdf_text import extract_cv_text
+from context_cache import ContextCache, GeminiCacheBackend, PromptPrefix, offer_part
+from fingerprint import minhash, remember_cv, find_near_duplicate, cluster_near_duplicates
+from json_stream import IncrementalJSONParser, repair_json
+
+PRICE_INPUT_PER_M  = 0.10   # $ / 1e6 tokens input
+PRICE_CACHED_INPUT_PER_M = 0.025   # $ / 1e6 tokens input servis depuis un cache de contexte
+PRICE_OUTPUT_PER_M = 0.40   # $ / 1e6 tokens output
+
+MODEL = "gemini-2.5-flash-lite"
+
+PROMPT_SYSTEM = """
+Vous êtes un expert RH très exigeant.
+Votre mission : analyser le CV (fourni en PDF, ou sous forme de texte extrait du PDF) en fonction de l’offre d’emploi fournie (texte).
+
+──────────────────────────────
+⚠️ Règles strictes de sortie :
+- Répondez UNIQUEMENT avec un JSON valide (UTF-8), sans aucun texte avant/après.
+- Le JSON doit contenir exactement et uniquement les champs suivants (pas d’ajout, pas de suppression).
+- Les champs numériques doivent rester des nombres (pas de texte).
+- N'utilisez pas de sous-objets ou de champs imbriqués (flat JSON).
+- Comptez le nombre de pages traitées du PDF (ou le nombre de pages indiqué pour le texte extrait) et placez ce nombre (entier) dans "pages_analysees".
+- Mettez la valeur LITTÉRALE "GEMINI " (avec un espace final) dans "methode_analyse".
+- Ne retournez AUCUN autre champ, objet ou commentaire hors JSON.
+
+──────────────────────────────
+📋 Champs attendus dans le JSON final :
+{
+  "nom_prenom": "Nom et prénom du candidat (extrait du CV)",
+  "score_technique": 0,
+  "score_experience": 0,
+  "score_formation": 0,
+  "score_soft_skills": 0,
+  "score_global": 0,
+  "points_forts": [],
+  "points_faibles": [],
+  "competences_matchees": [],
+  "competences_manquantes": [],
+  "competences_deduites": [],
+  "experience_pertinente": "",
+  "recommandation": "",
+  "commentaires": "",
+  "pages_analysees": 0,
+  "methode_analyse": "GEMINI "
+}
+
+──────────────────────────────
+🔢 Critères de notation (base 100) :
+- Compétences techniques requises : 40 points max
+- Expérience pertinente : 30 points max
+- Formation et qualifications : 15 points max
+- Soft skills : 15 points max
+- "score_global" = somme des 4 sous-scores (max 100).
+- "recommandation" ∈ { "Recommandé", "À considérer", "Non recommandé" }
+
+──────────────────────────────
+📌 Règles de pondération :
+- L’expérience supérieure au minimum requis est toujours positive (jamais négative).
+- Si une compétence ou une dimension est mal détaillée, attribuez un score partiel, mais ne réduisez pas à zéro si l’expérience est proche.
+- Formation :
+  • Formation directement liée au poste → score élevé.
+  • Formation partiellement liée → score moyen.
+  • Formation hors domaine → score 0.
+- Expérience :
+  • Alignée avec le poste → score élevé.
+  • Partielle (liée à une partie des missions/technos) → score intermédiaire.
+  • Totalement hors domaine (ex : commercial, événementiel, communication, vente, etc.) → score 0.
+  ⚠️ Ne jamais attribuer de points si le domaine n’est pas lié au poste.
+- Soft skills :
+  • Comptabiliser uniquement les soft skills en rapport direct avec le poste.
+  • Ne pas accorder de points pour des compétences génériques (vente, management, communication non technique).
+
+──────────────────────────────
+🚨 Conditions bloquantes :
+- Si le CV n’a AUCUN RAPPORT direct avec le poste demandé,
+- Ou si le poste est TECHNIQUE et que le CV est clairement NON TECHNIQUE,
+  → mettre tous les sous-scores à 0,
+  → "score_global": 0,
+  → "recommandation": "Non recommandé",
+  → "commentaires": "Profil hors filière, sans lien avec le poste".
+
+──────────────────────────────
+📌 Règles de cohérence :
+- Les "compétences manquantes" doivent venir UNIQUEMENT des exigences de l’offre donnée.
+- Les "competences_deduites" doivent inclure les compétences implicites (ex : projet en React → déduire "React", "JavaScript", "Front-end Development").
+- Toujours se baser UNIQUEMENT sur l’offre d’emploi fournie (ne pas réutiliser d’infos d’analyses précédentes).
+- Ne jamais insérer de compétences hors domaine (ex : CRM/marketing/commerce si l’offre est Full Stack Developer).
+"""
+
+
+EXPECTED_KEYS = [
+    "nom_prenom", "score_technique", "score_experience", "score_formation",
+    "score_soft_skills", "score_global", "points_forts", "points_faibles",
+    "competences_matchees", "competences_manquantes", "experience_pertinente",
+    "recommandation", "commentaires", "pages_analysees", "methode_analyse"
+]
+
+
+# Barèmes des scores (le schéma de réponse les impose au modèle, la validation les vérifie)
+SCORE_BOUNDS = {
+    "score_technique": 40,
+    "score_experience": 30,
+    "score_formation": 15,
+    "score_soft_skills": 15,
+    "score_global": 100,
+}
+LIST_KEYS = ("points_forts", "points_faibles", "competences_matchees", "competences_manquantes",
+             "competences_deduites")
+RECOMMANDATIONS = ("Recommandé", "À considérer", "Non recommandé")
+# Sans ces champs, une analyse n'est pas exploitable (les autres ont une valeur par défaut)
+REQUIRED_KEYS = ("score_technique", "score_experience", "score_formation", "score_soft_skills",
+                 "score_global")
+# Textes vides ou absents : valeur par défaut plutôt que rejet d'une réponse par ailleurs valide
+TEXT_DEFAULTS = {"nom_prenom": "Non spécifié", "recommandation": "Non spécifiée"}
+
+def _analysis_schema(extra=None):
+    # Schéma de réponse construit à partir d'EXPECTED_KEYS (ordre du prompt conservé)
+    keys = list(EXPECTED_KEYS)
+    keys.insert(keys.index("competences_manquantes") + 1, "competences_deduites")
+    properties = dict(extra or {})
+    for key in keys:
+        if key in SCORE_BOUNDS:
+            properties[key] = types.Schema(type=types.Type.INTEGER, minimum=0, maximum=SCORE_BOUNDS[key])
+        elif key == "pages_analysees":
+            properties[key] = types.Schema(type=types.Type.INTEGER, minimum=0)
+        elif key in LIST_KEYS:
+            properties[key] = types.Schema(type=types.Type.ARRAY, items=types.Schema(type=types.Type.STRING))
+        elif key == "recommandation":
+            properties[key] = types.Schema(type=types.Type.STRING, enum=list(RECOMMANDATIONS))
+        else:
+            properties[key] = types.Schema(type=types.Type.STRING)
+    return types.Schema(type=types.Type.OBJECT, properties=properties,
+                        required=list(extra or {}) + keys,
+                        property_ordering=list(extra or {}) + keys)
+
+ANALYSIS_SCHEMA = _analysis_schema()
+PACK_SCHEMA = types.Schema(type=types.Type.ARRAY,
+                           items=_analysis_schema({"filename": types.Schema(type=types.Type.STRING)}))
+
+# Dernier recours quand la réponse n'est pas récupérable localement : appel de correction
+# (réponse abîmée seule, sans l'offre ni le CV)
+PROMPT_REPAIR = """
+Le texte fourni devait être la réponse JSON d'une analyse de CV, mais il n'est pas un JSON valide.
+Renvoyez UNIQUEMENT le JSON corrigé, conforme au schéma imposé :
+- conservez toutes les valeurs présentes, sans les reformuler ni les réévaluer ;
+- corrigez seulement la syntaxe (guillemets, virgules, accolades, texte parasite) ;
+- si un champ texte ou liste est absent, mettez une chaîne ou une liste vide.
+"""
+REPAIR_MAX_CHARS = 40000
+
+# Empreinte du prompt : toute modification du prompt invalide le cache d'analyses
+PROMPT_HASH = hashlib.sha256(PROMPT_SYSTEM.encode("utf-8")).hexdigest()[:16]
+
+# Nombre d'appels Gemini simultanés par défaut pour un lot de CV
+DEFAULT_MAX_IN_FLIGHT = 4
+
+# Mode groupé : plusieurs CV courts (texte extrait) notés dans une même requête
+PACK_TOKEN_BUDGET = 12000    # tokens de CV au plus par requête groupée
+PACK_MAX_CV_TOKENS = 3000    # au-delà, le CV est analysé seul
+PACK_MAX_CVS = 8
+# Streaming : intervalle minimal entre deux événements "partial" d'un même CV (secondes)
+STREAM_EVENT_INTERVAL = 0.25
+
+PROMPT_PACK = """
+──────────────────────────────
+📦 Mode groupé :
+- Plusieurs CV sont fournis ci-dessous, chacun précédé d'une ligne "=== CV : <nom du fichier> === (N page(s))".
+- Le texte de chaque CV a été extrait du PDF : utilisez N pour "pages_analysees".
+- Analysez chaque CV indépendamment des autres, avec exactement les mêmes règles.
+- Répondez UNIQUEMENT avec un tableau JSON contenant un objet par CV.
+- Chaque objet contient le champ "filename" (nom de fichier exact, recopié de la ligne "=== CV : … ===")
+  en plus des champs attendus.
+"""
+
+
+def _print_notify(level: str, message: str):
+    print(message)
+
+def build_cv_part(pdf_bytes: bytes, prefer_text: bool = True, extraction: dict = None):
+    """Partie "CV" de la requête : texte extrait localement si fiable, sinon le PDF brut.
+    Retourne (part, input_mode) avec input_mode "text" ou "pdf".
+    `extraction` : résultat d'extract_cv_text déjà calculé, pour ne pas relire le PDF.
+    """
+    if prefer_text:
+        extraction = extraction or extract_cv_text(pdf_bytes)
+        if extraction["ok"]:
+            header = (
+                f"Voici le CV du candidat (texte extrait du PDF, {extraction['pages']} page(s) ; "
+                f"utilisez ce nombre pour \"pages_analysees\") :\n"
+            )
+            return types.Part.from_text(text=header + extraction["text"]), "text"
+    return types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"), "pdf"
+
+def make_context_cache(client, backend=None):
+    """Cache du préfixe (prompt système + offre) pour un lot ; backend Gemini par défaut"""
+    return ContextCache(backend or GeminiCacheBackend(client), MODEL, PROMPT_SYSTEM, PROMPT_HASH)
+
+def estimate_cost(tokens: dict):
+    """Coût en $ d'un appel ; les tokens servis depuis le cache de contexte sont moins chers"""
+    in_tok = tokens.get("prompt") or 0
+    cached_tok = min(tokens.get("cached") or 0, in_tok)
+    out_tok = tokens.get("completion") or 0
+    return ((in_tok - cached_tok) / 1_000_000) * PRICE_INPUT_PER_M \
+        + (cached_tok / 1_000_000) * PRICE_CACHED_INPUT_PER_M \
+        + (out_tok / 1_000_000) * PRICE_OUTPUT_PER_M
+
+def _usage_tokens(resp):
+    um = getattr(resp, "usage_metadata", None)
+    return {
+        "prompt": getattr(um, "prompt_token_count", None),
+        "completion": getattr(um, "candidates_token_count", None),
+        "cached": getattr(um, "cached_content_token_count", None),
+        "total": getattr(um, "total_token_count", None),
+    }
+
+def _request_layout(prefix, tail_parts, response_schema=ANALYSIS_SCHEMA):
+    # Préfixe commun (prompt système + offre) en tête, parties propres au(x) CV en dernier
+    config = types.GenerateContentConfig(
+        temperature=0.0,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        system_instruction=prefix.system_instruction,
+        cached_content=prefix.cached_content,
+    )
+    return prefix.contents + list(tail_parts), config
+
+def _stream_response(client, contents, config, on_chunk, stats, call_started):
+    # generate_content_stream : fragments transmis à on_chunk, réponse recomposée à la fin
+    pieces, usage = [], None
+    for chunk in client.models.generate_content_stream(model=MODEL, contents=contents, config=config):
+        text = getattr(chunk, "text", None) or ""
+        if stats["first_chunk_ms"] is None and text:
+            stats["first_chunk_ms"] = (time.perf_counter() - call_started) * 1000
+        usage = getattr(chunk, "usage_metadata", None) or usage
+        if text:
+            pieces.append(text)
+            on_chunk(text)
+    return SimpleNamespace(text="".join(pieces), usage_metadata=usage)
+
+def _call_model(client, job_offer_text: str, tail_parts, max_retries: int, notify, context_cache: ContextCache = None,
+                on_chunk=None, response_schema=ANALYSIS_SCHEMA):
+    """Appel generate_content avec retries sur 429/RESOURCE_EXHAUSTED.
+    Avec `on_chunk`, la réponse est reçue en streaming (si le client le permet) : chaque
+    fragment de texte est transmis à on_chunk(texte), et on_chunk(None) signale qu'un
+    nouvel essai repart de zéro.
+    La réponse est contrainte par `response_schema` (ANALYSIS_SCHEMA par défaut).
+    Retourne (réponse ou None, stats) ; stats : attempts, latency_ms (dernier appel),
+    duration_ms (total), wait_ms (backoff + limiteur de débit), context_cached, error,
+    streamed et first_chunk_ms (délai avant le premier fragment).
+    """
+    if context_cache is not None:
+        prefix = context_cache.prefix_for(job_offer_text)
+    else:
+        prefix = PromptPrefix(system_instruction=PROMPT_SYSTEM, contents=[offer_part(job_offer_text)])
+    rate_wait = getattr(client.models, "last_wait", None)
+    stream = on_chunk is not None and hasattr(client.models, "generate_content_stream")
+    stats = {"attempts": 0, "latency_ms": None, "duration_ms": 0.0, "wait_ms": 0.0,
+             "context_cached": False, "error": None, "streamed": stream, "first_chunk_ms": None}
+    started = time.perf_counter()
+    for attempt in range(max_retries):
+        contents, config = _request_layout(prefix, tail_parts, response_schema)
+        stats["attempts"] = attempt + 1
+        stats["context_cached"] = bool(prefix.cached_content)
+        call_started = time.perf_counter()
+        if stream and attempt:
+            on_chunk(None)
+            stats["first_chunk_ms"] = None
+        try:
+            if stream:
+                resp = _stream_response(client, contents, config, on_chunk, stats, call_started)
+            else:
+                resp = client.models.generate_content(
+                    model=MODEL,
+                    contents=contents,
+                    config=config,
+                )
+            waited = rate_wait() if rate_wait else 0.0
+            if stats["first_chunk_ms"] is not None:
+                stats["first_chunk_ms"] -= waited * 1000
+            stats["wait_ms"] += waited * 1000
+            stats["latency_ms"] = (time.perf_counter() - call_started - waited) * 1000
+            stats["duration_ms"] = (time.perf_counter() - started) * 1000
+            return resp, stats
+        except Exception as e:
+            stats["wait_ms"] += (rate_wait() if rate_wait else 0.0) * 1000
+            msg = str(e)
+            is_quota = ("429" in msg) or ("RESOURCE_EXHAUSTED" in msg.upper())
+            if prefix.cached_content and not is_quota and attempt < max_retries - 1:
+                # Cache de contexte expiré ou refusé : on repasse au préfixe en clair
+                context_cache.invalidate(job_offer_text)
+                prefix = context_cache.prefix_for(job_offer_text)
+                continue
+            if attempt < max_retries - 1 and is_quota:
+                wait = (2 ** attempt) + random.uniform(0, 0.75)
+                notify("warning", f"⏳ Quota/rate limit atteint. Nouvel essai dans {wait:.1f}s (tentative {attempt+2}/{max_retries})")
+                time.sleep(wait)
+                stats["wait_ms"] += wait * 1000
+                continue
+            notify("error", f"❌ Erreur Gemini : {e}")
+            stats["error"] = msg
+            stats["duration_ms"] = (time.perf_counter() - started) * 1000
+            return None, stats
+    # max_retries < 1 : aucun appel tenté
+    notify("error", f"❌ Aucun appel Gemini tenté (max_retries = {max_retries})")
+    stats["error"] = "aucune tentative"
+    return None, stats
+
+def _record_call(job_offer_id, kind, outcome, stats=None, tokens=None, cvs=1, input_mode=None, cache_hit=False,
+                 parse_status=None):
+    # Télémétrie : ne doit jamais faire échouer une analyse
+    stats = stats or {}
+    try:
+        record_model_call(
+            job_offer_id, MODEL, kind, outcome, cvs=cvs, cache_hit=cache_hit,
+            context_cached=stats.get("context_cached", False), input_mode=input_mode, tokens=tokens,
+            cost_usd=estimate_cost(tokens) if tokens and outcome not in ("cache", "duplicate") else 0.0,
+            latency_ms=stats.get("latency_ms"), duration_ms=stats.get("duration_ms"),
+            attempts=stats.get("attempts"), wait_ms=stats.get("wait_ms"), error=stats.get("error"),
+            streamed=stats.get("streamed", False), first_chunk_ms=stats.get("first_chunk_ms"),
+            parse_status=parse_status,
+        )
+    except Exception as e:
+        print(f"⚠️ Télémétrie non enregistrée : {e}")
+
+def _duplicate_result(duplicate: dict, pdf_sha256: str, job_offer_id: str = None):
+    """Résultat construit à partir de l'analyse d'un quasi-doublon, sans appel au modèle.
+    Mis en cache pour ce PDF : au lot suivant, c'est un résultat en cache (déjà enregistré
+    pour l'offre) et non un nouveau doublon à enregistrer.
+    """
+    analysis = json.loads(duplicate["analysis_json"])
+    # Un doublon de doublon pointe vers l'analyse d'origine
+    origin = analysis.pop("doublon_de", None) or {}
+    analysis["doublon_de"] = {
+        "analysis_id": origin.get("analysis_id") or duplicate.get("analysis_id"),
+        "filename": origin.get("filename") or duplicate.get("filename"),
+        "similarite": round(duplicate["similarite"], 3),
+    }
+    content = json.dumps(analysis, ensure_ascii=False)
+    if job_offer_id:
+        put_cached_analysis(pdf_sha256, job_offer_id, MODEL, PROMPT_HASH, content, {}, "text")
+    return {"content": content, "tokens": {}, "cached": False,
+            "duplicate": True, "input_mode": "text", "pdf_sha256": pdf_sha256}
+
+def analyze_cv_with_gemini(pdf_bytes: bytes, job_offer_text: str, client: genai.Client, max_retries: int = 4, notify=None,
+                           job_offer_id: str = None, force: bool = False, prefer_text: bool = True,
+                           context_cache: ContextCache = None, dedupe: bool = True, filename: str = None,
+                           extraction: dict = None, on_partial=None):
+    """Appel Gemini avec retries exponentiels simples sur 429/RESOURCE_EXHAUSTED.
+    `notify(level, message)` reçoit les avertissements ("warning") et erreurs ("error").
+    Si `job_offer_id` est fourni, le cache d'analyses est consulté avant l'appel
+    (sauf `force=True`) et alimenté après une réponse JSON valide.
+    Avec `prefer_text`, le texte du CV est extrait localement et envoyé à la place du PDF
+    lorsqu'il est exploitable (moins de tokens en entrée) ; "input_mode" indique le chemin utilisé.
+    Avec `dedupe`, un quasi-doublon déjà analysé pour l'offre (empreinte MinHash du texte)
+    est réutilisé sans appel au modèle : le résultat porte "duplicate": True et l'analyse "doublon_de".
+    La requête commence par le préfixe commun (prompt système + offre), réutilisé via
+    `context_cache` s'il est fourni, et se termine par le CV.
+    Avec `on_partial(champs, en_cours)`, la réponse est reçue en streaming : `champs` contient
+    les champs JSON déjà complets, `en_cours` vaut (clé, début du texte) ou None. Le résultat
+    final est validé et mis en cache comme d'habitude, une fois la réponse complète.
+    Le résultat contient "cached": True lorsqu'il provient du cache, et "pdf_sha256".
+    """
+    notify = notify or _print_notify
+    pdf_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+    if job_offer_id and not force:
+        cached = get_cached_analysis(pdf_sha256, job_offer_id, MODEL, PROMPT_HASH)
+        if cached:
+            cached["cached"] = True
+            cached["pdf_sha256"] = pdf_sha256
+            _record_call(job_offer_id, "single", "cache", input_mode=cached.get("input_mode"), cache_hit=True)
+            return cached
+    signature = None
+    if dedupe and job_offer_id:
+        extraction = extraction or extract_cv_text(pdf_bytes)
+        signature = minhash(extraction["text"]) if extraction["ok"] else None
+        duplicate = None if force else find_near_duplicate(job_offer_id, signature)
+        if duplicate:
+            remember_cv(job_offer_id, pdf_sha256, filename, signature)
+            _record_call(job_offer_id, "single", "duplicate", input_mode="text")
+            return _duplicate_result(duplicate, pdf_sha256, job_offer_id)
+    cv_part, input_mode = build_cv_part(pdf_bytes, prefer_text, extraction)
+    on_chunk = None
+    if on_partial is not None:
+        parser = IncrementalJSONParser()
+
+        def on_chunk(text):
+            nonlocal parser
+            if text is None:
+                parser = IncrementalJSONParser()
+                on_partial({}, None)
+                return
+            parser.feed(text)
+            on_partial(parser.fields, parser.pending())
+    resp, stats = _call_model(client, job_offer_text, [cv_part], max_retries, notify, context_cache, on_chunk)
+    if resp is None:
+        _record_call(job_offer_id, "single", "error", stats, input_mode=input_mode)
+        return None
+    output_text = resp.text or ""
+    tokens = _usage_tokens(resp)
+    analysis, parse_status = parse_analysis(output_text)
+    _record_call(job_offer_id, "single", "ok" if analysis is not None else "invalid_json", stats, tokens,
+                 input_mode=input_mode, parse_status=parse_status)
+    if analysis is None and output_text.strip():
+        # Réponse irrécupérable localement : correction à bas coût plutôt qu'une nouvelle analyse
+        fixed, fix_tokens = _fix_json_with_model(client, output_text, ANALYSIS_SCHEMA, notify, job_offer_id)
+        analysis = normalize_analysis(fixed)
+        tokens = _sum_tokens(tokens, fix_tokens)
+    if analysis is None:
+        notify("error", "❌ Réponse du modèle illisible même après correction : analyse non enregistrée"
+               if output_text.strip() else "❌ Réponse du modèle vide : analyse non enregistrée")
+    content = json.dumps(analysis, ensure_ascii=False) if analysis is not None else output_text
+    if job_offer_id and analysis is not None:
+        put_cached_analysis(pdf_sha256, job_offer_id, MODEL, PROMPT_HASH, content, tokens, input_mode)
+        remember_cv(job_offer_id, pdf_sha256, filename, signature)
+    return {"content": content, "tokens": tokens, "cached": False, "input_mode": input_mode,
+            "pdf_sha256": pdf_sha256}
+
+def _estimate_tokens(text: str):
+    return len(text) // 4
+
+def plan_packs(items, token_budget: int = PACK_TOKEN_BUDGET, max_cvs: int = PACK_MAX_CVS):
+    """Regroupe les CV (dicts avec "filename" et "text") en paquets sous le budget de tokens.
+    Deux CV de même nom ne partagent jamais un paquet (la réponse est indexée par nom de fichier).
+    """
+    packs = []
+    for item in sorted(items, key=lambda it: len(it["text"]), reverse=True):
+        size = _estimate_tokens(item["text"])
+        for pack in packs:
+            if (len(pack["items"]) < max_cvs and pack["tokens"] + size <= token_budget
+                    and all(it["filename"] != item["filename"] for it in pack["items"])):
+                pack["items"].append(item)
+                pack["tokens"] += size
+                break
+        else:
+            packs.append({"items": [item], "tokens": size})
+    return [pack["items"] for pack in packs]
+
+def analyze_cv_pack(items, job_offer_text: str, client: genai.Client, max_retries: int = 4, notify=None,
+                    job_offer_id: str = None, context_cache: ContextCache = None):
+    """Analyse plusieurs CV (texte extrait) en une seule requête.
+
+    `items` : dicts {"filename", "pdf_sha256", "text", "pages"} (+ "signature" MinHash optionnelle). Retourne {filename: résultat} pour
+    les CV dont l'objet JSON est présent et complet ; les autres sont absents du dict
+    (l'appelant les relance). Les tokens du paquet sont répartis au prorata de la taille des CV.
+    """
+    notify = notify or _print_notify
+    parts = [types.Part.from_text(text=PROMPT_PACK)] + [
+        types.Part.from_text(text=f"=== CV : {item['filename']} === ({item['pages']} page(s))\n{item['text']}")
+        for item in items
+    ]
+    resp, stats = _call_model(client, job_offer_text, parts, max_retries, notify, context_cache,
+                              response_schema=PACK_SCHEMA)
+    if resp is None:
+        _record_call(job_offer_id, "pack", "error", stats, cvs=len(items), input_mode="text")
+        return {}
+    tokens = _usage_tokens(resp)
+    output_text = resp.text or ""
+    parsed, parse_status = _parse_analysis_json(output_text), "strict"
+    if parsed is None:
+        parsed, parse_status = repair_json(output_text), "repaired"
+    if isinstance(parsed, dict):
+        parsed = next((v for v in parsed.values() if isinstance(v, list)), None)
+    if not isinstance(parsed, list):
+        _record_call(job_offer_id, "pack", "invalid_json", stats, tokens, cvs=len(items), input_mode="text",
+                     parse_status="failed")
+        if not output_text.strip():
+            return {}
+        # Un appel de correction coûte bien moins que de relancer tout le paquet
+        parsed, fix_tokens = _fix_json_with_model(client, output_text, PACK_SCHEMA, notify, job_offer_id, len(items))
+        tokens = _sum_tokens(tokens, fix_tokens)
+        parse_status = None   # déjà enregistré
+        if not isinstance(parsed, list):
+            return {}
+    by_name = {item["filename"]: item for item in items}
+    total_chars = sum(len(item["text"]) for item in items) or 1
+    results = {}
+    for obj in parsed:
+        if not isinstance(obj, dict):
+            continue
+        filename = obj.pop("filename", None)
+        analysis = normalize_analysis(obj)
+        if filename not in by_name or filename in results or analysis is None:
+            continue
+        if parse_status == "strict" and analysis != obj:
+            parse_status = "repaired"
+        obj = analysis
+        share = len(by_name[filename]["text"]) / total_chars
+        cv_tokens = {k: (round(v * share) if v is not None else None) for k, v in tokens.items()}
+        content = json.dumps(obj, ensure_ascii=False)
+        item = by_name[filename]
+        if job_offer_id:
+            put_cached_analysis(item["pdf_sha256"], job_offer_id, MODEL, PROMPT_HASH, content, cv_tokens, "text")
+            remember_cv(job_offer_id, item["pdf_sha256"], filename, item.get("signature"))
+        results[filename] = {"content": content, "tokens": cv_tokens, "cached": False,
+                             "input_mode": "text", "packed": len(items), "pdf_sha256": item["pdf_sha256"]}
+    if parse_status is not None:
+        _record_call(job_offer_id, "pack", "ok" if len(results) == len(items) else "partial", stats, tokens,
+                     cvs=len(items), input_mode="text", parse_status=parse_status)
+    return results
+
+def _parse_analysis_json(analysis_text: str):
+    clean = analysis_text.strip()
+    if clean.startswith("```json"):
+        clean = clean[len("```json"):].strip()
+    if clean.endswith("```"):
+        clean = clean[:-3].strip()
+    try:
+        return json.loads(clean)
+    except json.JSONDecodeError:
+        return None
+
+def _to_score(value, maximum):
+    # 32, 32.0, "32", "32/40" -> entier borné ; None si illisible
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, str):
+        match = re.match(r"\s*(\d+(?:[.,]\d+)?)", value)
+        value = match.group(1).replace(",", ".") if match else None
+    try:
+        return max(0, min(maximum, int(round(float(value)))))
+    except (TypeError, ValueError):
+        return None
+
+def normalize_analysis(data):
+    """Analyse conforme au schéma, ou None s'il manque un score indispensable (REQUIRED_KEYS).
+    Scores convertis en entiers et bornés, score global recalculé s'il manque, listes et
+    textes secondaires complétés par des valeurs vides, recommandation tronquée complétée,
+    nom et recommandation vides remplacés par TEXT_DEFAULTS.
+    """
+    if not isinstance(data, dict):
+        return None
+    analysis = dict(data)
+    for key, maximum in SCORE_BOUNDS.items():
+        analysis[key] = _to_score(analysis.get(key), maximum)
+    subscores = [analysis[key] for key in SCORE_BOUNDS if key != "score_global"]
+    if analysis["score_global"] is None and None not in subscores:
+        analysis["score_global"] = min(100, sum(subscores))
+    for key in LIST_KEYS:
+        value = analysis.get(key)
+        if isinstance(value, str):
+            analysis[key] = [value] if value.strip() else []
+        elif not isinstance(value, list):
+            analysis[key] = []
+    for key in ("experience_pertinente", "commentaires"):
+        if not isinstance(analysis.get(key), str):
+            analysis[key] = "" if analysis.get(key) is None else str(analysis[key])
+    recommandation = analysis.get("recommandation")
+    if isinstance(recommandation, str) and recommandation not in RECOMMANDATIONS:
+        matches = [r for r in RECOMMANDATIONS if r.lower().startswith(recommandation.strip().lower())]
+        if recommandation.strip() and len(matches) == 1:
+            analysis["recommandation"] = matches[0]
+    for key, default in TEXT_DEFAULTS.items():
+        value = analysis.get(key)
+        if value is None or not str(value).strip():
+            analysis[key] = default
+    analysis.setdefault("pages_analysees", None)
+    analysis.setdefault("methode_analyse", "GEMINI ")
+    if any(analysis.get(key) is None for key in REQUIRED_KEYS):
+        return None
+    return analysis
+
+def parse_analysis(analysis_text: str):
+    """(analyse normalisée ou None, statut) ; statut "strict" (JSON valide et conforme),
+    "repaired" (réparé ou complété localement) ou "failed"
+    """
+    data = _parse_analysis_json(analysis_text or "")
+    status = "strict"
+    if data is None:
+        data, status = repair_json(analysis_text or ""), "repaired"
+    analysis = normalize_analysis(data)
+    if analysis is None:
+        return None, "failed"
+    return analysis, "strict" if status == "strict" and analysis == data else "repaired"
+
+def _sum_tokens(*token_dicts):
+    total = {}
+    for tokens in token_dicts:
+        for key, value in (tokens or {}).items():
+            if value is not None:
+                total[key] = (total.get(key) or 0) + value
+            else:
+                total.setdefault(key, None)
+    return total
+
+def _fix_json_with_model(client, broken_text: str, response_schema, notify, job_offer_id=None, cvs=1):
+    """Appel de correction à bas coût (réponse abîmée seule) : (données JSON ou None, tokens).
+    Une seule tentative. En cas d'échec, les CV d'un paquet sont relancés un par un par
+    analyze_batch ; pour un CV seul, l'analyse est signalée en erreur et n'est pas enregistrée.
+    """
+    config = types.GenerateContentConfig(
+        temperature=0.0,
+        response_mime_type="application/json",
+        response_schema=response_schema,
+        system_instruction=PROMPT_REPAIR,
+    )
+    stats = {"attempts": 1, "wait_ms": 0.0, "error": None}
+    started = time.perf_counter()
+    try:
+        resp = client.models.generate_content(model=MODEL, contents=[broken_text[:REPAIR_MAX_CHARS]], config=config)
+    except Exception as e:
+        stats["error"] = str(e)
+        stats["duration_ms"] = stats["latency_ms"] = (time.perf_counter() - started) * 1000
+        _record_call(job_offer_id, "repair", "error", stats, cvs=cvs)
+        notify("warning", f"⚠️ Correction du JSON impossible : {e}")
+        return None, {}
+    stats["duration_ms"] = stats["latency_ms"] = (time.perf_counter() - started) * 1000
+    tokens = _usage_tokens(resp)
+    data = _parse_analysis_json(resp.text or "")
+    if data is None:
+        data = repair_json(resp.text or "")
+    _record_call(job_offer_id, "repair", "ok" if data is not None else "invalid_json", stats, tokens, cvs=cvs,
+                 parse_status="strict" if data is not None else "failed")
+    return data, tokens
+
+def analyze_batch(files, job_offer_text: str, client: genai.Client, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, max_retries: int = 4,
+                  job_offer_id: str = None, force: bool = False, prefer_text: bool = True,
+                  context_cache: ContextCache = None, pack: bool = False, dedupe: bool = True,
+                  stream: bool = False, extractions: dict = None):
+    """Analyse un lot de CV en parallèle (au plus `max_in_flight` appels simultanés).
+
+    `files` est une liste de tuples (filename, pdf_bytes). Génère les événements
+    au fil de l'eau, dans l'ordre de complétion :
+    - {"type": "notice", "index", "filename", "level", "message"}
+    - {"type": "partial", "index", "filename", "fields", "pending"} (avec `stream`)
+    - {"type": "result", "index", "filename", "result", "error"}
+    Un échec sur un fichier produit un "result" avec result=None sans bloquer le reste du lot.
+    Les threads de travail n'appellent jamais Streamlit : l'appelant affiche les événements.
+    `job_offer_id`, `force`, `prefer_text` et `dedupe` sont transmis à analyze_cv_with_gemini.
+    Sans `context_cache`, un cache de préfixe propre au lot est créé (à partir de 2 CV)
+    puis libéré à la fin du lot.
+    Avec `pack`, les CV courts dont le texte est exploitable sont regroupés (plan_packs) et
+    notés à plusieurs par requête ; un paquet dont la réponse est incomplète est scindé
+    en deux puis relancé, jusqu'à l'analyse individuelle. Chaque CV garde son propre "result".
+    Le mode groupé suppose l'extraction locale : il est ignoré si `prefer_text` est faux.
+    Avec `dedupe`, les quasi-doublons du lot ne sont analysés qu'une fois : les autres
+    reprennent le résultat du premier (marqué "duplicate", analyse "doublon_de").
+    Avec `stream`, les CV analysés seuls reçoivent leur réponse en streaming : des événements
+    "partial" (au plus un toutes les STREAM_EVENT_INTERVAL secondes par CV, plus un à chaque
+    champ complété) donnent les champs déjà reçus, avant le "result" définitif.
+    `extractions` : textes déjà extraits (extract_cv_text) par sha256 du PDF, par exemple
+    ceux de la pré-sélection ; ces CV ne sont pas extraits une seconde fois.
+    """
+    extractions = extractions or {}
+    events = queue.Queue()
+    own_cache = context_cache is None and len(files) > 1
+    if own_cache:
+        context_cache = make_context_cache(client)
+    pack = pack and prefer_text
+    dedupe = dedupe and bool(job_offer_id)
+    emitted = set()
+    emitted_lock = threading.Lock()
+    followers = {}   # index du représentant -> [(index, filename, pdf_bytes, similarité, extraction)]
+
+    def _emit(index, filename, result, error=None):
+        with emitted_lock:
+            if index in emitted:
+                return
+            emitted.add(index)
+            waiting = followers.pop(index, [])
+        events.put({"type": "result", "index": index, "filename": filename, "result": result, "error": error})
+        # Quasi-doublons du lot : reprise du résultat du représentant, ou analyse séparée s'il a échoué
+        analysis = _parse_analysis_json(result["content"]) if result else None
+        for f_index, f_filename, f_bytes, score, f_extraction in waiting:
+            if analysis is None:
+                pool.submit(_worker, f_index, f_filename, f_bytes, f_extraction)
+                continue
+            duplicate = {"analysis_id": None, "filename": filename, "similarite": score,
+                         "analysis_json": json.dumps(analysis, ensure_ascii=False)}
+            _record_call(job_offer_id, "single", "duplicate", input_mode="text")
+            _emit(f_index, f_filename, _duplicate_result(duplicate, hashlib.sha256(f_bytes).hexdigest(), job_offer_id))
+
+    def _notifier(index, filename):
+        def notify(level, message):
+            events.put({"type": "notice", "index": index, "filename": filename, "level": level, "message": message})
+        return notify
+
+    def _partial_notifier(index, filename):
+        last = {"at": 0.0, "fields": -1}
+
+        def on_partial(fields, pending):
+            now = time.monotonic()
+            if len(fields) == last["fields"] and now - last["at"] < STREAM_EVENT_INTERVAL:
+                return
+            last["at"], last["fields"] = now, len(fields)
+            events.put({"type": "partial", "index": index, "filename": filename,
+                        "fields": dict(fields), "pending": pending})
+        return on_partial
+
+    def _worker(index, filename, pdf_bytes, extraction=None):
+        try:
+            result = analyze_cv_with_gemini(pdf_bytes, job_offer_text, client, max_retries,
+                                            notify=_notifier(index, filename),
+                                            job_offer_id=job_offer_id, force=force, prefer_text=prefer_text,
+                                            context_cache=context_cache, dedupe=dedupe, filename=filename,
+                                            extraction=extraction,
+                                            on_partial=_partial_notifier(index, filename) if stream else None)
+            error = None if result else "Échec de l'appel Gemini"
+        except Exception as e:
+            result, error = None, str(e)
+        _emit(index, filename, result, error)
+
+    def _prepare(index, filename, pdf_bytes):
+        # Cache d'analyses, extraction locale et empreinte ; None si le CV est déjà traité
+        pdf_sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+        if job_offer_id and not force:
+            cached = get_cached_analysis(pdf_sha256, job_offer_id, MODEL, PROMPT_HASH)
+            if cached:
+                cached["cached"] = True
+                cached["pdf_sha256"] = pdf_sha256
+                _record_call(job_offer_id, "single", "cache", input_mode=cached.get("input_mode"), cache_hit=True)
+                _emit(index, filename, cached)
+                return None
+        extraction = extractions.get(pdf_sha256) or extract_cv_text(pdf_bytes)
+        signature = minhash(extraction["text"]) if dedupe and extraction["ok"] else None
+        return {"index": index, "filename": filename, "pdf_bytes": pdf_bytes, "pdf_sha256": pdf_sha256,
+                "text": extraction["text"], "pages": extraction["pages"], "extraction": extraction,
+                "signature": signature}
+
+    def _dispatch(item):
+        # CV seul, ou candidat au mode groupé (après recherche d'un doublon dans l'historique)
+        packable = pack and item["extraction"]["ok"] and _estimate_tokens(item["text"]) <= PACK_MAX_CV_TOKENS
+        if not packable:
+            pool.submit(_worker, item["index"], item["filename"], item["pdf_bytes"], item["extraction"])
+            return None
+        duplicate = None if force else find_near_duplicate(job_offer_id, item["signature"])
+        if duplicate:
+            remember_cv(job_offer_id, item["pdf_sha256"], item["filename"], item["signature"])
+            _record_call(job_offer_id, "single", "duplicate", input_mode="text")
+            _emit(item["index"], item["filename"], _duplicate_result(duplicate, item["pdf_sha256"], job_offer_id))
+            return None
+        return item
+
+    def _pack_worker(items):
+        try:
+            results = {}
+            if len(items) > 1:
+                label = f"{len(items)} CV groupés"
+                results = analyze_cv_pack(items, job_offer_text, client, max_retries,
+                                          notify=_notifier(items[0]["index"], label),
+                                          job_offer_id=job_offer_id, context_cache=context_cache)
+            for item in items:
+                if item["filename"] in results:
+                    _emit(item["index"], item["filename"], results[item["filename"]])
+            missing = [item for item in items if item["filename"] not in results]
+            if len(missing) == 1:
+                _worker(missing[0]["index"], missing[0]["filename"], missing[0]["pdf_bytes"], missing[0]["extraction"])
+            elif missing:
+                half = len(missing) // 2
+                pool.submit(_pack_worker, missing[:half])
+                pool.submit(_pack_worker, missing[half:])
+        except Exception as e:
+            for item in items:
+                _emit(item["index"], item["filename"], None, str(e))
+
+    def _plan():
+        try:
+            prepared = [f.result() for f in [pool.submit(_prepare, index, filename, pdf_bytes)
+                                             for index, (filename, pdf_bytes) in enumerate(files)]]
+            prepared = {item["index"]: item for item in prepared if item}
+            if dedupe:
+                clusters = cluster_near_duplicates({i: item["signature"] for i, item in prepared.items()})
+                with emitted_lock:
+                    for index, (rep, score) in clusters.items():
+                        item = prepared.pop(index)
+                        followers.setdefault(rep, []).append((index, item["filename"], item["pdf_bytes"], score,
+                                                              item["extraction"]))
+            packable = [item for item in (_dispatch(item) for item in prepared.values()) if item]
+            for items in plan_packs(packable):
+                pool.submit(_pack_worker, items)
+        except Exception as e:
+            for index, (filename, _) in enumerate(files):
+                _emit(index, filename, None, str(e))
+
+    pool = ThreadPoolExecutor(max_workers=max(1, int(max_in_flight)), thread_name_prefix="cv-analyse")
+    try:
+        if pack or dedupe:
+            # La planification attend les extractions : elle tourne hors du pool pour ne pas le bloquer
+            threading.Thread(target=_plan, name="cv-analyse-plan", daemon=True).start()
+        else:
+            for index, (filename, pdf_bytes) in enumerate(files):
+                pool.submit(_worker, index, filename, pdf_bytes,
+                            extractions.get(hashlib.sha256(pdf_bytes).hexdigest()) if extractions else None)
+        remaining = len(files)
+        while remaining:
+            event = events.get()
+            if event["type"] == "result":
+                remaining -= 1
+            yield event
+    finally:
+        # Si l'appelant interrompt l'itération, on n'attend pas les fichiers non démarrés
+        pool.shutdown(wait=False, cancel_futures=True)
+        if own_cache:
+            context_cache.close()
@@ -1,109 +1,23 @@
 import os
 import json
 import time
-import random
+import tempfile
 from datetime import datetime
 from dotenv import load_dotenv
 import streamlit as st
+import db
 from db import (
-    init_db, insert_analysis, get_all_analyses,
-    save_job_offer, get_analyses_by_job_offer,
-    get_all_job_offers, get_job_offer_stats,
-    get_job_offer_by_id,
+    init_db, insert_analysis, save_job_offer, wait_for_writes, SEARCH_PAGE_SIZE,
+    enqueue_batch_job, get_batch_job, get_batch_item_results, save_prescreen_scores,
+    get_telemetry_summary, get_telemetry_timeseries, get_cost_by_job_offer,
+    data_generation, bump_generation, export_analyses, EXPORT_FORMATS, find_job_offer_duplicate,
 )
 from google import genai
-from google.genai import types
-
-PRICE_INPUT_PER_M  = 0.10   # $ / 1e6 tokens input
-PRICE_OUTPUT_PER_M = 0.40   # $ / 1e6 tokens output
-
-MODEL = "gemini-2.5-flash-lite"
-
-PROMPT_SYSTEM = """
-Vous êtes un expert RH très exigeant.
-Votre mission : analyser le CV (fourni en PDF) en fonction de l’offre d’emploi fournie (texte).
-
-──────────────────────────────
-⚠️ Règles strictes de sortie :
-- Répondez UNIQUEMENT avec un JSON valide (UTF-8), sans aucun texte avant/après.
-- Le JSON doit contenir exactement et uniquement les champs suivants (pas d’ajout, pas de suppression).
-- Les champs numériques doivent rester des nombres (pas de texte).
-- N'utilisez pas de sous-objets ou de champs imbriqués (flat JSON).
-- Comptez le nombre de pages traitées du PDF et placez ce nombre (entier) dans "pages_analysees".
-- Mettez la valeur LITTÉRALE "GEMINI " (avec un espace final) dans "methode_analyse".
-- Ne retournez AUCUN autre champ, objet ou commentaire hors JSON.
-
-──────────────────────────────
-📋 Champs attendus dans le JSON final :
-{
-  "nom_prenom": "Nom et prénom du candidat (extrait du CV)",
-  "score_technique": 0,
-  "score_experience": 0,
-  "score_formation": 0,
-  "score_soft_skills": 0,
-  "score_global": 0,
-  "points_forts": [],
-  "points_faibles": [],
-  "competences_matchees": [],
-  "competences_manquantes": [],
-  "competences_deduites": [],
-  "experience_pertinente": "",
-  "recommandation": "",
-  "commentaires": "",
-  "pages_analysees": 0,
-  "methode_analyse": "GEMINI "
-}
-
-──────────────────────────────
-🔢 Critères de notation (base 100) :
-- Compétences techniques requises : 40 points max
-- Expérience pertinente : 30 points max
-- Formation et qualifications : 15 points max
-- Soft skills : 15 points max
-- "score_global" = somme des 4 sous-scores (max 100).
-- "recommandation" ∈ { "Recommandé", "À considérer", "Non recommandé" }
-
-──────────────────────────────
-📌 Règles de pondération :
-- L’expérience supérieure au minimum requis est toujours positive (jamais négative).
-- Si une compétence ou une dimension est mal détaillée, attribuez un score partiel, mais ne réduisez pas à zéro si l’expérience est proche.
-- Formation :
-  • Formation directement liée au poste → score élevé.
-  • Formation partiellement liée → score moyen.
-  • Formation hors domaine → score 0.
-- Expérience :
-  • Alignée avec le poste → score élevé.
-  • Partielle (liée à une partie des missions/technos) → score intermédiaire.
-  • Totalement hors domaine (ex : commercial, événementiel, communication, vente, etc.) → score 0.
-  ⚠️ Ne jamais attribuer de points si le domaine n’est pas lié au poste.
-- Soft skills :
-  • Comptabiliser uniquement les soft skills en rapport direct avec le poste.
-  • Ne pas accorder de points pour des compétences génériques (vente, management, communication non technique).
-
-──────────────────────────────
-🚨 Conditions bloquantes :
-- Si le CV n’a AUCUN RAPPORT direct avec le poste demandé,
-- Ou si le poste est TECHNIQUE et que le CV est clairement NON TECHNIQUE,
-  → mettre tous les sous-scores à 0,
-  → "score_global": 0,
-  → "recommandation": "Non recommandé",
-  → "commentaires": "Profil hors filière, sans lien avec le poste".
-
-──────────────────────────────
-📌 Règles de cohérence :
-- Les "compétences manquantes" doivent venir UNIQUEMENT des exigences de l’offre donnée.
-- Les "competences_deduites" doivent inclure les compétences implicites (ex : projet en React → déduire "React", "JavaScript", "Front-end Development").
-- Toujours se baser UNIQUEMENT sur l’offre d’emploi fournie (ne pas réutiliser d’infos d’analyses précédentes).
-- Ne jamais insérer de compétences hors domaine (ex : CRM/marketing/commerce si l’offre est Full Stack Developer).
-"""
-
-
-EXPECTED_KEYS = [
-    "nom_prenom", "score_technique", "score_experience", "score_formation",
-    "score_soft_skills", "score_global", "points_forts", "points_faibles",
-    "competences_matchees", "competences_manquantes", "experience_pertinente",
-    "recommandation", "commentaires", "pages_analysees", "methode_analyse"
-]
+from analyzer import (
+    MODEL, DEFAULT_MAX_IN_FLIGHT, analyze_batch, estimate_cost, _parse_analysis_json,
+)
+from prescreen import prescreen_batch, parse_keywords, summarize, extractions_by_sha
+from fingerprint import find_similar_job_offer, remember_job_offer
 
 load_dotenv()
 
@@ -131,6 +45,40 @@ st.markdown(
     unsafe_allow_html=True
 )
 
+# Lectures en base conservées entre les reruns. La clé inclut la génération des tables lues :
+# save_job_offer, insert_analysis… la font avancer et seules les lectures concernées sont
+# refaites. Le TTL rattrape les écritures des autres processus (cli.py, worker.py).
+DATA_CACHE_TTL_SECONDS = 300
+
+@st.cache_data(show_spinner=False, ttl=DATA_CACHE_TTL_SECONDS, max_entries=256)
+def _cached_query(name, generation, args, kwargs):
+    return getattr(db, name)(*args, **kwargs)
+
+def _cached(name, *tables):
+    def read(*args, **kwargs):
+        return _cached_query(name, data_generation(*tables), args, kwargs)
+    read.__name__ = name
+    return read
+
+get_all_job_offers = _cached("get_all_job_offers", "job_offers", "analyses")
+get_job_offer_by_id = _cached("get_job_offer_by_id", "job_offers")
+search_job_offers = _cached("search_job_offers", "job_offers")
+get_job_offer_stats = _cached("get_job_offer_stats", "analyses")
+get_job_offer_score_histogram = _cached("get_job_offer_score_histogram", "analyses")
+get_analyses_by_job_offer = _cached("get_analyses_by_job_offer", "analyses")
+get_analyses_page = _cached("get_analyses_page", "analyses")
+get_analyses_summary = _cached("get_analyses_summary", "analyses")
+get_top_skills = _cached("get_top_skills", "analyses")
+find_candidates_by_skill = _cached("find_candidates_by_skill", "analyses")
+search_analyses = _cached("search_analyses", "analyses")
+get_prescreen_runs = _cached("get_prescreen_runs", "prescreen")
+get_prescreen_scores = _cached("get_prescreen_scores", "prescreen", "analyses")
+
+@st.cache_resource(show_spinner=False)
+def _gemini_client():
+    # Client Gemini (lit GEMINI_API_KEY depuis l'env), créé une fois par processus
+    return genai.Client()
+
 def initialize_gemini():
     # Pour initialiser la clé API dans l'environnement (Windows) :
     # set GEMINI_API_KEY=sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
@@ -140,57 +88,9 @@ def initialize_gemini():
     if not api_key:
         st.error("⚠️ Clé API GEMINI_API_KEY non configurée.")
         st.stop()
-        # Client Gemini (lit GEMINI_API_KEY depuis l'env)
         # Exemple de clé API insérée manuellement (à ne pas faire en production)
         # api_key = "sk-ect"
-    return genai.Client()
-
-def analyze_cv_with_gemini(pdf_bytes: bytes, job_offer_text: str, client: genai.Client, max_retries: int = 4):
-    """Appel Gemini avec retries exponentiels simples sur 429/RESOURCE_EXHAUSTED."""
-    contents = [
-        types.Part.from_bytes(data=pdf_bytes, mime_type="application/pdf"),
-        types.Part.from_text(text=f"Voici l'offre d'emploi à analyser :\n{job_offer_text}"),
-        types.Part.from_text(text=PROMPT_SYSTEM),
-    ]
-    for attempt in range(max_retries):
-        try:
-            resp = client.models.generate_content(
-                model=MODEL,
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    temperature=0.0,
-                    response_mime_type="application/json",
-                ),
-            )
-            output_text = resp.text or ""
-            um = getattr(resp, "usage_metadata", None)
-            tokens = {
-                "prompt": getattr(um, "input_token_count", None),
-                "completion": getattr(um, "output_token_count", None),
-                "total": getattr(um, "total_token_count", None),
-            }
-            return {"content": output_text, "tokens": tokens}
-        except Exception as e:
-            msg = str(e)
-            is_quota = ("429" in msg) or ("RESOURCE_EXHAUSTED" in msg.upper())
-            if attempt < max_retries - 1 and is_quota:
-                wait = (2 ** attempt) + random.uniform(0, 0.75)
-                st.warning(f"⏳ Quota/rate limit atteint. Nouvel essai dans {wait:.1f}s (tentative {attempt+2}/{max_retries})")
-                time.sleep(wait)
-                continue
-            st.error(f"❌ Erreur Gemini : {e}")
-            return None
-
-def _parse_analysis_json(analysis_text: str):
-    clean = analysis_text.strip()
-    if clean.startswith("```json"):
-        clean = clean[len("```json"):].strip()
-    if clean.endswith("```"):
-        clean = clean[:-3].strip()
-    try:
-        return json.loads(clean)
-    except json.JSONDecodeError:
-        return None
+    return _gemini_client()
 
 def _render_analysis(analysis: dict, filename: str):
     st.header(f"📊 Analyse de {filename}")
@@ -256,45 +156,248 @@ def _render_analysis(analysis: dict, filename: str):
     with col5:
         st.metric("Date", datetime.now().strftime("%d/%m/%Y %H:%M"))
 
-def display_analysis_conditional(analysis_text: str, filename: str, multi: bool):
-    analysis = _parse_analysis_json(analysis_text)
-    if not analysis:
-        st.error("❌ Erreur lors du parsing de l'analyse JSON")
-        st.text_area("Analyse brute :", analysis_text, height=300)
-        return None
-    score_global = analysis.get("score_global", "?")
-    recommandation = analysis.get("recommandation", "?")
-    header = f"📄 {filename} — {score_global}/100 — {recommandation}"
-    if multi:
-        with st.expander(header, expanded=False):
-            _render_analysis(analysis, filename)
+# Sous-scores affichés : (champ, libellé, maximum)
+SUB_SCORES = (
+    ("score_technique", "Technique", 40),
+    ("score_experience", "Expérience", 30),
+    ("score_formation", "Formation", 15),
+    ("score_soft_skills", "Soft skills", 15),
+)
+
+def _render_partial_analysis(fields: dict, pending, filename: str):
+    """Analyse en cours de réception (streaming) : champs déjà complets, texte long en cours"""
+    score_global = fields.get("score_global")
+    st.subheader(f"⏳ {filename} — {fields.get('nom_prenom', '…')} — " + (
+        f"{score_global}/100" if score_global is not None else "notation en cours…"))
+    cols = st.columns(4)
+    for col, (key, label, maximum) in zip(cols, SUB_SCORES):
+        col.metric(label, f"{fields[key]}/{maximum}" if key in fields else "…")
+    if fields.get("recommandation"):
+        st.write(f"**Recommandation :** {fields['recommandation']}")
+    for key, label in (("experience_pertinente", "💼 Expérience pertinente"), ("commentaires", "📝 Commentaires")):
+        text = fields.get(key) or (pending[1] + " ▌" if pending and pending[0] == key else None)
+        if text:
+            st.caption(label)
+            st.write(text)
+
+# Rafraîchissement du tableau de résultats pendant l'analyse (secondes)
+RESULTS_TABLE_REFRESH_SECONDS = 0.5
+
+def _result_table_rows(rows):
+    """Lignes compactes du tableau de résultats (une par CV)"""
+    table = []
+    for row in rows:
+        analysis = row["analysis"] or row.get("partial") or {}
+        if row["status"] == "ok":
+            status = "♻️ Cache" if row["cached"] else "👥 Doublon" if row["duplicate"] else "✅"
+        else:
+            status = {"pending": "⏳ En cours", "invalid": "❌ JSON invalide"}.get(row["status"], "❌ Échec")
+        table.append({
+            "Fichier": row["filename"],
+            "Candidat": analysis.get("nom_prenom", ""),
+            "Score": analysis.get("score_global"),
+            **{label: analysis.get(key) for key, label, _ in SUB_SCORES},
+            "Recommandation": analysis.get("recommandation", ""),
+            "Statut": status,
+        })
+    return table
+
+def _render_result_detail(row):
+    if row["analysis"]:
+        _render_analysis(row["analysis"], row["filename"])
+    elif row["status"] == "invalid":
+        st.error(f"❌ Erreur lors du parsing de l'analyse JSON ({row['filename']})")
+        st.text_area("Analyse brute :", row["raw"], height=300)
     else:
-        _render_analysis(analysis, filename)
-    return analysis
+        st.error(f"❌ Échec de l'analyse pour {row['filename']}")
 
+@st.fragment
+def _results_view():
+    """Tableau triable des derniers résultats ; l'analyse détaillée n'est rendue que pour la
+    ligne sélectionnée. Fragment : la sélection ne relance pas toute la page.
+    """
+    results = st.session_state.get("_last_results")
+    if not results:
+        return
+    rows = results["rows"]
+    if len(rows) == 1:
+        _render_result_detail(rows[0])
+        return
+    event = st.dataframe(
+        _result_table_rows(rows), key=f"results_table_{results['run']}", on_select="rerun",
+        selection_mode="single-row", hide_index=True, width="stretch",
+        column_config={"Score": st.column_config.ProgressColumn("Score", min_value=0, max_value=100, format="%d")},
+    )
+    selected = event.selection.rows
+    if selected:
+        with st.container(border=True):
+            _render_result_detail(rows[selected[0]])
+    else:
+        st.caption("👆 Sélectionnez une ligne pour afficher l'analyse détaillée.")
+
+
+# Filtres de période de l'historique (nombre de jours, None = tout)
+HISTORY_PERIODS = {
+    "Toutes les dates": None,
+    "7 derniers jours": 7,
+    "30 derniers jours": 30,
+    "90 derniers jours": 90,
+}
+
+SKILL_KIND_LABELS = {
+    "Compétence matchée": "matchee",
+    "Compétence déduite": "deduite",
+    "Compétence manquante": "manquante",
+}
+
+RECOMMANDATION_FILTERS = ["Toutes", "Recommandé", "À considérer", "Non recommandé"]
+
+# Exports de l'historique : fichiers écrits par paquets côté serveur, puis téléchargés
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "cv_exports")
+EXPORT_MIME_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson", "parquet": "application/vnd.apache.parquet"}
+
+def _history_export_section(job_offer_id):
+    """Export de l'historique (offre filtrée ci-dessus, période choisie) en CSV, NDJSON ou Parquet"""
+    with st.expander("📤 Exporter l'historique"):
+        col_e1, col_e2 = st.columns(2)
+        with col_e1:
+            fmt = st.selectbox("Format :", EXPORT_FORMATS, key="export_format")
+        with col_e2:
+            dates = st.date_input("Période (jours inclus, vide = tout) :", value=(), key="export_dates")
+        st.caption("Offre : celle du filtre « Filtrer par offre d'emploi ». "
+                   "Pour les exports planifiés : `python cli.py export --help`.")
+        if st.button("Préparer l'export", key="export_run"):
+            previous = st.session_state.pop("_export", None)
+            if previous and os.path.exists(previous[0]):
+                os.remove(previous[0])
+            os.makedirs(EXPORT_DIR, exist_ok=True)
+            path = os.path.join(EXPORT_DIR, f"analyses_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}")
+            date_from = dates[0] if len(dates) > 0 else None
+            date_to = dates[1] if len(dates) > 1 else None
+            with st.spinner("Export en cours…"):
+                count = export_analyses(path, fmt, job_offer_id, date_from, date_to)
+            if count is None:
+                st.error("❌ Export impossible (voir la console) : pour Parquet, installez pyarrow.")
+            else:
+                st.session_state._export = (path, fmt, count)
+        export = st.session_state.get("_export")
+        if export and os.path.exists(export[0]):
+            path, fmt, count = export
+            st.success(f"✅ {count} analyse(s) exportée(s)")
+            with open(path, "rb") as f:
+                st.download_button(f"📥 Télécharger ({os.path.getsize(path) / 1e6:.1f} Mo)", data=f,
+                                   file_name=os.path.basename(path), mime=EXPORT_MIME_TYPES[fmt], key="export_download")
 
-def _parse_dt_any(s: str):
-    # Try common formats; fall back to raw string for stable ordering
-    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%d/%m/%Y %H:%M:%S", "%d/%m/%Y"):
-        try:
-            return datetime.strptime(s, fmt)
-        except Exception:
-            pass
-    try:
-        # ISO 8601 tolerant
-        return datetime.fromisoformat(s)
-    except Exception:
-        return s  # last resort: compare as string
+def _search_offset(key: str, query: str):
+    """Décalage courant d'une recherche paginée (remis à zéro quand la requête change)"""
+    state_key = f"_search_{key}"
+    if st.session_state.get(f"{state_key}_query") != query:
+        st.session_state[f"{state_key}_query"] = query
+        st.session_state[f"{state_key}_offset"] = 0
+    return st.session_state[f"{state_key}_offset"]
 
-def sort_job_offers_newest_first(job_offers):
-    # Expected tuple shape from your code: (ID, Titre, DateCreation, NbAnalyses)
-    # If your get_all_job_offers returns a different shape, adjust the index for date.
-    return sorted(job_offers, key=lambda r: _parse_dt_any(r[2]), reverse=True)
+def _search_pager_buttons(key: str, offset: int, has_more: bool):
+    """Boutons Précédents/Suivants d'une recherche paginée"""
+    state_key = f"_search_{key}"
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if offset > 0 and st.button("◀ Précédents", key=f"{state_key}_prev"):
+            st.session_state[f"{state_key}_offset"] = max(0, offset - SEARCH_PAGE_SIZE)
+            st.rerun()
+    with col_info:
+        st.caption(f"Résultats {offset + 1} et suivants")
+    with col_next:
+        if has_more and st.button("Suivants ▶", key=f"{state_key}_next"):
+            st.session_state[f"{state_key}_offset"] = offset + SEARCH_PAGE_SIZE
+            st.rerun()
 
+# Rafraîchissement du suivi des lots en file d'attente (secondes)
+QUEUE_POLL_SECONDS = 2
+
+def _queued_job_rows(job_id: int):
+    """Items terminés d'un lot, lus par incréments (seuls les nouveaux sont relus en base)"""
+    cache = st.session_state.setdefault("_queued_results", {}).setdefault(job_id, {"since": 0.0, "since_id": 0,
+                                                                                  "rows": {}})
+    results = get_batch_item_results(job_id, cache["since"], cache["since_id"])
+    if results:
+        # Analyses écrites par un worker (autre processus) : lectures en cache à refaire
+        bump_generation("analyses")
+    for item_id, filename, status, error, result_json, cached, cost_usd, input_mode, completed_at in results:
+        analysis = _parse_analysis_json(result_json) if result_json else None
+        cache["rows"][item_id] = {
+            "Fichier": filename,
+            "Candidat": (analysis or {}).get("nom_prenom", ""),
+            "Score": (analysis or {}).get("score_global"),
+            "Recommandation": (analysis or {}).get("recommandation", ""),
+            "Statut": "✅" if status == "done" else f"⏭️ {error or ''}" if status == "skipped" else f"❌ {error or ''}",
+            "Cache": bool(cached),
+        }
+        # Curseur strict : le dernier item lu n'est pas relu (ni la génération relancée) au tick suivant
+        cache["since"], cache["since_id"] = max((cache["since"], cache["since_id"]), (completed_at or 0.0, item_id))
+    return list(cache["rows"].values())
+
+def _render_queued_jobs():
+    """Progression et résultats des lots mis en file ; True quand tous sont terminés"""
+    jobs = [job for job in (get_batch_job(job_id) for job_id in st.session_state.get("_queued_jobs", [])) if job]
+    for job in reversed(jobs):
+        counts = job["counts"]
+        total = sum(counts.values())
+        finished = counts["done"] + counts["failed"] + counts["skipped"]
+        with st.container(border=True):
+            st.markdown(f"**Lot #{job['id']}** — {job['status']} — {finished}/{total} CV traité(s)"
+                        + (f", {counts['failed']} échec(s)" if counts["failed"] else ""))
+            st.progress(finished / total if total else 1.0)
+            rows = _queued_job_rows(job["id"])
+            if rows:
+                st.dataframe(rows, hide_index=True, width="stretch")
+            if job["status"] == "queued":
+                st.caption("⏳ En attente d'un worker (`python worker.py`)")
+    return all(job["status"] not in ("queued", "running") for job in jobs)
+
+@st.fragment(run_every=QUEUE_POLL_SECONDS)
+def _poll_queued_jobs():
+    if _render_queued_jobs():
+        # Tous les lots sont terminés : affichage statique, plus de sondage
+        st.rerun()
+
+def _queued_jobs_section():
+    job_ids = st.session_state.get("_queued_jobs")
+    if not job_ids:
+        return
+    st.markdown("---")
+    st.header("🗂️ Lots en arrière-plan")
+    if any((get_batch_job(job_id) or {}).get("status") in ("queued", "running") for job_id in job_ids):
+        _poll_queued_jobs()
+    else:
+        _render_queued_jobs()
+        if st.button("Masquer les lots terminés", key="clear_queued_jobs"):
+            st.session_state.pop("_queued_jobs", None)
+            st.session_state.pop("_queued_results", None)
+            st.rerun()
+
+def _open_offer(job_offer_id: str):
+    """Sélectionne l'offre et redirige vers l'analyse de CV"""
+    st.session_state._last_offer_id = job_offer_id  # pour pré-sélection future
+    st.session_state._force_selected_offer = job_offer_id
+    # Signaler une redirection vers Analyse de CV au prochain cycle
+    st.session_state.navigate_to_analysis = True
+    st.rerun()
+
+def _create_offer(title: str, content: str):
+    new_id = save_job_offer(title, content)
+    remember_job_offer(new_id, content)
+    st.toast("Offre ajoutée !", icon="✅")
+    _open_offer(new_id)
+
+@st.cache_resource
+def _init_database():
+    # Migrations du schéma : une seule fois par processus, pas à chaque rerun
+    init_db()
+    return True
 
 def main():
     """Application Streamlit — version Gemini 2.5 Flash-Lite"""
-    init_db()
+    _init_database()
 
     # Navigation persistante + redirection programmée avant création du widget
     if "navigate_to_analysis" in st.session_state:
@@ -305,7 +408,7 @@ def main():
         st.session_state["nav_page"] = "Analyse de CV"
     page = st.sidebar.radio(
         "Navigation",
-        ["Analyse de CV", "Gestion des offres", "Historique des analyses"],
+        ["Analyse de CV", "Gestion des offres", "Historique des analyses", "Télémétrie"],
         key="nav_page"
     )
 
@@ -325,6 +428,61 @@ def main():
             st.markdown("1. Choisissez une offre d'emploi existante (onglet « Gestion des offres » pour en créer)")
             st.markdown("2. Uploadez un ou plusieurs CV (PDF)")
             st.markdown("3. Cliquez sur 'Analyser'")
+            st.slider(
+                "Analyses simultanées",
+                min_value=1, max_value=16, value=DEFAULT_MAX_IN_FLIGHT,
+                key="max_in_flight",
+                help="Nombre maximal d'appels Gemini en parallèle pendant un lot",
+            )
+            st.checkbox(
+                "Forcer une nouvelle analyse",
+                key="force_reanalysis",
+                help="Ignore le cache : les CV déjà analysés pour cette offre sont renvoyés à Gemini",
+            )
+            st.checkbox(
+                "Extraction locale du texte",
+                value=True,
+                key="prefer_text",
+                help="Envoie le texte extrait du PDF plutôt que le PDF (moins de tokens). "
+                     "Les CV scannés ou sans texte exploitable sont envoyés en PDF.",
+            )
+            st.checkbox(
+                "Détecter les doublons",
+                value=True,
+                key="dedupe",
+                help="Un CV quasi identique à un CV déjà analysé pour cette offre (même lot ou historique) "
+                     "reprend son analyse au lieu d'un nouvel appel Gemini.",
+            )
+            st.checkbox(
+                "Analyse en arrière-plan",
+                key="use_queue",
+                help="Met le lot en file d'attente : il est traité par les workers (`python worker.py`), "
+                     "même si l'onglet est fermé. La progression s'affiche ci-dessous.",
+            )
+            with st.expander("🔎 Pré-sélection locale"):
+                st.checkbox(
+                    "Pré-sélectionner avant Gemini",
+                    key="prescreen",
+                    help="Classe le lot en local (BM25 face à l'offre + mots-clés obligatoires) "
+                         "et n'envoie à Gemini que les meilleurs CV.",
+                )
+                st.text_area("Mots-clés obligatoires (séparés par des virgules)", key="prescreen_keywords", height=68)
+                st.number_input("Garder les N meilleurs (0 : pas de limite)", min_value=0, value=0, step=10,
+                                key="prescreen_top_k")
+                st.slider("Score local minimal", min_value=0, max_value=100, value=0, key="prescreen_min_score")
+            st.checkbox(
+                "Grouper les CV courts",
+                key="pack_cvs",
+                help="Note plusieurs CV courts (texte extrait) dans une même requête Gemini. "
+                     "Un groupe dont la réponse est incomplète est scindé puis relancé automatiquement.",
+            )
+            st.checkbox(
+                "Affichage progressif",
+                value=True,
+                key="stream_results",
+                help="Reçoit les réponses Gemini en streaming : nom et scores s'affichent dès leur arrivée, "
+                     "le détail se complète ensuite. L'analyse n'est enregistrée qu'une fois complète.",
+            )
 
         col_left, col_right = st.columns([1, 1])
 
@@ -333,9 +491,8 @@ def main():
 
             job_offers = get_all_job_offers()  # [(id, title, created_at, nb_analyses), ...]
             if job_offers:
-                job_offers_sorted = sort_job_offers_newest_first(job_offers)
                 label_map = {
-                    f"{row[1]} — {row[2]}  ({row[0][:8]}…)": row[0] for row in job_offers_sorted
+                    f"{row[1]} — {row[2]}  ({row[0][:8]}…)": row[0] for row in job_offers
                 }
                 # Pré-sélection si une offre vient d'être créée (basé sur l'ID forcé)
                 forced_id = None
@@ -412,6 +569,40 @@ def main():
 
             job_offer_id = selected_job_offer_id
             st.info(f"🧾 Offre utilisée : {job_title} ({job_offer_id[:8]}…)")
+            files = [(uploaded_file.name, uploaded_file.read()) for uploaded_file in uploaded_files]
+            extractions = {}   # textes déjà extraits par la pré-sélection
+            if st.session_state.get("prescreen", False) and len(files) > 1:
+                keywords = parse_keywords(st.session_state.get("prescreen_keywords", ""))
+                top_k = st.session_state.get("prescreen_top_k", 0) or None
+                min_score = st.session_state.get("prescreen_min_score", 0) or None
+                with st.spinner("🔎 Pré-sélection locale des CV…"):
+                    screening = prescreen_batch(files, job_offer_text, keywords, top_k, min_score)
+                save_prescreen_scores(job_offer_id, screening,
+                                      {"keywords": keywords, "top_k": top_k, "min_score": min_score})
+                kept, skipped, unscored = summarize(screening)
+                st.info(f"🔎 Pré-sélection : {kept} CV retenu(s) pour Gemini, {skipped} écarté(s)"
+                        + (f" — {unscored} non noté(s) (texte illisible), retenus d'office" if unscored else ""))
+                with st.expander("Détail de la pré-sélection"):
+                    st.dataframe(
+                        [{"Rang": r["rank"], "Fichier": r["filename"], "Score local": r["score"],
+                          "Mots-clés": f"{r['keyword_hits']}/{r['keywords_total']}" if r["keyword_hits"] is not None else "",
+                          "Retenu": r["selected"], "Motif": r["reason"]}
+                         for r in sorted(screening, key=lambda r: (r["rank"] is None, r["rank"] or 0))],
+                        hide_index=True, width="stretch",
+                    )
+                files = [files[r["index"]] for r in screening if r["selected"]]
+                extractions = extractions_by_sha(screening)
+                if not files:
+                    st.warning("⚠️ Aucun CV ne passe la pré-sélection : assouplissez les critères.")
+                    return
+            if st.session_state.get("use_queue", False):
+                queued_id = enqueue_batch_job(job_offer_id, files, {
+                    "prefer_text": st.session_state.get("prefer_text", True),
+                    "force": st.session_state.get("force_reanalysis", False),
+                    "dedupe": st.session_state.get("dedupe", True),
+                })
+                st.session_state.setdefault("_queued_jobs", []).append(queued_id)
+                st.rerun()
             st.markdown("---")
             client = initialize_gemini()
             st.markdown("---")
@@ -420,39 +611,122 @@ def main():
             progress_bar = st.progress(0)
             status_text = st.empty()
             analyses = []
-            multi_files = len(uploaded_files) > 1
-            analyses_container = st.container()
-            for i, uploaded_file in enumerate(uploaded_files, start=1):
-                status_text.text(f"Analyse en cours : {uploaded_file.name} ({i}/{len(uploaded_files)})")
-                progress_bar.progress((i - 1) / len(uploaded_files))
-                pdf_bytes = uploaded_file.read()
-                result = analyze_cv_with_gemini(pdf_bytes, job_offer_text, client)
-                if result:
-                    analysis_text = result["content"]
-                    tokens_used = result["tokens"]
-                    in_tok = tokens_used.get("prompt") or 0
-                    out_tok = tokens_used.get("completion") or 0
-                    total_tok = tokens_used.get("total") or (in_tok + out_tok)
-                    cost_cv = (in_tok / 1_000_000) * PRICE_INPUT_PER_M + (out_tok / 1_000_000) * PRICE_OUTPUT_PER_M
-                    if not multi_files:
-                        st.success(f"✅ Analyse terminée pour {uploaded_file.name}")
-                    with analyses_container:
-                        parsed = display_analysis_conditional(analysis_text, uploaded_file.name, multi_files)
-                    if parsed:
-                        insert_analysis(uploaded_file.name, parsed, job_offer_id)
-                    analyses.append({
-                        "filename": uploaded_file.name,
-                        "analysis": parsed if parsed else analysis_text,
-                        "tokens": {"prompt": in_tok, "completion": out_tok, "total": total_tok},
-                        "cost_usd": cost_cv
-                    })
+            multi_files = len(files) > 1
+            notices_container = st.container()
+            results_area = st.container()
+            table_slot = results_area.empty()   # aperçu pendant l'analyse
+            total_files = len(files)
+            done = 0
+            status_text.text(f"Analyse en cours : 0/{total_files}")
+            max_in_flight = st.session_state.get("max_in_flight", DEFAULT_MAX_IN_FLIGHT)
+            force = st.session_state.get("force_reanalysis", False)
+            prefer_text = st.session_state.get("prefer_text", True)
+            pack = st.session_state.get("pack_cvs", False)
+            dedupe = st.session_state.get("dedupe", True)
+            stream = st.session_state.get("stream_results", True)
+            # Une ligne par CV, conservée en session : le tableau survit aux reruns
+            rows = [{"filename": name, "analysis": None, "raw": None, "status": "pending", "cached": False,
+                     "duplicate": False} for name, _ in files]
+            run = st.session_state.get("_last_results", {}).get("run", 0) + 1
+            st.session_state._last_results = {"run": run, "rows": rows, "job_title": job_title}
+            last_refresh = 0.0
+            duplicates = 0
+            cache_hits = 0
+            text_inputs = 0
+            packed_inputs = 0
+            write_tickets = []
+            for event in analyze_batch(files, job_offer_text, client, max_in_flight=max_in_flight,
+                                       job_offer_id=job_offer_id, force=force, prefer_text=prefer_text,
+                                       pack=pack, dedupe=dedupe, stream=stream, extractions=extractions):
+                filename = event["filename"]
+                if event["type"] == "partial":
+                    if multi_files:
+                        rows[event["index"]]["partial"] = event["fields"]
+                    else:
+                        with table_slot.container():
+                            _render_partial_analysis(event["fields"], event["pending"], filename)
+                elif event["type"] == "notice":
+                    with notices_container:
+                        if event["level"] == "warning":
+                            st.warning(f"{filename} : {event['message']}")
+                        else:
+                            st.error(f"{filename} : {event['message']}")
+                    continue
                 else:
-                    st.error(f"❌ Échec de l'analyse pour {uploaded_file.name}")
+                    done += 1
+                    progress_bar.progress(done / total_files)
+                    status_text.text(f"Analyse en cours : {filename} terminé ({done}/{total_files})")
+                    result = event["result"]
+                    row = rows[event["index"]]
+                    row.pop("partial", None)
+                    if result:
+                        analysis_text = result["content"]
+                        tokens_used = result["tokens"]
+                        in_tok = tokens_used.get("prompt") or 0
+                        out_tok = tokens_used.get("completion") or 0
+                        total_tok = tokens_used.get("total") or (in_tok + out_tok)
+                        cached = result.get("cached", False)
+                        input_mode = result.get("input_mode")
+                        if input_mode == "text" and not cached:
+                            text_inputs += 1
+                        if result.get("packed"):
+                            packed_inputs += 1
+                        if result.get("duplicate"):
+                            duplicates += 1
+                        # Un résultat en cache n'est pas refacturé
+                        cost_cv = 0.0 if cached else estimate_cost(tokens_used)
+                        if cached:
+                            cache_hits += 1
+                        if not multi_files:
+                            st.success(f"✅ Analyse terminée pour {filename}" + (" (résultat en cache)" if cached else ""))
+                        parsed = _parse_analysis_json(analysis_text)
+                        row.update(analysis=parsed, raw=analysis_text, status="ok" if parsed else "invalid",
+                                   cached=cached, duplicate=bool(result.get("duplicate")))
+                        # L'analyse en cache est déjà enregistrée pour cette offre : pas de doublon
+                        if parsed and not cached:
+                            write_tickets.append(insert_analysis(filename, parsed, job_offer_id, input_mode,
+                                                                 result.get("pdf_sha256")))
+                        analyses.append({
+                            "index": event["index"],
+                            "filename": filename,
+                            "analysis": parsed if parsed else analysis_text,
+                            "tokens": {"prompt": in_tok, "completion": out_tok, "cached": tokens_used.get("cached") or 0, "total": total_tok},
+                            "cost_usd": cost_cv,
+                            "cached": cached,
+                            "input_mode": input_mode,
+                        })
+                    else:
+                        row["status"] = "error"
+                # Tableau compact redessiné au plus toutes les RESULTS_TABLE_REFRESH_SECONDS
+                if multi_files and time.monotonic() - last_refresh >= RESULTS_TABLE_REFRESH_SECONDS:
+                    table_slot.dataframe(_result_table_rows(rows), hide_index=True, width="stretch")
+                    last_refresh = time.monotonic()
+
+            # Tableau final interactif (tri, sélection, détail) à la place de l'aperçu
+            table_slot.empty()
+            with results_area:
+                _results_view()
 
+            # Export dans l'ordre d'upload, quel que soit l'ordre de complétion
+            analyses.sort(key=lambda a: a["index"])
+            for a in analyses:
+                del a["index"]
             progress_bar.progress(1.0)
+            # Les analyses sont écrites par lots en arrière-plan : on attend leur validation
+            status_text.text("💾 Enregistrement des analyses…")
+            if not wait_for_writes(write_tickets, timeout=30):
+                st.warning("⚠️ Certaines analyses n'ont pas pu être enregistrées dans la base de données.")
             status_text.text("✅ Analyse terminée !")
             if len(analyses) > 0:
-                st.success(f"🎉 {len(analyses)}/{len(uploaded_files)} CV(s) analysé(s) avec succès")
+                st.success(f"🎉 {len(analyses)}/{total_files} CV(s) analysé(s) avec succès")
+                if cache_hits:
+                    st.info(f"♻️ {cache_hits} résultat(s) servi(s) depuis le cache (aucun appel Gemini)")
+                if text_inputs:
+                    st.info(f"📝 {text_inputs} CV envoyé(s) sous forme de texte extrait (les autres en PDF)")
+                if packed_inputs:
+                    st.info(f"📦 {packed_inputs} CV noté(s) dans des requêtes groupées")
+                if duplicates:
+                    st.info(f"👥 {duplicates} quasi-doublon(s) : analyse existante reprise sans appel Gemini")
                 results_json = {
                     "metadata": {
                         "date": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
@@ -473,8 +747,12 @@ def main():
                     mime="application/json",
                     width="stretch"
                 )
+        elif st.session_state.get("_last_results"):
+            st.markdown("---")
+            st.header(f"📊 Résultats de la dernière analyse — {st.session_state._last_results['job_title']}")
+            _results_view()
 
-                          
+        _queued_jobs_section()
 
     elif page == "Gestion des offres":
         st.title("📋 Gestion des offres d'emploi")
@@ -492,29 +770,47 @@ def main():
             if not title_clean or not content_clean:
                 st.error("Veuillez renseigner le titre et le contenu de l'offre.")
             else:
-                # Vérifier doublon (même titre OU même couple titre+contenu)
-                existing = get_all_job_offers() or []
-                duplicate = None
-                for off in existing:
-                    # off: (id, title, content, created_at, ...?)
-                    same_title = len(off) > 1 and off[1].strip().lower() == title_clean.lower()
-                    same_content = len(off) > 2 and off[2].strip() == content_clean
-                    if same_title and (same_content or True):  # si titre identique on considère doublon UX
-                        duplicate = off
-                        break
-                if duplicate:
-                    st.warning(f"⚠️ Cette offre existe déjà (ID: {duplicate[0][:8]}…). Pas de création.")
-                    st.info("Astuce : modifiez légèrement le titre si vous souhaitez vraiment en créer une nouvelle.")
+                # Doublons : recherches indexées (hash du contenu, titre normalisé) puis empreintes
+                duplicate = find_job_offer_duplicate(title_clean, content_clean)
+                similar = None if duplicate else find_similar_job_offer(content_clean)
+                if duplicate and duplicate[2] == "contenu":
+                    # Offre republiée à l'identique : l'existante est réutilisée (analyses et cache)
+                    st.toast(f"Offre déjà enregistrée : « {duplicate[1]} » réutilisée", icon="♻️")
+                    _open_offer(duplicate[0])
+                elif duplicate or similar:
+                    match = ({"id": duplicate[0], "title": duplicate[1], "motif": "même titre"} if duplicate else
+                             {"id": similar["id"], "title": similar["title"],
+                              "motif": f"texte similaire à {similar['similarite']:.0%}"})
+                    st.session_state._pending_offer = {"title": title_clean, "content": content_clean, "match": match}
                 else:
-                    new_id = save_job_offer(title_clean, content_clean)
-                    st.success(f"✅ Offre créée (ID: {new_id[:8]}…). Redirection vers l'analyse…")
-                    st.toast("Offre ajoutée !", icon="✅")
-                    # Préparer redirection
-                    st.session_state._last_offer_id = new_id  # pour pré-sélection future
-                    st.session_state._force_selected_offer = new_id
-                    # Signaler une redirection vers Analyse de CV au prochain cycle
-                    st.session_state.navigate_to_analysis = True
-                    st.rerun()
+                    _create_offer(title_clean, content_clean)
+
+        pending = st.session_state.get("_pending_offer")
+        if pending:
+            match = pending["match"]
+            st.warning(f"⚠️ Une offre proche existe déjà : « {match['title']} » (ID: {match['id'][:8]}…) — {match['motif']}.")
+            st.caption("Réutiliser l'offre existante conserve ses analyses et son cache de résultats.")
+            col_a, col_b, col_c = st.columns(3)
+            if col_a.button("♻️ Utiliser l'offre existante", type="primary", key="pending_offer_reuse"):
+                del st.session_state._pending_offer
+                _open_offer(match["id"])
+            if col_b.button("➕ Créer quand même", key="pending_offer_create"):
+                del st.session_state._pending_offer
+                _create_offer(pending["title"], pending["content"])
+            if col_c.button("Annuler", key="pending_offer_cancel"):
+                del st.session_state._pending_offer
+                st.rerun()
+
+        search_query = st.text_input("🔎 Rechercher une offre", placeholder="Titre, mots du contenu…", key="offer_search").strip()
+        if search_query:
+            offset = _search_offset("offers", search_query)
+            results, has_more = search_job_offers(search_query, offset=offset)
+            if results:
+                for r in results:
+                    st.markdown(f"**{r[1]}** ({r[0][:8]}…) — {r[2]} — {r[3]} CV analysé(s)  \n{r[4]}")
+                _search_pager_buttons("offers", offset, has_more)
+            else:
+                st.info("Aucune offre ne correspond à cette recherche.")
 
         tab1, tab2 = st.tabs(["📊 Vue d'ensemble", "🔍 Détails par offre"])
 
@@ -522,7 +818,6 @@ def main():
             st.subheader("📈 Statistiques des offres d'emploi")
             job_offers = get_all_job_offers()
             if job_offers:
-                job_offers = sort_job_offers_newest_first(job_offers)  # <-- ajout
                 import pandas as pd
                 df = pd.DataFrame(job_offers, columns=["ID", "Titre", "Date de création", "Nb CV analysés"])
                 df["ID court"] = df["ID"].apply(lambda x: x[:8] + "...")
@@ -546,7 +841,6 @@ def main():
             st.subheader("🔍 Analyses par offre d'emploi")
             job_offers = get_all_job_offers()
             if job_offers:
-                job_offers = sort_job_offers_newest_first(job_offers)  # <-- ajout
                 job_titles = {f"{job[1]} ({job[0][:8]}...)": job[0] for job in job_offers}
                 selected_job_title = st.selectbox("Choisissez une offre d'emploi:", options=list(job_titles.keys()))
                 if selected_job_title:
@@ -555,9 +849,34 @@ def main():
                     if stats and stats[0] > 0:
                         col1, col2, col3, col4 = st.columns(4)
                         with col1: st.metric("CV analysés", int(stats[0]))
-                        with col2: st.metric("Score moyen", f"{stats[1]:.1f}/100")
+                        with col2: st.metric("Score moyen", f"{stats[1]:.1f}/100" if stats[1] is not None else "N/A")
                         with col3: st.metric("Meilleur score", f"{stats[2]}/100")
                         with col4: st.metric("Score minimum", f"{stats[3]}/100")
+                        st.write("**Répartition des scores globaux**")
+                        histogram = get_job_offer_score_histogram(job_offer_id)
+                        st.bar_chart(
+                            {"CV": {f"{b * 10}-{b * 10 + 9 if b < 9 else 100}": n for b, n in enumerate(histogram)}},
+                            height=200,
+                        )
+                        missing = get_top_skills(job_offer_id, kind="manquante", limit=10)
+                        if missing:
+                            st.write("**Compétences les plus souvent manquantes**")
+                            st.write(" · ".join(f"{label} ({nb})" for label, nb in missing))
+                        runs = get_prescreen_runs(job_offer_id)
+                        if runs:
+                            with st.expander("🔎 Pré-sélections locales (audit de la coupure)"):
+                                run_labels = {
+                                    f"{created_at} — {kept}/{total} retenus — {json.loads(params or '{}')}": run_id
+                                    for run_id, created_at, params, total, kept in runs
+                                }
+                                run_id = run_labels[st.selectbox("Passage", options=list(run_labels.keys()))]
+                                st.dataframe(
+                                    [{"Rang": r[5], "Fichier": r[0], "Score local": r[1], "BM25": r[2],
+                                      "Mots-clés": f"{r[3]}/{r[4]}" if r[3] is not None else "",
+                                      "Retenu": bool(r[6]), "Motif": r[7], "Score Gemini": r[8]}
+                                     for r in get_prescreen_scores(run_id)],
+                                    hide_index=True, width="stretch",
+                                )
                         st.markdown("---")
 
                         analyses = get_analyses_by_job_offer(job_offer_id)
@@ -584,45 +903,176 @@ def main():
     elif page == "Historique des analyses":
         st.title("📑 Historique des analyses (BDD)")
         st.markdown("---")
-        rows = get_all_analyses()
+        search_query = st.text_input("🔎 Rechercher un candidat", placeholder="Nom, commentaire, compétence…", key="history_search").strip()
+        if search_query:
+            offset = _search_offset("analyses", search_query)
+            results, has_more = search_analyses(search_query, offset=offset)
+            if results:
+                for r in results:
+                    st.markdown(f"**{r[1]}** — {r[2]}/100 — {r[3] or 'Non spécifiée'} — {r[5]}  \n{r[6]}")
+                _search_pager_buttons("analyses", offset, has_more)
+            else:
+                st.info("Aucun résultat pour cette recherche.")
+            st.markdown("---")
+        job_offers = get_all_job_offers()
+        col_f1, col_f2 = st.columns(2)
+        with col_f1:
+            period_label = st.selectbox("Période :", list(HISTORY_PERIODS.keys()))
+            job_filter_map = {"Toutes les offres": None}
+            job_filter_map.update({f"{job[1]} ({job[0][:8]}...)": job[0] for job in job_offers})
+            selected_filter = st.selectbox("Filtrer par offre d'emploi:", list(job_filter_map.keys()))
+        with col_f2:
+            score_range = st.slider("Score global :", min_value=0, max_value=100, value=(0, 100))
+            recommandation = st.selectbox("Recommandation :", RECOMMANDATION_FILTERS)
+        filters = {
+            "job_offer_id": job_filter_map[selected_filter],
+            "score_min": score_range[0] if score_range[0] > 0 else None,
+            "score_max": score_range[1] if score_range[1] < 100 else None,
+            "recommandation": None if recommandation == RECOMMANDATION_FILTERS[0] else recommandation,
+            "since_days": HISTORY_PERIODS[period_label],
+        }
+
+        # Pages chargées à la demande ; un changement de filtre ou une nouvelle analyse enregistrée
+        # (génération de la table analyses) repart de la première page
+        history_key = (filters, data_generation("analyses"))
+        if st.session_state.get("_history_filters") != history_key:
+            rows, cursor = get_analyses_page(**filters)
+            st.session_state._history_filters = history_key
+            st.session_state._history_rows = rows
+            st.session_state._history_cursor = cursor
+        rows = st.session_state._history_rows
+
         if rows:
-            job_offers = get_all_job_offers()
-            if job_offers and len(job_offers) > 1:
-                job_filter_options = ["Toutes les offres"] + [f"{job[1]} ({job[0][:8]}...)" for job in job_offers]
-                selected_filter = st.selectbox("Filtrer par offre d'emploi:", job_filter_options)
-                if selected_filter != "Toutes les offres":
-                    selected_job_id = None
-                    for job in job_offers:
-                        if f"{job[1]} ({job[0][:8]}...)" == selected_filter:
-                            selected_job_id = job[0]
-                            break
-                    rows = [r for r in rows if r[9] == selected_job_id]
+            total, avg_score, best_score = get_analyses_summary(**filters)
+            col1, col2, col3 = st.columns(3)
+            with col1: st.metric("Analyses totales", total)
+            if avg_score is not None:
+                with col2: st.metric("Score moyen", f"{avg_score:.1f}/100")
+                with col3: st.metric("Meilleur score", f"{best_score}/100")
+            st.dataframe(
+                [{
+                    "Nom/Prénom": r[1],
+                    "Score global /100": r[2],
+                    "Technique /40": r[3],
+                    "Expérience /30": r[4],
+                    "Formation /15": r[5],
+                    "Soft skills /15": r[6],
+                    "Recommandation": r[11] or "",
+                    "Offre d'emploi": r[9] if r[9] else "Non spécifiée",
+                    "Commentaire": (r[7][:100] + "...") if len(str(r[7])) > 100 else r[7],
+                    "Date": r[8]
+                } for r in rows],
+                width="stretch"
+            )
+            st.caption(f"{len(rows)} analyse(s) affichée(s) sur {total}")
+            if st.session_state._history_cursor and st.button("⬇️ Charger plus"):
+                more, cursor = get_analyses_page(after=st.session_state._history_cursor, **filters)
+                st.session_state._history_rows = rows + more
+                st.session_state._history_cursor = cursor
+                st.rerun()
+        elif filters == {"job_offer_id": None, "score_min": None, "score_max": None, "recommandation": None, "since_days": None}:
+            st.info("Aucune analyse enregistrée dans la base de données.")
+        else:
+            st.info("Aucune analyse trouvée pour le filtre sélectionné.")
+        _history_export_section(filters["job_offer_id"])
 
-            if rows:
+        st.markdown("---")
+        st.subheader("🧩 Recherche par compétence (toutes offres)")
+        col_s1, col_s2, col_s3 = st.columns([2, 1, 1])
+        with col_s1:
+            skill_query = st.text_input("Compétence", placeholder="Ex: Kubernetes")
+        with col_s2:
+            skill_kind_label = st.selectbox("Type", list(SKILL_KIND_LABELS.keys()))
+        with col_s3:
+            skill_min_score = st.number_input("Score global minimum", min_value=0, max_value=100, value=0)
+        if skill_query.strip():
+            candidates = find_candidates_by_skill(
+                skill_query,
+                kind=SKILL_KIND_LABELS[skill_kind_label],
+                min_score=skill_min_score or None,
+            )
+            if candidates:
                 st.dataframe(
                     [{
-                        "Nom/Prénom": r[0],
-                        "Score global /100": r[1],
-                        "Technique /40": r[2],
-                        "Expérience /30": r[3],
-                        "Formation /15": r[4],
-                        "Soft skills /15": r[5],
-                        "Offre d'emploi": r[8] if r[8] else "Non spécifiée",
-                        "Commentaire": (r[6][:100] + "...") if len(str(r[6])) > 100 else r[6],
-                        "Date": r[7]
-                    } for r in rows],
+                        "Nom/Prénom": c[1],
+                        "Score global /100": c[2],
+                        "Offre d'emploi": c[4] if c[4] else "Non spécifiée",
+                        "Fichier": c[6],
+                        "Date": c[5],
+                    } for c in candidates],
                     width="stretch"
                 )
-                col1, col2, col3 = st.columns(3)
-                scores = [r[1] for r in rows if r[1] is not None]
-                if scores:
-                    with col1: st.metric("Analyses totales", len(rows))
-                    with col2: st.metric("Score moyen", f"{sum(scores)/len(scores):.1f}/100")
-                    with col3: st.metric("Meilleur score", f"{max(scores)}/100")
             else:
-                st.info("Aucune analyse trouvée pour le filtre sélectionné.")
-        else:
-            st.info("Aucune analyse enregistrée dans la base de données.")
+                st.info("Aucun candidat trouvé pour cette compétence.")
+
+    elif page == "Télémétrie":
+        st.title("📡 Télémétrie des appels Gemini")
+        st.markdown("---")
+        job_offers = get_all_job_offers()
+        col_f1, col_f2, col_f3 = st.columns([1, 2, 1])
+        with col_f1:
+            period_label = st.selectbox("Période :", list(HISTORY_PERIODS.keys()), index=2, key="telemetry_period")
+        with col_f2:
+            offer_map = {"Toutes les offres": None}
+            offer_map.update({f"{job[1]} ({job[0][:8]}...)": job[0] for job in job_offers})
+            offer_label = st.selectbox("Offre d'emploi :", list(offer_map.keys()), key="telemetry_offer")
+        with col_f3:
+            bucket_label = st.selectbox("Granularité :", ["Jour", "Heure"], key="telemetry_bucket")
+        since_days, job_offer_id = HISTORY_PERIODS[period_label], offer_map[offer_label]
+
+        summary = get_telemetry_summary(since_days, job_offer_id)
+        if not summary["calls"] and not summary["served_without_call"]:
+            st.info("Aucun appel enregistré sur cette période.")
+            return
+        col1, col2, col3, col4 = st.columns(4)
+        with col1: st.metric("Appels au modèle", summary["calls"])
+        with col2: st.metric("Latence p50", f"{summary['p50_ms'] / 1000:.2f} s" if summary["p50_ms"] is not None else "N/A")
+        with col3: st.metric("Latence p95", f"{summary['p95_ms'] / 1000:.2f} s" if summary["p95_ms"] is not None else "N/A")
+        with col4: st.metric("Coût estimé", f"${summary['cost_usd']:.4f}")
+        col5, col6, col7, col8 = st.columns(4)
+        with col5: st.metric("CV traités", summary["cvs"], help="CV servis par le cache ou un doublon inclus")
+        with col6: st.metric("Sans appel (cache/doublon)", summary["served_without_call"])
+        with col7: st.metric("Erreurs", summary["errors"], help="Échecs d'appel, JSON invalide ou lot groupé incomplet")
+        with col8: st.metric("Nouvelles tentatives", summary["retries"],
+                             help=f"Attente cumulée (quota et limiteur) : {summary['wait_s']:.0f} s")
+        if summary["total_tokens"]:
+            first, last = (datetime.fromtimestamp(summary[k]) for k in ("first_ts", "last_ts"))
+            st.caption(f"{summary['total_tokens']:,} tokens, dont {summary['cached_tokens']:,} servis par le cache "
+                       f"de contexte — du {first:%d/%m %H:%M} au {last:%d/%m %H:%M}")
+
+        if summary["first_chunk_p50_ms"] is not None:
+            st.caption(f"⚡ Réponses en streaming : premier fragment reçu en {summary['first_chunk_p50_ms'] / 1000:.2f} s (médiane)")
+        if summary["parse_failure_rate"] is not None:
+            st.caption(f"🧩 Lecture des réponses : {summary['parse_repaired']} réparée(s) localement, "
+                       f"{summary['parse_fixed']} corrigée(s) par un appel dédié, {summary['parse_failed']} illisible(s) "
+                       f"({summary['parse_failure_rate']:.1%} d'échec)")
+
+        series = get_telemetry_timeseries(since_days, job_offer_id, "hour" if bucket_label == "Heure" else "day")
+        if series:
+            st.write("**Débit (CV traités par période)**")
+            st.bar_chart({"CV": {r[0]: r[2] for r in series}, "Appels": {r[0]: r[1] for r in series}},
+                         height=220, stack=False)
+            st.write("**Latence des appels (s)**")
+            st.line_chart({"p50": {r[0]: (r[4] or 0) / 1000 for r in series},
+                           "p95": {r[0]: (r[5] or 0) / 1000 for r in series}}, height=220)
+            st.write("**Coût estimé par période ($)**")
+            st.bar_chart({"Coût": {r[0]: r[7] for r in series}}, height=180)
+
+        if job_offer_id is None:
+            costs = get_cost_by_job_offer(since_days)
+            if costs:
+                st.write("**Coût par offre**")
+                st.dataframe(
+                    [{
+                        "Offre": f"{c[1]} ({c[0][:8]}...)" if c[0] else "Sans offre",
+                        "Appels": c[2],
+                        "CV": c[3],
+                        "Tokens": c[4],
+                        "Coût ($)": round(c[5], 4),
+                        "Coût / CV ($)": round(c[5] / c[3], 5) if c[3] else None,
+                    } for c in costs],
+                    width="stretch"
+                )
 
 if __name__ == "__main__":
     main()
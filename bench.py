@@ -0,0 +1,416 @@
+"""Mesures de performance, hors ligne : client Gemini simulé et bases synthétiques.
+
+    python bench.py pipeline [--cvs 200] [--concurrency 4] [--latency 0.2 1.0] [--rate-limit 0.02] [--malformed 0.02]
+    python bench.py db [--sizes 10000,100000,1000000] [--repeat 5]
+    python bench.py all
+
+Le rapport est écrit en JSON (--output) ; avec --baseline, les mesures sont comparées à
+un rapport précédent et les régressions sont signalées (code de sortie 1).
+Les bases synthétiques sont conservées dans --data-dir et réutilisées d'une exécution
+à l'autre. La base de l'application (db.DB_PATH) n'est jamais modifiée.
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import itertools
+import statistics
+import tempfile
+from datetime import datetime, timedelta
+import db
+from db import (
+    init_db, save_job_offer, insert_analysis, wait_for_writes, get_analysis_writer, shutdown_analysis_writer,
+    close_connection,
+    _INSERT_ANALYSIS_SQL, _INSERT_MODEL_CALL_SQL, _analysis_row,
+)
+from analyzer import MODEL, analyze_batch, estimate_cost, _parse_analysis_json
+from fake_gemini import FakeGeminiClient
+
+# Tailles des bases synthétiques (nombre d'analyses)
+BENCH_DB_SIZES = (10_000, 100_000, 1_000_000)
+# Analyses insérées par transaction lors de la génération
+BENCH_INSERT_CHUNK = 10_000
+# Une mesure est une régression si elle se dégrade de plus de ce facteur par rapport à la référence
+BENCH_REGRESSION_RATIO = 1.25
+# ... et d'au moins cette durée (les requêtes sous la milliseconde sont dominées par le bruit)
+BENCH_MIN_DELTA_MS = 1.0
+BENCH_DATA_DIR = os.path.join(tempfile.gettempdir(), "cv_bench")
+# Version du contenu des bases synthétiques : à incrémenter quand leur génération change
+BENCH_DB_VERSION = 2
+
+_pipeline_runs = itertools.count(1)
+
+_FIRST_NAMES = ("Alice", "Bruno", "Camille", "David", "Emma", "Fatou", "Gabriel", "Hugo", "Inès", "Jules",
+                "Karim", "Léa", "Mathis", "Nora", "Oscar", "Paul", "Quentin", "Rose", "Sofia", "Théo")
+_LAST_NAMES = ("Martin", "Bernard", "Dubois", "Thomas", "Robert", "Richard", "Petit", "Durand", "Leroy",
+               "Moreau", "Simon", "Laurent", "Lefebvre", "Michel", "Garcia", "David", "Bertrand", "Roux")
+_SKILLS = ("Python", "SQL", "Java", "JavaScript", "TypeScript", "React", "Django", "Flask", "Docker",
+           "Kubernetes", "AWS", "Azure", "GCP", "Terraform", "Linux", "Git", "Spark", "Pandas", "Airflow",
+           "PostgreSQL", "MongoDB", "Redis", "Kafka", "Scrum", "Power BI", "Excel", "C#", ".NET", "Go", "Rust")
+_WORDS = ("projet", "équipe", "client", "données", "migration", "plateforme", "pilotage", "analyse",
+          "développement", "architecture", "qualité", "déploiement", "support", "formation", "API",
+          "automatisation", "reporting", "sécurité", "performance", "intégration", "produit", "métier")
+_RECOMMANDATIONS = ((70, "Recommandé"), (50, "À considérer"), (0, "Non recommandé"))
+
+BENCH_OFFER_TEXT = (
+    "Développeur Python confirmé (H/F). Missions : conception d'API Django et Flask, "
+    "traitement de données avec Pandas et Spark, déploiement Docker et Kubernetes sur AWS. "
+    "Compétences : Python, SQL, PostgreSQL, Git, Linux, Airflow. Anglais technique apprécié."
+)
+
+
+def _synthetic_pdf(lines):
+    """PDF d'une page (Helvetica) contenant les lignes de texte données"""
+    def escape(text):
+        return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    stream = "BT /F1 10 Tf 40 800 Td 13 TL " + " ".join(f"({escape(line)}) '" for line in lines) + " ET"
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents 4 0 R "
+        "/Resources << /Font << /F1 5 0 R >> >> >>",
+        f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+def _synthetic_cv_lines(rng, index):
+    name = f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)} {index}"
+    lines = [name, f"Développeur - {rng.randint(1, 15)} ans d'expérience",
+             "Compétences : " + ", ".join(rng.sample(_SKILLS, rng.randint(4, 9)))]
+    for year in range(2024, 2024 - rng.randint(3, 6), -1):
+        lines.append(f"{year} : " + " ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 14))))
+    lines.append("Formation : Master informatique, " + " ".join(rng.choice(_WORDS) for _ in range(6)))
+    return lines
+
+def _synthetic_analysis(rng):
+    technique, experience = rng.randint(0, 40), rng.randint(0, 30)
+    formation, soft = rng.randint(0, 15), rng.randint(0, 15)
+    score = technique + experience + formation + soft
+    return {
+        "nom_prenom": f"{rng.choice(_FIRST_NAMES)} {rng.choice(_LAST_NAMES)}",
+        "score_technique": technique,
+        "score_experience": experience,
+        "score_formation": formation,
+        "score_soft_skills": soft,
+        "score_global": score,
+        "points_forts": [rng.choice(_WORDS)],
+        "points_faibles": [],
+        "competences_matchees": rng.sample(_SKILLS, rng.randint(2, 6)),
+        "competences_manquantes": rng.sample(_SKILLS, rng.randint(0, 3)),
+        "competences_deduites": rng.sample(_SKILLS, rng.randint(0, 2)),
+        "experience_pertinente": " ".join(rng.choice(_WORDS) for _ in range(12)),
+        "recommandation": next(label for threshold, label in _RECOMMANDATIONS if score >= threshold),
+        "commentaires": " ".join(rng.choice(_WORDS) for _ in range(rng.randint(15, 40))),
+        "pages_analysees": 1,
+        "methode_analyse": "GEMINI ",
+    }
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+# ---------------------------------------------------------------------------
+# Débit du pipeline d'analyse (analyze_batch + écrivain groupé)
+# ---------------------------------------------------------------------------
+
+def bench_pipeline(cvs=200, concurrency=4, latency=(0.2, 1.0), rate_limit_rate=0.0, malformed_rate=0.0,
+                   pack=False, max_retries=4, seed=42, data_dir=BENCH_DATA_DIR):
+    """Lot de `cvs` CV synthétiques analysés de bout en bout sur une base neuve.
+    Retourne les paramètres et les mesures (débit, temps jusqu'au premier résultat,
+    issues, statistiques du client simulé).
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"pipeline-{os.getpid()}-{next(_pipeline_runs)}.db")
+    db.DB_PATH = path
+    init_db()
+    job_offer_id = save_job_offer("Offre de test (bench)", BENCH_OFFER_TEXT)
+    files = [(f"cv{i:05d}.pdf", _synthetic_pdf(_synthetic_cv_lines(rng, i))) for i in range(cvs)]
+    client = FakeGeminiClient(latency=latency, rate_limit_rate=rate_limit_rate,
+                              malformed_rate=malformed_rate, seed=seed)
+
+    ok, failed, cost, tickets, completions = 0, 0, 0.0, [], []
+    started = time.perf_counter()
+    for event in analyze_batch(files, BENCH_OFFER_TEXT, client, max_in_flight=concurrency,
+                               max_retries=max_retries, job_offer_id=job_offer_id, pack=pack):
+        if event["type"] != "result":
+            continue
+        completions.append(time.perf_counter() - started)
+        result = event["result"]
+        parsed = _parse_analysis_json(result["content"]) if result else None
+        if parsed is None:
+            failed += 1
+            continue
+        ok += 1
+        cost += estimate_cost(result["tokens"])
+        tickets.append(insert_analysis(event["filename"], parsed, job_offer_id,
+                                       result.get("input_mode"), result.get("pdf_sha256")))
+    wait_for_writes(tickets)
+    get_analysis_writer().flush()
+    elapsed = time.perf_counter() - started
+
+    telemetry = db.get_telemetry_summary(job_offer_id=job_offer_id)
+    close_connection()
+    shutdown_analysis_writer()   # ferme aussi la connexion de l'écrivain avant suppression
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    return {
+        "params": {"cvs": cvs, "concurrency": concurrency, "latency": list(latency), "rate_limit_rate": rate_limit_rate,
+                   "malformed_rate": malformed_rate, "pack": pack, "max_retries": max_retries, "seed": seed},
+        "elapsed_s": round(elapsed, 3),
+        "cv_per_s": round(cvs / elapsed, 3) if elapsed else None,
+        "first_result_s": round(completions[0], 3) if completions else None,
+        "p50_completion_s": round(_percentile(completions, 0.50), 3) if completions else None,
+        "ok": ok,
+        "failed": failed,
+        "cost_usd": round(cost, 6),
+        "model_calls": telemetry["calls"],
+        "retries": telemetry["retries"],
+        "wait_s": round(telemetry["wait_s"], 3),
+        "call_p50_ms": telemetry["p50_ms"] and round(telemetry["p50_ms"], 1),
+        "call_p95_ms": telemetry["p95_ms"] and round(telemetry["p95_ms"], 1),
+        "client": dict(client.stats),
+    }
+
+# ---------------------------------------------------------------------------
+# Bases synthétiques et requêtes de db.py
+# ---------------------------------------------------------------------------
+
+def build_synthetic_db(size, seed=7, data_dir=BENCH_DATA_DIR):
+    """Base de `size` analyses (offres, compétences, FTS et agrégats maintenus par les triggers
+    comme en production) et d'autant de lignes de télémétrie / 10. Réutilisée si elle existe.
+    Retourne (chemin, durée de génération en secondes ou None si réutilisée).
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"synthetic-v{BENCH_DB_VERSION}-{size}.db")
+    if os.path.exists(path):
+        return path, None
+    building = path + ".tmp"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(building + suffix):
+            os.remove(building + suffix)
+    started = time.perf_counter()
+    rng = random.Random(seed + size)
+    db.DB_PATH = building
+    init_db()
+    conn = db.get_connection()
+    conn.execute("PRAGMA synchronous=OFF")
+    offers = [save_job_offer(f"{rng.choice(('Développeur', 'Data engineer', 'Chef de projet', 'DevOps'))} {n}",
+                             f"Offre synthétique {n} : " + " ".join(rng.choice(_WORDS + _SKILLS) for _ in range(80)))
+              for n in range(min(500, max(10, size // 2000)))]
+    # Dates croissantes sur un an : l'ordre des id suit l'ordre chronologique, comme en production
+    start = datetime.now() - timedelta(days=365)
+    step = 365 * 86400 / size
+    for first in range(0, size, BENCH_INSERT_CHUNK):
+        rows = []
+        for i in range(first, min(size, first + BENCH_INSERT_CHUNK)):
+            job_offer_id = rng.choice(offers)
+            row = list(_analysis_row(f"cv{i:07d}.pdf", _synthetic_analysis(rng), job_offer_id, "text",
+                                     f"{rng.getrandbits(256):064x}"))
+            row[9] = (start + timedelta(seconds=i * step)).strftime(db.TIMESTAMP_FORMAT)
+            rows.append(row)
+        with conn:
+            conn.executemany(_INSERT_ANALYSIS_SQL, rows)
+        print(f"   {min(size, first + BENCH_INSERT_CHUNK):,}/{size:,} analyses", end="\r", flush=True)
+    now = time.time()
+    calls = []
+    for i in range(max(1, size // 10)):
+        ts = now - 365 * 86400 + i * (365 * 86400 / max(1, size // 10))
+        prompt, completion = rng.randint(800, 3000), rng.randint(300, 600)
+        tokens = {"prompt": prompt, "completion": completion, "cached": 0, "total": prompt + completion}
+        outcome = rng.choices(("ok", "cache", "error", "invalid_json"), (90, 6, 2, 2))[0]
+        calls.append((ts, datetime.fromtimestamp(ts).strftime(db.TIMESTAMP_FORMAT), rng.choice(offers), MODEL,
+                      "single", 1, outcome, outcome == "cache", 0, "text", prompt, completion, 0,
+                      prompt + completion, 0.0 if outcome == "cache" else estimate_cost(tokens),
+                      rng.lognormvariate(6.5, 0.4),
+                      rng.lognormvariate(6.6, 0.5), rng.choices((1, 2, 3), (95, 4, 1))[0], 0.0, None, 0, None,
+                      None if outcome == "cache" else "strict"))
+    with conn:
+        conn.executemany(_INSERT_MODEL_CALL_SQL, calls)
+    total_cost = conn.execute("SELECT COALESCE(SUM(cost_usd), 0) FROM model_calls").fetchone()[0]
+    assert total_cost > 0, "coût synthétique nul : clés de tokens attendues par estimate_cost ?"
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    close_connection()
+    os.replace(building, path)
+    for suffix in ("-wal", "-shm"):
+        if os.path.exists(building + suffix):
+            os.remove(building + suffix)
+    print()
+    return path, round(time.perf_counter() - started, 2)
+
+def _result_size(result):
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])   # (rows, curseur) / (rows, has_more)
+    if isinstance(result, list):
+        return len(result)
+    return 0 if result is None else 1
+
+def _query_cases():
+    """(nom, fonction) des lectures de db.py, paramétrées sur la base courante"""
+    conn = db.get_connection()
+    size = conn.execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+    job_offer_id = conn.execute("SELECT job_offer_id FROM job_offer_stats ORDER BY nb_analyses DESC LIMIT 1").fetchone()[0]
+    middle = conn.execute("SELECT date, id FROM analyses ORDER BY date DESC, id DESC LIMIT 1 OFFSET ?",
+                          (size // 2,)).fetchone()
+    return [
+        ("get_all_analyses", lambda: db.get_all_analyses()),
+        ("get_all_analyses[7j]", lambda: db.get_all_analyses(since_days=7)),
+        ("get_analyses_page", lambda: db.get_analyses_page()),
+        ("get_analyses_page[milieu]", lambda: db.get_analyses_page(after=tuple(middle))),
+        ("get_analyses_page[offre]", lambda: db.get_analyses_page(job_offer_id=job_offer_id)),
+        ("get_analyses_page[score>=70,recommandé]",
+         lambda: db.get_analyses_page(score_min=70, recommandation="Recommandé")),
+        ("get_analyses_summary", lambda: db.get_analyses_summary()),
+        ("get_analyses_summary[score>=50,30j]", lambda: db.get_analyses_summary(score_min=50, since_days=30)),
+        ("get_analyses_by_job_offer", lambda: db.get_analyses_by_job_offer(job_offer_id)),
+        ("get_all_job_offers", lambda: db.get_all_job_offers()),
+        ("get_job_offer_stats", lambda: db.get_job_offer_stats(job_offer_id)),
+        ("get_job_offer_score_histogram", lambda: db.get_job_offer_score_histogram(job_offer_id)),
+        ("get_job_offer_by_id", lambda: db.get_job_offer_by_id(job_offer_id)),
+        ("get_analysis_details", lambda: db.get_analysis_details(middle[1])),
+        ("find_candidates_by_skill", lambda: db.find_candidates_by_skill("Python")),
+        ("find_candidates_by_skill[offre]", lambda: db.find_candidates_by_skill("Kubernetes", job_offer_id=job_offer_id)),
+        ("get_top_skills", lambda: db.get_top_skills()),
+        ("get_top_skills[offre]", lambda: db.get_top_skills(job_offer_id)),
+        ("search_analyses", lambda: db.search_analyses("martin")),
+        ("search_analyses[offre]", lambda: db.search_analyses("python docker", job_offer_id)),
+        ("search_job_offers", lambda: db.search_job_offers("développeur")),
+        ("get_telemetry_summary[30j]", lambda: db.get_telemetry_summary(30)),
+        ("get_telemetry_timeseries[30j]", lambda: db.get_telemetry_timeseries(30)),
+        ("get_cost_by_job_offer[30j]", lambda: db.get_cost_by_job_offer(30)),
+    ]
+
+def bench_queries(path, repeat=5):
+    """Durées (ms) de chaque lecture : premier appel puis `repeat` appels (min, médiane, max)"""
+    db.DB_PATH = path
+    close_connection()
+    results = {}
+    for name, call in _query_cases():
+        started = time.perf_counter()
+        rows = _result_size(call())
+        first = (time.perf_counter() - started) * 1000
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            call()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {"rows": rows, "first_ms": round(first, 3), "min_ms": round(min(timings), 3),
+                         "median_ms": round(statistics.median(timings), 3), "max_ms": round(max(timings), 3)}
+        print(f"   {name:<42} {results[name]['median_ms']:>10.2f} ms  ({rows} ligne(s))")
+    close_connection()
+    return results
+
+def bench_databases(sizes=BENCH_DB_SIZES, repeat=5, data_dir=BENCH_DATA_DIR):
+    report = {}
+    for size in sizes:
+        print(f"🗄️ Base synthétique de {size:,} analyses")
+        path, generated_s = build_synthetic_db(size, data_dir=data_dir)
+        report[str(size)] = {"path": path, "generate_s": generated_s,
+                             "file_mb": round(os.path.getsize(path) / 1e6, 1),
+                             "queries": bench_queries(path, repeat)}
+    return report
+
+# ---------------------------------------------------------------------------
+# Rapport et comparaison
+# ---------------------------------------------------------------------------
+
+def _metrics(report):
+    # {clé: (valeur, plus_grand_est_mieux)} des mesures comparables d'un rapport
+    metrics = {}
+    for n, run in enumerate(report.get("pipeline") or []):
+        metrics[f"pipeline[{n}].cv_per_s"] = (run["cv_per_s"], True)
+    for size, entry in (report.get("db") or {}).items():
+        for name, timing in entry["queries"].items():
+            metrics[f"db[{size}].{name}.median_ms"] = (timing["median_ms"], False)
+    return metrics
+
+def compare_reports(report, baseline, ratio=BENCH_REGRESSION_RATIO):
+    """Mesures dégradées de plus de `ratio` : [(clé, référence, actuel)]"""
+    current, previous = _metrics(report), _metrics(baseline)
+    regressions = []
+    for key, (value, higher_is_better) in current.items():
+        if key not in previous or not value or not previous[key][0]:
+            continue
+        before = previous[key][0]
+        if (value * ratio < before) if higher_is_better else (value > before * ratio
+                                                               and value - before >= BENCH_MIN_DELTA_MS):
+            regressions.append((key, before, value))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mesures de performance (client simulé, bases synthétiques)")
+    parser.add_argument("command", choices=("pipeline", "db", "all"))
+    parser.add_argument("--output", default="bench_report.json", help="rapport JSON (défaut bench_report.json)")
+    parser.add_argument("--baseline", help="rapport précédent à comparer")
+    parser.add_argument("--data-dir", dest="data_dir", default=BENCH_DATA_DIR,
+                        help=f"bases synthétiques (défaut {BENCH_DATA_DIR})")
+    parser.add_argument("--cvs", type=int, default=200, help="taille du lot simulé (défaut 200)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[4],
+                        help="appels simultanés ; plusieurs valeurs : une mesure par valeur")
+    parser.add_argument("--latency", type=float, nargs=2, default=(0.2, 1.0), metavar=("MIN", "MAX"),
+                        help="latence simulée d'un appel, en secondes (défaut 0.2 1.0)")
+    parser.add_argument("--rate-limit", dest="rate_limit", type=float, default=0.0, help="proportion d'erreurs 429")
+    parser.add_argument("--malformed", type=float, default=0.0, help="proportion de JSON invalides")
+    parser.add_argument("--pack", action="store_true", help="grouper les CV courts par requête")
+    parser.add_argument("--sizes", default=",".join(str(s) for s in BENCH_DB_SIZES),
+                        help="tailles des bases synthétiques, séparées par des virgules")
+    parser.add_argument("--repeat", type=int, default=5, help="répétitions par requête (défaut 5)")
+    args = parser.parse_args(argv)
+    app_db = db.DB_PATH
+
+    report = {
+        "generated_at": datetime.now().strftime(db.TIMESTAMP_FORMAT),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    try:
+        if args.command in ("pipeline", "all"):
+            report["pipeline"] = []
+            for concurrency in args.concurrency:
+                print(f"⚙️ Pipeline : {args.cvs} CV, {concurrency} appel(s) simultané(s)")
+                run = bench_pipeline(args.cvs, concurrency, tuple(args.latency), args.rate_limit, args.malformed,
+                                     args.pack, data_dir=args.data_dir)
+                print(f"   {run['cv_per_s']} CV/s, {run['ok']} ok, {run['failed']} échec(s), "
+                      f"{run['retries']} nouvelle(s) tentative(s), appel p95 {run['call_p95_ms']} ms")
+                report["pipeline"].append(run)
+        if args.command in ("db", "all"):
+            sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+            report["db"] = bench_databases(sizes, args.repeat, args.data_dir)
+    finally:
+        db.DB_PATH = app_db
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"📝 Rapport : {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare_reports(report, json.load(f))
+        for key, before, after in regressions:
+            print(f"🔻 {key} : {before} → {after}")
+        if regressions:
+            return 1
+        print("✅ Aucune régression par rapport à la référence")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
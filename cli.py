@@ -0,0 +1,286 @@
+"""Analyse de CV en ligne de commande, sans l'interface Streamlit.
+
+    python cli.py analyze <dossier> --offer <id_offre> [--concurrency 4] [--rpm 60] [--fake-model]
+    python cli.py resume <id_lot>
+    python cli.py jobs
+    python cli.py export --format csv --offer <id_offre> --from 2025-01-01 --to 2025-03-31 -o analyses.csv
+
+L'état du lot (un item par PDF) est conservé dans la base : relancer la même commande
+reprend là où le lot s'était arrêté.
+"""
+import os
+import sys
+import argparse
+from pathlib import Path
+from dotenv import load_dotenv
+import db
+from db import (
+    init_db, get_job_offer_by_id, create_batch_job, add_batch_items, get_batch_job,
+    find_batch_job, list_batch_jobs, get_batch_items, set_batch_job_status,
+    start_batch_items, complete_batch_item, skip_batch_items, save_prescreen_scores,
+    export_analyses, EXPORT_FORMATS,
+)
+from analyzer import DEFAULT_MAX_IN_FLIGHT, analyze_batch, estimate_cost, _parse_analysis_json
+from rate_limit import TokenBucket, RateLimitedClient
+from prescreen import prescreen_batch, parse_keywords, summarize, extractions_by_sha
+
+load_dotenv()
+
+# Valeurs par défaut des options conservées avec le lot (reprises telles quelles par "resume")
+RUN_DEFAULTS = {
+    "concurrency": DEFAULT_MAX_IN_FLIGHT,
+    "rpm": 0,
+    "max_retries": 4,
+    "prefer_text": True,
+    "pack": False,
+    "force": False,
+    "dedupe": True,
+    "fake_model": False,
+    "keywords": None,
+    "top_k": None,
+    "min_score": None,
+}
+
+
+def _make_client(fake_model: bool):
+    if fake_model:
+        from fake_gemini import FakeGeminiClient
+        return FakeGeminiClient(latency=(0.05, 0.3))
+    if not os.getenv("GEMINI_API_KEY"):
+        print("⚠️ Clé API GEMINI_API_KEY non configurée (ou utilisez --fake-model).")
+        sys.exit(2)
+    from google import genai
+    return genai.Client()
+
+def _list_pdfs(directory: Path):
+    return sorted((p.name, str(p.resolve())) for p in directory.iterdir()
+                  if p.is_file() and p.suffix.lower() == ".pdf")
+
+def _run_options(args, stored=None):
+    # Option passée en ligne de commande > option enregistrée avec le lot > défaut
+    options = dict(RUN_DEFAULTS, **(stored or {}))
+    for name in RUN_DEFAULTS:
+        value = getattr(args, name, None)
+        if value is not None:
+            options[name] = value
+    return options
+
+def run_batch_job(job_id, options, retry_failed=False):
+    """Traite les items restants d'un lot ; retourne le code de sortie (0 : aucun échec)"""
+    job = get_batch_job(job_id)
+    offer = get_job_offer_by_id(job["job_offer_id"])
+    if not offer:
+        print(f"❌ Offre {job['job_offer_id']} introuvable.")
+        return 2
+    job_offer_id, job_title, job_offer_text = offer[0], offer[1], offer[2]
+    statuses = ("pending", "running", "failed") if retry_failed else ("pending", "running")
+    items = get_batch_items(job_id, statuses)
+    print(f"🧾 Lot #{job_id} — offre « {job_title} » ({job_offer_id[:8]}…)")
+    if not items:
+        print("✅ Rien à faire : tous les CV du lot sont déjà traités.")
+        set_batch_job_status(job_id, "failed" if job["counts"]["failed"] else "done")
+        return 1 if job["counts"]["failed"] else 0
+
+    files, item_by_index, extractions = [], {}, {}
+    for item_id, filename, path, status, attempts in items:
+        try:
+            pdf_bytes = Path(path).read_bytes()
+        except OSError as e:
+            complete_batch_item(item_id, error=f"Lecture impossible : {e}")
+            print(f"❌ {filename} : lecture impossible ({e})")
+            continue
+        item_by_index[len(files)] = (item_id, attempts)
+        files.append((filename, pdf_bytes))
+
+    if len(files) > 1 and (options["keywords"] or options["top_k"] or options["min_score"]):
+        keywords = parse_keywords(options["keywords"])
+        screening = prescreen_batch(files, job_offer_text, keywords, options["top_k"], options["min_score"])
+        save_prescreen_scores(job_offer_id, screening, {"keywords": keywords, "top_k": options["top_k"],
+                                                        "min_score": options["min_score"], "batch_job": job_id})
+        skip_batch_items([(item_by_index[r["index"]][0], f"Pré-sélection : {r['reason']}")
+                          for r in screening if not r["selected"]])
+        kept, skipped, unscored = summarize(screening)
+        print(f"🔎 Pré-sélection : {kept} retenu(s), {skipped} écarté(s), {unscored} non noté(s)")
+        selected = [r["index"] for r in screening if r["selected"]]
+        item_by_index = {new: item_by_index[old] for new, old in enumerate(selected)}
+        files = [files[old] for old in selected]
+        extractions = extractions_by_sha(screening)
+
+    client = _make_client(options["fake_model"])
+    if options["rpm"]:
+        client = RateLimitedClient(client, TokenBucket(options["rpm"]))
+    start_batch_items([item_id for item_id, _ in item_by_index.values()])
+    set_batch_job_status(job_id, "running")
+
+    total, done, failed, cache_hits, cost = len(files), 0, 0, 0, 0.0
+    try:
+        for event in analyze_batch(files, job_offer_text, client, max_in_flight=options["concurrency"],
+                                   max_retries=options["max_retries"], job_offer_id=job_offer_id,
+                                   force=options["force"], prefer_text=options["prefer_text"],
+                                   pack=options["pack"], dedupe=options["dedupe"], extractions=extractions):
+            filename = event["filename"]
+            if event["type"] == "notice":
+                print(f"   {filename} : {event['message']}")
+                continue
+            done += 1
+            item_id, attempts = item_by_index[event["index"]]
+            result = event["result"]
+            parsed = _parse_analysis_json(result["content"]) if result else None
+            if parsed is None:
+                failed += 1
+                error = event["error"] or "Réponse JSON invalide"
+                complete_batch_item(item_id, error=error)
+                print(f"[{done}/{total}] ❌ {filename} : {error}")
+                continue
+            cached = result.get("cached", False)
+            cost_cv = 0.0 if cached else estimate_cost(result["tokens"])
+            cost += cost_cv
+            if cached:
+                cache_hits += 1
+            # Un résultat en cache est déjà enregistré pour cette offre, sauf si l'item avait été
+            # interrompu entre la mise en cache et son enregistrement (tentative précédente)
+            record = not cached or attempts > 0
+            complete_batch_item(item_id, filename, parsed if record else None, job_offer_id,
+                                result.get("input_mode"), content=result["content"], cached=cached,
+                                cost_usd=cost_cv, pdf_sha256=result.get("pdf_sha256"))
+            print(f"[{done}/{total}] ✅ {filename} — {parsed.get('nom_prenom', '?')} : "
+                  f"{parsed.get('score_global', '?')}/100" + (" (cache)" if cached else "")
+                  + (" (doublon)" if result.get("duplicate") else ""))
+    except KeyboardInterrupt:
+        set_batch_job_status(job_id, "interrupted")
+        print(f"\n⏸️ Lot #{job_id} interrompu ({done}/{total} traités). Reprise : python cli.py resume {job_id}")
+        return 130
+
+    job = get_batch_job(job_id)
+    set_batch_job_status(job_id, "failed" if job["counts"]["failed"] else "done")
+    print(f"🎉 {done - failed}/{total} CV analysé(s), {failed} échec(s), {cache_hits} depuis le cache, "
+          f"coût estimé ${cost:.4f}")
+    if job["counts"]["failed"]:
+        print(f"↩️ Relancer les échecs : python cli.py resume {job_id} --retry-failed")
+    return 1 if failed else 0
+
+def cmd_analyze(args):
+    directory = Path(args.directory)
+    if not directory.is_dir():
+        print(f"❌ Dossier introuvable : {directory}")
+        return 2
+    if not get_job_offer_by_id(args.offer):
+        print(f"❌ Offre {args.offer} introuvable.")
+        return 2
+    pdfs = _list_pdfs(directory)
+    if not pdfs:
+        print(f"⚠️ Aucun PDF dans {directory}")
+        return 2
+    source = str(directory.resolve())
+    job_id = None if args.new else find_batch_job(args.offer, source)
+    if job_id:
+        job = get_batch_job(job_id)
+        options = _run_options(args, job["options"])
+        added = add_batch_items(job_id, pdfs)
+        print(f"🔁 Reprise du lot #{job_id}" + (f" ({added} nouveau(x) fichier(s))" if added else ""))
+    else:
+        options = _run_options(args)
+        job_id = create_batch_job(args.offer, source, pdfs, options)
+        print(f"🆕 Lot #{job_id} créé : {len(pdfs)} PDF")
+    return run_batch_job(job_id, options, args.retry_failed)
+
+def cmd_resume(args):
+    job = get_batch_job(args.job_id)
+    if not job:
+        print(f"❌ Lot #{args.job_id} introuvable.")
+        return 2
+    return run_batch_job(args.job_id, _run_options(args, job["options"]), args.retry_failed)
+
+def cmd_jobs(args):
+    rows = list_batch_jobs(args.limit)
+    if not rows:
+        print("Aucun lot.")
+        return 0
+    for job_id, job_offer_id, source, status, created_at, total, done, failed in rows:
+        print(f"#{job_id:<5} {created_at}  {status:<11} {done}/{total} ({failed} échec(s))  "
+              f"offre {job_offer_id[:8]}…  {source}")
+    return 0
+
+def cmd_export(args):
+    if args.offer and not get_job_offer_by_id(args.offer):
+        print(f"❌ Offre {args.offer} introuvable.")
+        return 2
+    if args.output in (None, "-"):
+        if args.format == "parquet":
+            print("❌ L'export Parquet doit être écrit dans un fichier (--output).")
+            return 2
+        try:
+            count = export_analyses(sys.stdout, args.format, args.offer, args.date_from, args.date_to)
+        except BrokenPipeError:
+            # Lecteur fermé en cours de route (ex. | head) : arrêt sans trace
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            return 0
+        return 0 if count is not None else 2
+    count = export_analyses(args.output, args.format, args.offer, args.date_from, args.date_to)
+    if count is None:
+        return 2
+    # Sur stderr : la sortie standard peut porter l'export lui-même
+    print(f"📤 {count} analyse(s) exportée(s) dans {args.output}", file=sys.stderr)
+    return 0
+
+def _add_run_options(parser):
+    parser.add_argument("--concurrency", type=int, help=f"appels Gemini simultanés (défaut {DEFAULT_MAX_IN_FLIGHT})")
+    parser.add_argument("--rpm", type=float, help="limite d'appels Gemini par minute (0 : aucune)")
+    parser.add_argument("--max-retries", dest="max_retries", type=int, help="tentatives par appel, au moins 1 (défaut 4)")
+    parser.add_argument("--pdf", dest="prefer_text", action="store_const", const=False,
+                        help="envoyer les PDF tels quels (pas d'extraction locale du texte)")
+    parser.add_argument("--pack", action="store_const", const=True, help="grouper les CV courts par requête")
+    parser.add_argument("--force", action="store_const", const=True, help="ignorer le cache d'analyses")
+    parser.add_argument("--no-dedupe", dest="dedupe", action="store_const", const=False,
+                        help="analyser aussi les quasi-doublons au lieu de reprendre l'analyse existante")
+    parser.add_argument("--fake-model", dest="fake_model", action="store_const", const=True,
+                        help="client Gemini simulé, sans réseau")
+    parser.add_argument("--keywords", help="pré-sélection locale : mots-clés obligatoires (séparés par des virgules)")
+    parser.add_argument("--top-k", dest="top_k", type=int, help="pré-sélection locale : garder les N meilleurs CV")
+    parser.add_argument("--min-score", dest="min_score", type=float,
+                        help="pré-sélection locale : score local minimal (0-100)")
+    parser.add_argument("--retry-failed", dest="retry_failed", action="store_true",
+                        help="relancer aussi les CV en échec")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Analyse de CV par lots, hors interface")
+    parser.add_argument("--db", help=f"base SQLite (défaut {db.DB_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("analyze", help="analyser un dossier de PDF pour une offre")
+    p.add_argument("directory")
+    p.add_argument("--offer", required=True, help="identifiant de l'offre")
+    p.add_argument("--new", action="store_true", help="créer un nouveau lot au lieu de reprendre le dernier")
+    _add_run_options(p)
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("resume", help="reprendre un lot interrompu")
+    p.add_argument("job_id", type=int)
+    _add_run_options(p)
+    p.set_defaults(func=cmd_resume)
+
+    p = sub.add_parser("jobs", help="lister les derniers lots")
+    p.add_argument("--limit", type=int, default=20)
+    p.set_defaults(func=cmd_jobs)
+
+    p = sub.add_parser("export", help="exporter l'historique des analyses (CSV, NDJSON, Parquet)")
+    p.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    p.add_argument("--offer", help="identifiant de l'offre (défaut : toutes)")
+    p.add_argument("--from", dest="date_from", help="premier jour inclus (AAAA-MM-JJ)")
+    p.add_argument("--to", dest="date_to", help="dernier jour inclus (AAAA-MM-JJ)")
+    p.add_argument("-o", "--output", help="fichier de sortie (défaut : sortie standard, sauf Parquet)")
+    p.set_defaults(func=cmd_export)
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, "max_retries", None) is not None and args.max_retries < 1:
+        parser.error("--max-retries doit valoir au moins 1")
+    if args.db:
+        db.DB_PATH = args.db
+    init_db()
+    return args.func(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import time
+import hashlib
+import threading
+from google.genai import types
+
+# Durée de vie d'un préfixe mis en cache côté Gemini (prompt système + offre)
+CONTEXT_CACHE_TTL = 900  # secondes
+# Marge avant expiration : au-delà, le préfixe est recréé plutôt que réutilisé
+CONTEXT_CACHE_REFRESH_MARGIN = 60
+
+
+def offer_part(job_offer_text: str):
+    return types.Part.from_text(text=f"Voici l'offre d'emploi à analyser :\n{job_offer_text}")
+
+class PromptPrefix:
+    """Début commun des requêtes d'un lot : soit une référence de cache Gemini
+    (`cached_content`), soit le prompt système et l'offre envoyés en clair.
+    """
+
+    __slots__ = ("cached_content", "system_instruction", "contents")
+
+    def __init__(self, cached_content=None, system_instruction=None, contents=None):
+        self.cached_content = cached_content
+        self.system_instruction = system_instruction
+        self.contents = contents or []
+
+class InlineBackend:
+    """Aucun cache côté serveur : le préfixe est renvoyé dans chaque requête"""
+
+    def create(self, model, system_instruction, contents, ttl_seconds):
+        return None
+
+    def delete(self, name):
+        pass
+
+class GeminiCacheBackend:
+    """Cache de contexte explicite de l'API Gemini (client.caches)"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, system_instruction, contents, ttl_seconds):
+        cache = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                system_instruction=system_instruction,
+                contents=[types.Content(role="user", parts=contents)],
+                ttl=f"{int(ttl_seconds)}s",
+                display_name="cv-analyse-prefixe-offre",
+            ),
+        )
+        return cache.name
+
+    def delete(self, name):
+        self.client.caches.delete(name=name)
+
+class ContextCache:
+    """Crée une seule fois par (offre, version du prompt) le préfixe partagé des requêtes,
+    puis le réutilise pour tous les CV. Si le backend refuse la création (offre trop courte
+    pour le cache Gemini, quota…), le préfixe est envoyé en clair pour cette offre.
+    """
+
+    def __init__(self, backend, model: str, system_instruction: str, prompt_version: str,
+                 ttl_seconds: int = CONTEXT_CACHE_TTL):
+        self.backend = backend
+        self.model = model
+        self.system_instruction = system_instruction
+        self.prompt_version = prompt_version
+        self.ttl_seconds = ttl_seconds
+        self._entries = {}   # clé -> (nom du cache, expiration) ; nom None = préfixe en clair
+        self._lock = threading.Lock()
+
+    def _key(self, job_offer_text: str):
+        offer_hash = hashlib.sha256(job_offer_text.encode("utf-8")).hexdigest()
+        return (offer_hash, self.prompt_version)
+
+    def _inline(self, job_offer_text: str):
+        return PromptPrefix(system_instruction=self.system_instruction, contents=[offer_part(job_offer_text)])
+
+    def prefix_for(self, job_offer_text: str):
+        key = self._key(job_offer_text)
+        with self._lock:
+            name, expires_at = self._entries.get(key, (None, 0.0))
+            if key in self._entries and (name is None or expires_at - time.time() > CONTEXT_CACHE_REFRESH_MARGIN):
+                return PromptPrefix(cached_content=name) if name else self._inline(job_offer_text)
+            try:
+                name = self.backend.create(self.model, self.system_instruction,
+                                           [offer_part(job_offer_text)], self.ttl_seconds)
+            except Exception as e:
+                print(f"⚠️ Cache de contexte indisponible, préfixe envoyé en clair : {e}")
+                name = None
+            self._entries[key] = (name, time.time() + self.ttl_seconds)
+        return PromptPrefix(cached_content=name) if name else self._inline(job_offer_text)
+
+    def invalidate(self, job_offer_text: str):
+        """Abandonne le cache serveur d'une offre (expiré / introuvable) : préfixe en clair ensuite"""
+        with self._lock:
+            self._entries[self._key(job_offer_text)] = (None, 0.0)
+
+    def close(self):
+        """Supprime les caches créés côté serveur"""
+        with self._lock:
+            names = [name for name, _ in self._entries.values() if name]
+            self._entries.clear()
+        for name in names:
+            try:
+                self.backend.delete(name)
+            except Exception as e:
+                print(f"⚠️ Suppression du cache {name} impossible : {e}")
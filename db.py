@@ -1,14 +1,99 @@
+import re
+import csv
 import sqlite3
+import unicodedata
 from datetime import datetime
 import hashlib
 import json
+import time
+import queue
+import atexit
+import threading
+import uuid
 
 DB_PATH = "new.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    
+# Réglages appliqués à chaque connexion (WAL : les lectures ne bloquent plus derrière les écritures)
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-20000",      # ~20 Mo de cache de pages
+    "PRAGMA mmap_size=268435456",    # 256 Mo lus via mmap
+    "PRAGMA temp_store=MEMORY",
+)
+SQLITE_BUSY_TIMEOUT = 10.0
+SQLITE_CACHED_STATEMENTS = 256
+
+# Horodatage stocké en ISO-8601 local : l'ordre lexicographique est l'ordre chronologique
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Taille d'une page de l'historique
+HISTORY_PAGE_SIZE = 50
+# Taille d'une page de résultats de recherche plein texte
+SEARCH_PAGE_SIZE = 20
+
+# Écrivain groupé des analyses : taille max d'une transaction et délai d'attente avant écriture
+ANALYSIS_WRITER_BATCH_SIZE = 64
+ANALYSIS_WRITER_FLUSH_INTERVAL = 0.5  # secondes
+
+_local = threading.local()
+
+# Générations des tables lues par l'interface, incrémentées après chaque écriture validée par
+# ce processus : incluses dans une clé de cache, elles rendent caduques les seules lectures
+# qui dépendent de la table modifiée
+_generations = {"job_offers": 0, "analyses": 0, "prescreen": 0}
+_generations_lock = threading.Lock()
+
+# Cache des analyses Gemini (clé : hash PDF + offre + modèle + prompt)
+CACHE_MAX_AGE_DAYS = 30
+CACHE_MAX_ENTRIES = 5000
+CACHE_MAX_BYTES = 50 * 1024 * 1024
+
+def _open_connection(path):
+    conn = sqlite3.connect(
+        path,
+        timeout=SQLITE_BUSY_TIMEOUT,
+        cached_statements=SQLITE_CACHED_STATEMENTS,
+    )
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+def get_connection():
+    """Connexion SQLite du thread courant, ouverte une seule fois puis réutilisée.
+    Les requêtes préparées restent en cache sur la connexion (cached_statements).
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        if conn is not None:
+            conn.close()
+        conn = _open_connection(DB_PATH)
+        _local.conn = conn
+        _local.path = DB_PATH
+    return conn
+
+def bump_generation(*tables):
+    """Signale une écriture sur `tables` (aussi appelé pour les écritures d'autres processus)"""
+    with _generations_lock:
+        for table in tables:
+            _generations[table] += 1
+
+def data_generation(*tables):
+    """Clé de cache : base courante et générations des tables lues"""
+    with _generations_lock:
+        return (DB_PATH,) + tuple(_generations[table] for table in tables)
+
+def _now():
+    return datetime.now().strftime(TIMESTAMP_FORMAT)
+
+def close_connection():
+    """Ferme la connexion du thread courant (elle sera rouverte au prochain appel)"""
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+def _migration_base_schema(c):
     # Table pour les offres d'emploi
     c.execute('''
         CREATE TABLE IF NOT EXISTS job_offers (
@@ -36,75 +121,684 @@ def init_db():
             FOREIGN KEY (job_offer_id) REFERENCES job_offers (id)
         )
     ''')
+
+    # Bases antérieures aux offres d'emploi : ajouter la colonne job_offer_id
+    c.execute("PRAGMA table_info(analyses)")
+    columns = [column[1] for column in c.fetchall()]
+    if 'job_offer_id' not in columns:
+        c.execute('ALTER TABLE analyses ADD COLUMN job_offer_id TEXT')
+        
+        # Créer une offre par défaut pour les analyses existantes
+        default_job_id = "default_legacy"
+        c.execute('''
+            INSERT OR IGNORE INTO job_offers (id, title, content, created_date)
+            VALUES (?, ?, ?, ?)
+        ''', (
+            default_job_id,
+            "Offre héritée (analyses antérieures)",
+            "Analyses réalisées avant l'implémentation du système d'offres d'emploi",
+            datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+        ))
+        
+        # Mettre à jour les analyses existantes
+        c.execute('UPDATE analyses SET job_offer_id = ? WHERE job_offer_id IS NULL', (default_job_id,))
+
     # Index utiles
     c.execute("CREATE INDEX IF NOT EXISTS idx_job_offers_created_date ON job_offers(created_date)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_analyses_job_offer_id ON analyses(job_offer_id)")
 
-    # Vérifier si la colonne job_offer_id existe, sinon l'ajouter (migration)
+def _migration_analysis_cache(c):
+    # Cache des réponses Gemini, adressé par le contenu du PDF
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            cache_key TEXT PRIMARY KEY,
+            pdf_sha256 TEXT,
+            job_offer_id TEXT,
+            model TEXT,
+            prompt_hash TEXT,
+            content TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            total_tokens INTEGER,
+            size_bytes INTEGER,
+            created_at REAL,
+            last_used_at REAL,
+            hits INTEGER DEFAULT 0
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_cache_last_used ON analysis_cache(last_used_at)")
+
+def _migration_iso_timestamps(c):
+    # 'JJ/MM/AAAA HH:MM:SS' -> 'AAAA-MM-JJ HH:MM:SS' (triable et comparable en SQL)
+    for table, column in (("job_offers", "created_date"), ("analyses", "date")):
+        c.execute(f'''
+            UPDATE {table}
+            SET {column} = substr({column}, 7, 4) || '-' || substr({column}, 4, 2) || '-'
+                           || substr({column}, 1, 2) || substr({column}, 11)
+            WHERE {column} GLOB '[0-3][0-9]/[01][0-9]/[0-9][0-9][0-9][0-9]*'
+        ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analyses_date ON analyses(date, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analyses_job_offer_date ON analyses(job_offer_id, date, id)")
+
+def _migration_recommandation(c):
+    # Recommandation conservée pour filtrer l'historique en SQL
+    c.execute("ALTER TABLE analyses ADD COLUMN recommandation TEXT")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analyses_recommandation ON analyses(recommandation, date, id)")
+
+# Maintenance incrémentale des agrégats par offre. {row} vaut NEW (ajout) ou OLD (retrait).
+_STATS_ADD_SQL = '''
+    INSERT INTO job_offer_stats (job_offer_id) VALUES ({row}.job_offer_id)
+        ON CONFLICT (job_offer_id) DO NOTHING;
+    UPDATE job_offer_stats SET
+        nb_analyses = nb_analyses + 1,
+        nb_scored = nb_scored + ({row}.score_global IS NOT NULL),
+        score_sum = score_sum + COALESCE({row}.score_global, 0),
+        score_min = CASE WHEN {row}.score_global IS NULL THEN score_min
+                         WHEN score_min IS NULL OR {row}.score_global < score_min THEN {row}.score_global
+                         ELSE score_min END,
+        score_max = CASE WHEN {row}.score_global IS NULL THEN score_max
+                         WHEN score_max IS NULL OR {row}.score_global > score_max THEN {row}.score_global
+                         ELSE score_max END
+    WHERE job_offer_id = {row}.job_offer_id;
+    INSERT INTO job_offer_score_histogram (job_offer_id, bucket, nb)
+        SELECT {row}.job_offer_id, MAX(0, MIN(9, CAST({row}.score_global AS INTEGER) / 10)), 1
+        WHERE {row}.score_global IS NOT NULL
+        ON CONFLICT (job_offer_id, bucket) DO UPDATE SET nb = nb + 1;
+'''
+
+# Le min/max d'une offre est recalculé lors d'un retrait (cas rare : suppression/correction)
+_STATS_REMOVE_SQL = '''
+    UPDATE job_offer_stats SET
+        nb_analyses = nb_analyses - 1,
+        nb_scored = nb_scored - ({row}.score_global IS NOT NULL),
+        score_sum = score_sum - COALESCE({row}.score_global, 0),
+        score_min = (SELECT MIN(score_global) FROM analyses WHERE job_offer_id = {row}.job_offer_id),
+        score_max = (SELECT MAX(score_global) FROM analyses WHERE job_offer_id = {row}.job_offer_id)
+    WHERE job_offer_id = {row}.job_offer_id;
+    UPDATE job_offer_score_histogram SET nb = nb - 1
+    WHERE job_offer_id = {row}.job_offer_id
+      AND bucket = MAX(0, MIN(9, CAST({row}.score_global AS INTEGER) / 10));
+'''
+
+def _migration_job_offer_stats(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_offer_stats (
+            job_offer_id TEXT PRIMARY KEY,
+            nb_analyses INTEGER NOT NULL DEFAULT 0,
+            nb_scored INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            score_min INTEGER,
+            score_max INTEGER
+        )
+    ''')
+    # Histogramme des scores globaux par tranche de 10 points (tranche 9 = 90..100)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_offer_score_histogram (
+            job_offer_id TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            nb INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (job_offer_id, bucket)
+        )
+    ''')
+    c.execute('''
+        INSERT INTO job_offer_stats (job_offer_id, nb_analyses, nb_scored, score_sum, score_min, score_max)
+        SELECT job_offer_id, COUNT(*), COUNT(score_global), COALESCE(SUM(score_global), 0),
+               MIN(score_global), MAX(score_global)
+        FROM analyses
+        WHERE job_offer_id IS NOT NULL
+        GROUP BY job_offer_id
+    ''')
+    _fill_score_histogram(c)
+    _create_job_offer_stats_triggers(c)
+
+def _fill_score_histogram(c):
+    # Tranche entière : un score REAL (ex. 71.5) tombe dans la même tranche que 71
+    c.execute('''
+        INSERT INTO job_offer_score_histogram (job_offer_id, bucket, nb)
+        SELECT job_offer_id, MAX(0, MIN(9, CAST(score_global AS INTEGER) / 10)), COUNT(*)
+        FROM analyses
+        WHERE job_offer_id IS NOT NULL AND score_global IS NOT NULL
+        GROUP BY 1, 2
+    ''')
+
+def _create_job_offer_stats_triggers(c):
+    add_new = _STATS_ADD_SQL.format(row="NEW")
+    remove_old = _STATS_REMOVE_SQL.format(row="OLD")
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_stats_insert
+        AFTER INSERT ON analyses WHEN NEW.job_offer_id IS NOT NULL
+        BEGIN {add_new} END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_stats_delete
+        AFTER DELETE ON analyses WHEN OLD.job_offer_id IS NOT NULL
+        BEGIN {remove_old} END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_stats_update_old
+        AFTER UPDATE OF job_offer_id, score_global ON analyses WHEN OLD.job_offer_id IS NOT NULL
+        BEGIN {remove_old} END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_stats_update_new
+        AFTER UPDATE OF job_offer_id, score_global ON analyses WHEN NEW.job_offer_id IS NOT NULL
+        BEGIN {add_new} END
+    ''')
+
+# Types de compétences indexées -> champ JSON de l'analyse Gemini
+SKILL_KINDS = {
+    "matchee": "competences_matchees",
+    "manquante": "competences_manquantes",
+    "deduite": "competences_deduites",
+}
+
+def _skill_key(skill):
+    # Même normalisation que lower(trim(x)) côté SQLite (minuscules ASCII uniquement)
+    return "".join(ch.lower() if ch.isascii() else ch for ch in str(skill).strip())
+
+def _migration_structured_analyses(c):
+    # Analyse complète (JSON Gemini) + index normalisé candidat -> compétence
+    c.execute("ALTER TABLE analyses ADD COLUMN analysis_json TEXT")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS skills (
+            id INTEGER PRIMARY KEY,
+            name_norm TEXT NOT NULL UNIQUE,
+            label TEXT NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS analysis_skills (
+            analysis_id INTEGER NOT NULL,
+            skill_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            job_offer_id TEXT,
+            score_global INTEGER,
+            PRIMARY KEY (analysis_id, skill_id, kind)
+        ) WITHOUT ROWID
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_skills_skill ON analysis_skills(skill_id, kind, score_global)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analysis_skills_offer ON analysis_skills(job_offer_id, kind, skill_id)")
+
+    inserts = []
+    for kind, field in SKILL_KINDS.items():
+        inserts.append(f'''
+            INSERT OR IGNORE INTO skills (name_norm, label)
+                SELECT lower(trim(value)), trim(value)
+                FROM json_each(NEW.analysis_json, '$.{field}')
+                WHERE type = 'text' AND trim(value) <> '';
+            INSERT OR IGNORE INTO analysis_skills (analysis_id, skill_id, kind, job_offer_id, score_global)
+                SELECT NEW.id, s.id, '{kind}', NEW.job_offer_id, NEW.score_global
+                FROM json_each(NEW.analysis_json, '$.{field}') je
+                JOIN skills s ON s.name_norm = lower(trim(je.value))
+                WHERE je.type = 'text';
+        ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_skills_insert
+        AFTER INSERT ON analyses
+        WHEN NEW.analysis_json IS NOT NULL AND json_valid(NEW.analysis_json)
+        BEGIN {"".join(inserts)} END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_skills_delete
+        AFTER DELETE ON analyses
+        BEGIN DELETE FROM analysis_skills WHERE analysis_id = OLD.id; END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_skills_update
+        AFTER UPDATE OF job_offer_id, score_global ON analyses
+        BEGIN
+            UPDATE analysis_skills SET job_offer_id = NEW.job_offer_id, score_global = NEW.score_global
+            WHERE analysis_id = NEW.id;
+        END
+    ''')
+
+# Compétences du candidat (matchées + déduites) indexées en plein texte
+_FTS_SKILLS_SQL = '''
+    (SELECT group_concat(value, ', ') FROM (
+        SELECT value FROM json_each(CASE WHEN json_valid({row}.analysis_json) THEN {row}.analysis_json END, '$.competences_matchees')
+        UNION ALL
+        SELECT value FROM json_each(CASE WHEN json_valid({row}.analysis_json) THEN {row}.analysis_json END, '$.competences_deduites')
+    ))
+'''
+
+def _migration_full_text_search(c):
     try:
-        c.execute("PRAGMA table_info(analyses)")
-        columns = [column[1] for column in c.fetchall()]
-        
-        if 'job_offer_id' not in columns:
-            print("🔄 Migration: Ajout de la colonne job_offer_id...")
-            c.execute('ALTER TABLE analyses ADD COLUMN job_offer_id TEXT')
-            
-            # Créer une offre par défaut pour les analyses existantes
-            default_job_id = "default_legacy"
-            c.execute('''
-                INSERT OR IGNORE INTO job_offers (id, title, content, created_date)
-                VALUES (?, ?, ?, ?)
-            ''', (
-                default_job_id,
-                "Offre héritée (analyses antérieures)",
-                "Analyses réalisées avant l'implémentation du système d'offres d'emploi",
-                datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-            ))
-            
-            # Mettre à jour les analyses existantes
-            c.execute('UPDATE analyses SET job_offer_id = ? WHERE job_offer_id IS NULL', (default_job_id,))
-            print("✅ Migration terminée")
-    except Exception as e:
-        print(f"⚠️ Erreur de migration : {e}")
-    
-    conn.commit()
-    conn.close()
+        c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS analyses_fts USING fts5("
+                  "nom_prenom, commentaire, skills, tokenize = 'unicode61 remove_diacritics 2')")
+    except sqlite3.OperationalError as e:
+        # SQLite compilé sans FTS5 : la recherche plein texte reste indisponible
+        print(f"⚠️ FTS5 indisponible, recherche plein texte désactivée : {e}")
+        return
+    c.execute("CREATE VIRTUAL TABLE IF NOT EXISTS job_offers_fts USING fts5("
+              "title, content, tokenize = 'unicode61 remove_diacritics 2')")
+
+    skills_new = _FTS_SKILLS_SQL.format(row="NEW")
+    c.execute(f'''
+        INSERT INTO analyses_fts (rowid, nom_prenom, commentaire, skills)
+        SELECT a.id, a.nom_prenom, a.commentaire, {_FTS_SKILLS_SQL.format(row="a")}
+        FROM analyses a
+    ''')
+    c.execute("INSERT INTO job_offers_fts (rowid, title, content) SELECT rowid, title, content FROM job_offers")
+
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_fts_insert AFTER INSERT ON analyses
+        BEGIN
+            INSERT INTO analyses_fts (rowid, nom_prenom, commentaire, skills)
+            VALUES (NEW.id, NEW.nom_prenom, NEW.commentaire, {skills_new});
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_fts_delete AFTER DELETE ON analyses
+        BEGIN DELETE FROM analyses_fts WHERE rowid = OLD.id; END
+    ''')
+    c.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_analyses_fts_update
+        AFTER UPDATE OF nom_prenom, commentaire, analysis_json ON analyses
+        BEGIN
+            DELETE FROM analyses_fts WHERE rowid = OLD.id;
+            INSERT INTO analyses_fts (rowid, nom_prenom, commentaire, skills)
+            VALUES (NEW.id, NEW.nom_prenom, NEW.commentaire, {skills_new});
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_job_offers_fts_insert AFTER INSERT ON job_offers
+        BEGIN
+            INSERT INTO job_offers_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_job_offers_fts_delete AFTER DELETE ON job_offers
+        BEGIN DELETE FROM job_offers_fts WHERE rowid = OLD.rowid; END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_job_offers_fts_update AFTER UPDATE OF title, content ON job_offers
+        BEGIN
+            DELETE FROM job_offers_fts WHERE rowid = OLD.rowid;
+            INSERT INTO job_offers_fts (rowid, title, content) VALUES (NEW.rowid, NEW.title, NEW.content);
+        END
+    ''')
+
+def _migration_input_mode(c):
+    # Chemin d'entrée envoyé à Gemini : "text" (extraction locale) ou "pdf"
+    c.execute("ALTER TABLE analyses ADD COLUMN input_mode TEXT")
+    c.execute("ALTER TABLE analysis_cache ADD COLUMN input_mode TEXT")
+
+def _migration_batch_jobs(c):
+    # Lots lancés hors interface (cli.py) : un job par dossier/offre, un item par PDF
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS batch_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_offer_id TEXT NOT NULL,
+            source TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            options_json TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS batch_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id INTEGER NOT NULL REFERENCES batch_jobs(id) ON DELETE CASCADE,
+            filename TEXT NOT NULL,
+            path TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            analysis_id INTEGER,
+            updated_at TEXT,
+            UNIQUE (job_id, filename)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_batch_items_job_status ON batch_items(job_id, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_batch_jobs_offer_source ON batch_jobs(job_offer_id, source)")
+
+def _migration_job_queue(c):
+    # File d'attente persistante consommée par worker.py : PDF stockés en base, réservation
+    # des items par un worker (bail), résultat conservé pour l'affichage de la progression
+    c.execute("ALTER TABLE batch_jobs ADD COLUMN runner TEXT NOT NULL DEFAULT 'cli'")
+    for column in ("pdf_blob BLOB", "pdf_sha256 TEXT", "claimed_by TEXT", "claimed_at REAL",
+                   "completed_at REAL", "result_json TEXT", "cached INTEGER", "cost_usd REAL",
+                   "input_mode TEXT"):
+        c.execute(f"ALTER TABLE batch_items ADD COLUMN {column}")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_batch_items_status_claimed ON batch_items(status, claimed_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_batch_items_job_completed ON batch_items(job_id, completed_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_batch_jobs_status ON batch_jobs(status)")
+    # Seaux à jetons partagés entre processus (limite d'appels Gemini commune)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limits (
+            name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_cv_fingerprints(c):
+    # Détection des quasi-doublons : empreinte MinHash du texte de chaque CV analysé,
+    # découpée en bandes LSH pour ne comparer que les candidats probables d'une même offre
+    c.execute("ALTER TABLE analyses ADD COLUMN pdf_sha256 TEXT")
+    c.execute("ALTER TABLE analyses ADD COLUMN duplicate_of INTEGER")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_analyses_job_offer_pdf ON analyses(job_offer_id, pdf_sha256)")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cv_fingerprints (
+            job_offer_id TEXT NOT NULL,
+            pdf_sha256 TEXT NOT NULL,
+            filename TEXT,
+            signature BLOB NOT NULL,
+            created_at TEXT,
+            PRIMARY KEY (job_offer_id, pdf_sha256)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cv_lsh_buckets (
+            job_offer_id TEXT NOT NULL,
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            pdf_sha256 TEXT NOT NULL,
+            PRIMARY KEY (job_offer_id, band, bucket, pdf_sha256)
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_prescreen_scores(c):
+    # Pré-sélection locale (prescreen.py) : un score par CV et par passage, pour auditer la coupure
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS prescreen_scores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            job_offer_id TEXT NOT NULL,
+            filename TEXT,
+            pdf_sha256 TEXT,
+            score REAL,
+            bm25 REAL,
+            keyword_hits INTEGER,
+            keywords_total INTEGER,
+            rank INTEGER,
+            selected INTEGER NOT NULL,
+            reason TEXT,
+            params_json TEXT,
+            created_at TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_prescreen_run ON prescreen_scores(run_id, rank)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_prescreen_job_offer_pdf ON prescreen_scores(job_offer_id, pdf_sha256)")
+
+def _migration_model_calls(c):
+    # Télémétrie : une ligne par appel au modèle (ou par résultat servi sans appel)
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS model_calls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            created_at TEXT NOT NULL,
+            job_offer_id TEXT,
+            model TEXT,
+            kind TEXT,
+            cvs INTEGER NOT NULL DEFAULT 1,
+            outcome TEXT NOT NULL,
+            cache_hit INTEGER NOT NULL DEFAULT 0,
+            context_cached INTEGER NOT NULL DEFAULT 0,
+            input_mode TEXT,
+            prompt_tokens INTEGER,
+            completion_tokens INTEGER,
+            cached_tokens INTEGER,
+            total_tokens INTEGER,
+            cost_usd REAL,
+            latency_ms REAL,
+            duration_ms REAL,
+            attempts INTEGER,
+            wait_ms REAL,
+            error TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_model_calls_ts ON model_calls(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_model_calls_job_offer_ts ON model_calls(job_offer_id, ts)")
+
+def _migration_model_call_streaming(c):
+    # Réponses en streaming : délai avant le premier fragment reçu
+    c.execute("ALTER TABLE model_calls ADD COLUMN streamed INTEGER NOT NULL DEFAULT 0")
+    c.execute("ALTER TABLE model_calls ADD COLUMN first_chunk_ms REAL")
+
+def _migration_model_call_parse_status(c):
+    # Lecture de la réponse : JSON conforme, réparé localement ou illisible
+    c.execute("ALTER TABLE model_calls ADD COLUMN parse_status TEXT")
+
+def normalize_offer_title(title):
+    """Titre comparable : minuscules, sans accents ni ponctuation, espaces réduits"""
+    text = unicodedata.normalize("NFKD", (title or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return " ".join(re.findall(r"[a-z0-9+#]+", text))
+
+def offer_content_hash(content):
+    """SHA-256 du contenu de l'offre, espaces réduits (une remise en page ne compte pas)"""
+    return hashlib.sha256(" ".join((content or "").split()).encode("utf-8")).hexdigest()
+
+def _migration_job_offer_dedupe(c):
+    # Doublons d'offres : titre normalisé et hash complet du contenu indexés (recherche
+    # exacte sans parcourir les offres), empreintes MinHash pour les quasi-doublons
+    c.execute("ALTER TABLE job_offers ADD COLUMN title_norm TEXT")
+    c.execute("ALTER TABLE job_offers ADD COLUMN content_hash TEXT")
+    seen = set()
+    for job_id, title, content in c.execute(
+            "SELECT id, title, content FROM job_offers ORDER BY created_date, rowid").fetchall():
+        digest = offer_content_hash(content)
+        # Doublons exacts déjà en base : seule la première offre porte le hash (index unique)
+        c.execute("UPDATE job_offers SET title_norm = ?, content_hash = ? WHERE id = ?",
+                  (normalize_offer_title(title), None if digest in seen else digest, job_id))
+        seen.add(digest)
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_job_offers_content_hash ON job_offers(content_hash)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_job_offers_title_norm ON job_offers(title_norm)")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_offer_fingerprints (
+            job_offer_id TEXT PRIMARY KEY,
+            signature BLOB,
+            created_at TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS job_offer_lsh_buckets (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            job_offer_id TEXT NOT NULL,
+            PRIMARY KEY (band, bucket, job_offer_id)
+        ) WITHOUT ROWID
+    ''')
+
+def _migration_job_offers_fts_by_id(c):
+    # Le rowid implicite de job_offers (clé primaire TEXT) peut être renuméroté par VACUUM :
+    # l'index plein texte des offres porte désormais l'id de l'offre (colonne non indexée)
+    if not c.execute("SELECT 1 FROM sqlite_master WHERE name = 'job_offers_fts'").fetchone():
+        return   # FTS5 indisponible (migration 7)
+    for trigger in ("insert", "delete", "update"):
+        c.execute(f"DROP TRIGGER IF EXISTS trg_job_offers_fts_{trigger}")
+    c.execute("DROP TABLE job_offers_fts")
+    c.execute("CREATE VIRTUAL TABLE job_offers_fts USING fts5("
+              "id UNINDEXED, title, content, tokenize = 'unicode61 remove_diacritics 2')")
+    c.execute("INSERT INTO job_offers_fts (id, title, content) SELECT id, title, content FROM job_offers")
+    c.execute('''
+        CREATE TRIGGER trg_job_offers_fts_insert AFTER INSERT ON job_offers
+        BEGIN
+            INSERT INTO job_offers_fts (id, title, content) VALUES (NEW.id, NEW.title, NEW.content);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_job_offers_fts_delete AFTER DELETE ON job_offers
+        BEGIN DELETE FROM job_offers_fts WHERE id = OLD.id; END
+    ''')
+    c.execute('''
+        CREATE TRIGGER trg_job_offers_fts_update AFTER UPDATE OF id, title, content ON job_offers
+        BEGIN
+            DELETE FROM job_offers_fts WHERE id = OLD.id;
+            INSERT INTO job_offers_fts (id, title, content) VALUES (NEW.id, NEW.title, NEW.content);
+        END
+    ''')
+
+def _migration_score_histogram_buckets(c):
+    # Tranches calculées sur la partie entière du score : triggers recréés, histogramme reconstruit
+    for trigger in ("insert", "delete", "update_old", "update_new"):
+        c.execute(f"DROP TRIGGER IF EXISTS trg_analyses_stats_{trigger}")
+    c.execute("DELETE FROM job_offer_score_histogram")
+    _fill_score_histogram(c)
+    _create_job_offer_stats_triggers(c)
+
+# Migrations ordonnées : (version, description, fonction). La version appliquée est
+# conservée dans PRAGMA user_version ; ne jamais modifier une migration publiée,
+# en ajouter une nouvelle à la fin.
+MIGRATIONS = [
+    (1, "Schéma initial (offres, analyses)", _migration_base_schema),
+    (2, "Cache des analyses Gemini", _migration_analysis_cache),
+    (3, "Horodatages ISO-8601 et index de dates", _migration_iso_timestamps),
+    (4, "Recommandation des analyses", _migration_recommandation),
+    (5, "Agrégats par offre maintenus par triggers", _migration_job_offer_stats),
+    (6, "Analyses complètes et index des compétences", _migration_structured_analyses),
+    (7, "Recherche plein texte (FTS5)", _migration_full_text_search),
+    (8, "Mode d'entrée des analyses (texte ou PDF)", _migration_input_mode),
+    (9, "Lots d'analyse hors interface (jobs et items)", _migration_batch_jobs),
+    (10, "File d'attente persistante des analyses", _migration_job_queue),
+    (11, "Empreintes des CV (quasi-doublons)", _migration_cv_fingerprints),
+    (12, "Scores de pré-sélection locale", _migration_prescreen_scores),
+    (13, "Télémétrie des appels au modèle", _migration_model_calls),
+    (14, "Télémétrie des réponses en streaming", _migration_model_call_streaming),
+    (15, "Statut de lecture des réponses du modèle", _migration_model_call_parse_status),
+    (16, "Doublons d'offres (titre normalisé, hash du contenu, empreintes)", _migration_job_offer_dedupe),
+    (17, "Recherche plein texte des offres indexée par id", _migration_job_offers_fts_by_id),
+    (18, "Tranches entières de l'histogramme des scores", _migration_score_histogram_buckets),
+]
+
+_migrated_paths = set()
+_migrate_lock = threading.Lock()
+
+def get_schema_version():
+    return get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def migrate():
+    """Applique les migrations dont la version dépasse PRAGMA user_version.
+    Chaque migration s'exécute dans sa propre transaction (BEGIN IMMEDIATE : un seul
+    processus migre à la fois). Retourne la version finale du schéma.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    for version, description, step in MIGRATIONS:
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            current = c.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current:
+                conn.rollback()
+                continue
+            print(f"🔄 Migration {version} : {description}...")
+            step(c)
+            c.execute(f"PRAGMA user_version = {int(version)}")
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"⚠️ Erreur de migration {version} : {e}")
+            raise
+    return get_schema_version()
+
+def init_db():
+    """Met le schéma à jour, une seule fois par processus et par fichier de base"""
+    with _migrate_lock:
+        if DB_PATH in _migrated_paths:
+            return
+        migrate()
+        _migrated_paths.add(DB_PATH)
 
 def create_job_offer_id(job_offer_text):
     """Crée un ID unique basé sur le contenu de l'offre d'emploi"""
     return hashlib.md5(job_offer_text.encode()).hexdigest()[:12]
 
 def save_job_offer(title, content):
-    """Sauvegarde une offre d'emploi et retourne son ID"""
-    job_id = create_job_offer_id(content)
-    conn = sqlite3.connect(DB_PATH)
+    """Sauvegarde une offre d'emploi et retourne son ID.
+    Une offre au contenu identique (hash complet, espaces réduits) n'est pas recréée :
+    son ID est retourné, avec ses analyses et son cache.
+    """
+    digest = offer_content_hash(content)
+    conn = get_connection()
     c = conn.cursor()
-    
-    # Vérifier si l'offre existe déjà
-    c.execute('SELECT id FROM job_offers WHERE id = ?', (job_id,))
-    if not c.fetchone():
-        c.execute('''
-            INSERT INTO job_offers (id, title, content, created_date)
-            VALUES (?, ?, ?, ?)
-        ''', (job_id, title, content, datetime.now().strftime('%d/%m/%Y %H:%M:%S')))
-        conn.commit()
-    
-    conn.close()
+    row = c.execute('SELECT id FROM job_offers WHERE content_hash = ?', (digest,)).fetchone()
+    if row:
+        return row[0]
+    # L'ID n'est qu'un préfixe du md5 : allongé si déjà pris par un autre contenu,
+    # puis suffixé au hasard une fois le md5 complet épuisé
+    full_id = hashlib.md5(content.encode()).hexdigest()
+    candidates = [full_id[:n] for n in range(12, len(full_id) + 1, 4)] + [f"{full_id}-{uuid.uuid4().hex[:8]}"]
+    job_id = next(candidate for candidate in candidates
+                  if candidate == candidates[-1]
+                  or not c.execute('SELECT 1 FROM job_offers WHERE id = ?', (candidate,)).fetchone())
+    try:
+        with conn:
+            # Deux enregistrements simultanés du même contenu : l'index unique départage,
+            # le second reprend l'offre du premier
+            row = c.execute('''
+                INSERT INTO job_offers (id, title, content, created_date, title_norm, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(content_hash) DO NOTHING
+                RETURNING id
+            ''', (job_id, title, content, _now(), normalize_offer_title(title), digest)).fetchone()
+    except sqlite3.IntegrityError:
+        # ID pris entre-temps par un autre contenu : on recommence avec l'ID suivant
+        return save_job_offer(title, content)
+    if row is None:
+        return c.execute('SELECT id FROM job_offers WHERE content_hash = ?', (digest,)).fetchone()[0]
+    bump_generation("job_offers")
     return job_id
 
-def insert_analysis(filename, analysis, job_offer_id):
-    """Insère une analyse de CV liée à une offre d'emploi"""
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    nom_prenom = analysis.get("nom_prenom", "")
-    c.execute('''
-        INSERT INTO analyses (
-            job_offer_id, nom_prenom, filename, score_global, score_technique, 
-            score_experience, score_formation, score_soft_skills, commentaire, date
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+def find_job_offer_duplicate(title, content):
+    """Offre existante identique : même contenu, sinon même titre normalisé (recherches indexées).
+    Retourne (id, titre, motif) avec motif "contenu" ou "titre", ou None.
+    """
+    conn = get_connection()
+    row = conn.execute('SELECT id, title FROM job_offers WHERE content_hash = ?',
+                       (offer_content_hash(content),)).fetchone()
+    if row:
+        return row[0], row[1], "contenu"
+    row = conn.execute('SELECT id, title FROM job_offers WHERE title_norm = ? ORDER BY created_date DESC LIMIT 1',
+                       (normalize_offer_title(title),)).fetchone()
+    return (row[0], row[1], "titre") if row else None
+
+def put_job_offer_fingerprint(job_offer_id, signature, buckets):
+    """Enregistre l'empreinte du texte d'une offre ; `buckets` : liste de (bande, seau)"""
+    conn = get_connection()
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO job_offer_fingerprints (job_offer_id, signature, created_at) VALUES (?, ?, ?)
+        ''', (job_offer_id, signature, _now()))
+        conn.executemany('''
+            INSERT OR IGNORE INTO job_offer_lsh_buckets (band, bucket, job_offer_id) VALUES (?, ?, ?)
+        ''', [(band, bucket, job_offer_id) for band, bucket in buckets])
+
+def get_unindexed_job_offers():
+    """Offres sans empreinte (créées avant l'indexation) : (id, content)"""
+    return get_connection().execute('''
+        SELECT j.id, j.content FROM job_offers j
+        WHERE NOT EXISTS (SELECT 1 FROM job_offer_fingerprints f WHERE f.job_offer_id = j.id)
+    ''').fetchall()
+
+def find_job_offer_candidates(buckets):
+    """Offres partageant au moins une bande LSH : (id, titre, signature)"""
+    if not buckets:
+        return []
+    values = ", ".join("(?, ?)" for _ in buckets)
+    return get_connection().execute(f'''
+        SELECT j.id, j.title, f.signature
+        FROM job_offer_fingerprints f
+        JOIN job_offers j ON j.id = f.job_offer_id
+        WHERE f.signature IS NOT NULL AND f.job_offer_id IN (
+            SELECT b.job_offer_id FROM job_offer_lsh_buckets b WHERE (b.band, b.bucket) IN (VALUES {values})
+        )
+    ''', [v for pair in buckets for v in pair]).fetchall()
+
+_INSERT_ANALYSIS_SQL = '''
+    INSERT INTO analyses (
+        job_offer_id, nom_prenom, filename, score_global, score_technique, 
+        score_experience, score_formation, score_soft_skills, commentaire, date,
+        recommandation, analysis_json, input_mode, pdf_sha256, duplicate_of
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def _analysis_row(filename, analysis, job_offer_id, input_mode=None, pdf_sha256=None):
+    duplicate = analysis.get("doublon_de") or {}
+    return (
         job_offer_id,
-        nom_prenom,
+        analysis.get("nom_prenom", ""),
         filename,
         analysis.get("score_global", 0),
         analysis.get("score_technique", 0),
@@ -112,53 +806,278 @@ def insert_analysis(filename, analysis, job_offer_id):
         analysis.get("score_formation", 0),
         analysis.get("score_soft_skills", 0),
         analysis.get("commentaires", ""),
-        datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-    ))
-    conn.commit()
-    conn.close()
+        _now(),
+        analysis.get("recommandation"),
+        json.dumps(analysis, ensure_ascii=False),
+        input_mode,
+        pdf_sha256,
+        duplicate.get("analysis_id"),
+    )
+
+class WriteTicket:
+    """Accusé d'une écriture mise en file : wait() rend True une fois la ligne validée en base"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.error = None
+
+    def _done(self, error=None):
+        self.error = error
+        self._event.set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout) and self.error is None
+
+_STOP = object()
+
+class AnalysisWriter:
+    """Écrivain unique en arrière-plan pour la table analyses (et la télémétrie des appels).
+    Les lignes soumises sont regroupées (au plus `batch_size`, ou ce qui arrive pendant
+    `flush_interval` secondes) et écrites en une transaction via executemany. La télémétrie
+    a sa propre transaction, après les analyses : son échec n'annule jamais une analyse.
+    """
+
+    def __init__(self, batch_size=ANALYSIS_WRITER_BATCH_SIZE, flush_interval=ANALYSIS_WRITER_FLUSH_INTERVAL):
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.closed = False
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="analysis-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, row, sql=None):
+        """Met une ligne en file ; `sql` : requête d'insertion (analyses par défaut)"""
+        if self.closed:
+            raise RuntimeError("AnalysisWriter déjà fermé")
+        ticket = WriteTicket()
+        self._queue.put(((sql or _INSERT_ANALYSIS_SQL, row), ticket))
+        return ticket
+
+    def flush(self, timeout=None):
+        """Écrit immédiatement tout ce qui a été soumis avant l'appel"""
+        ticket = WriteTicket()
+        self._queue.put((None, ticket))
+        return ticket.wait(timeout)
+
+    def close(self, timeout=None):
+        """Vide la file, valide les dernières lignes puis arrête le thread"""
+        if self.closed:
+            return True
+        self.closed = True
+        ticket = WriteTicket()
+        self._queue.put((_STOP, ticket))
+        ok = ticket.wait(timeout)
+        self._thread.join(timeout)
+        return ok
+
+    def _run(self):
+        while True:
+            rows, tickets, marker = [], [], None
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                row, ticket = item
+                if row is None or row is _STOP:
+                    marker = item
+                    break
+                rows.append(row)
+                tickets.append(ticket)
+                remaining = deadline - time.monotonic()
+                if len(rows) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            batch = [(row, ticket) for row, ticket in zip(rows, tickets) if row[0] != _INSERT_MODEL_CALL_SQL]
+            telemetry = [(row, ticket) for row, ticket in zip(rows, tickets) if row[0] == _INSERT_MODEL_CALL_SQL]
+            error = self._write([row for row, _ in batch]) if batch else None
+            telemetry_error = (self._write([row for row, _ in telemetry], "appel(s) au modèle (télémétrie)")
+                               if telemetry else None)
+            for _, ticket in batch:
+                ticket._done(error)
+            for _, ticket in telemetry:
+                ticket._done(telemetry_error)
+            if marker:
+                marker[1]._done(error)
+                if marker[0] is _STOP:
+                    close_connection()
+                    return
+
+    def _write(self, rows, label="analyse(s)", max_retries=3):
+        # rows : liste de (sql, ligne) ; un executemany par requête, dans une seule transaction
+        by_sql = {}
+        for sql, row in rows:
+            by_sql.setdefault(sql, []).append(row)
+        error = None
+        for attempt in range(max_retries):
+            try:
+                conn = get_connection()
+                with conn:
+                    for sql, sql_rows in by_sql.items():
+                        conn.executemany(sql, sql_rows)
+                if _INSERT_ANALYSIS_SQL in by_sql:
+                    bump_generation("analyses")
+                return None
+            except sqlite3.OperationalError as e:
+                error = e
+                # Seul un verrou ("database is locked" / "busy") justifie un nouvel essai ;
+                # une erreur de schéma ou de requête échoue tout de suite
+                if "locked" not in str(e) and "busy" not in str(e):
+                    break
+                time.sleep(0.2 * (attempt + 1))
+            except Exception as e:
+                error = e
+                break
+        print(f"⚠️ Écriture groupée de {len(rows)} {label} échouée : {error}")
+        return error
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_analysis_writer():
+    """Écrivain partagé par le processus (créé au premier appel)"""
+    global _writer
+    with _writer_lock:
+        if _writer is None or _writer.closed:
+            _writer = AnalysisWriter()
+        return _writer
+
+def shutdown_analysis_writer(timeout=10.0):
+    """Valide les analyses encore en file (appelé automatiquement à l'arrêt du processus)"""
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.close(timeout)
 
-def get_all_analyses():
-    """Récupère toutes les analyses avec les informations de l'offre d'emploi"""
-    conn = sqlite3.connect(DB_PATH)
+atexit.register(shutdown_analysis_writer)
+
+def insert_analysis(filename, analysis, job_offer_id, input_mode=None, pdf_sha256=None):
+    """Met en file une analyse de CV liée à une offre d'emploi.
+    `input_mode` : "text" ou "pdf" selon ce qui a été envoyé à Gemini ; `pdf_sha256` permet
+    de retrouver l'analyse d'un quasi-doublon. Une analyse réutilisée porte "doublon_de".
+    L'écriture est groupée en arrière-plan ; retourne un WriteTicket à attendre si besoin.
+    """
+    return get_analysis_writer().submit(_analysis_row(filename, analysis, job_offer_id, input_mode, pdf_sha256))
+
+def wait_for_writes(tickets, timeout=None):
+    """Attend que toutes les analyses mises en file soient validées ; True si aucune erreur"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    ok = True
+    for ticket in tickets:
+        remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+        ok = ticket.wait(remaining) and ok
+    return ok
+
+def _since_clause(column, since_days):
+    # Filtre "N derniers jours" évalué par SQLite sur l'horodatage ISO
+    if since_days is None:
+        return "", ()
+    return f"WHERE {column} >= datetime('now', 'localtime', ?)", (f"-{int(since_days)} days",)
+
+def get_all_analyses(since_days=None):
+    """Récupère toutes les analyses (les plus récentes d'abord) avec les informations de l'offre d'emploi.
+    `since_days` limite aux analyses des N derniers jours.
+    """
+    conn = get_connection()
     c = conn.cursor()
+    where, params = _since_clause("a.date", since_days)
     
     try:
-        # Vérifier la structure de la table
-        c.execute("PRAGMA table_info(analyses)")
-        columns = [column[1] for column in c.fetchall()]
-        
-        if 'job_offer_id' in columns:
-            # Nouvelle structure avec job_offer_id
-            c.execute('''
-                SELECT a.nom_prenom, a.score_global, a.score_technique, a.score_experience, 
-                       a.score_formation, a.score_soft_skills, a.commentaire, a.date,
-                       j.title as job_title, a.job_offer_id
-                FROM analyses a
-                LEFT JOIN job_offers j ON a.job_offer_id = j.id
-                ORDER BY a.id DESC
-            ''')
-        else:
-            # Ancienne structure sans job_offer_id
-            c.execute('''
-                SELECT nom_prenom, score_global, score_technique, score_experience, 
-                       score_formation, score_soft_skills, commentaire, date,
-                       'Non spécifiée' as job_title, NULL as job_offer_id
-                FROM analyses 
-                ORDER BY id DESC
-            ''')
-        
+        c.execute(f'''
+            SELECT a.nom_prenom, a.score_global, a.score_technique, a.score_experience, 
+                   a.score_formation, a.score_soft_skills, a.commentaire, a.date,
+                   j.title as job_title, a.job_offer_id
+            FROM analyses a
+            LEFT JOIN job_offers j ON a.job_offer_id = j.id
+            {where}
+            ORDER BY a.date DESC, a.id DESC
+        ''', params)
         rows = c.fetchall()
-        conn.close()
         return rows
         
     except Exception as e:
         print(f"Erreur dans get_all_analyses: {e}")
-        conn.close()
         return []
 
+def _history_where(job_offer_id=None, score_min=None, score_max=None, recommandation=None, since_days=None):
+    clauses, params = [], []
+    if job_offer_id:
+        clauses.append("a.job_offer_id = ?")
+        params.append(job_offer_id)
+    if score_min is not None:
+        clauses.append("a.score_global >= ?")
+        params.append(score_min)
+    if score_max is not None:
+        clauses.append("a.score_global <= ?")
+        params.append(score_max)
+    if recommandation:
+        clauses.append("a.recommandation = ?")
+        params.append(recommandation)
+    if since_days is not None:
+        clauses.append("a.date >= datetime('now', 'localtime', ?)")
+        params.append(f"-{int(since_days)} days")
+    return clauses, params
+
+def get_analyses_page(job_offer_id=None, score_min=None, score_max=None, recommandation=None,
+                      since_days=None, after=None, limit=HISTORY_PAGE_SIZE):
+    """Page de l'historique, des plus récentes aux plus anciennes (pagination par clé sur (date, id)).
+    `after` est le curseur renvoyé par l'appel précédent. Retourne (rows, next_cursor) ;
+    next_cursor vaut None sur la dernière page. Colonnes : id, nom_prenom, score_global,
+    score_technique, score_experience, score_formation, score_soft_skills,
+    commentaire (101 premiers caractères), date, job_title, job_offer_id, recommandation.
+    """
+    clauses, params = _history_where(job_offer_id, score_min, score_max, recommandation, since_days)
+    if after:
+        clauses.append("(a.date, a.id) < (?, ?)")
+        params.extend(after)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT a.id, a.nom_prenom, a.score_global, a.score_technique, a.score_experience,
+               a.score_formation, a.score_soft_skills, substr(a.commentaire, 1, 101), a.date,
+               j.title as job_title, a.job_offer_id, a.recommandation
+        FROM analyses a
+        LEFT JOIN job_offers j ON a.job_offer_id = j.id
+        {where}
+        ORDER BY a.date DESC, a.id DESC
+        LIMIT ?
+    ''', (*params, limit + 1))
+    rows = c.fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = (rows[-1][8], rows[-1][0])
+    return rows, next_cursor
+
+def get_analyses_summary(job_offer_id=None, score_min=None, score_max=None, recommandation=None, since_days=None):
+    """Agrégats de l'historique filtré : (nombre, score moyen, meilleur score)"""
+    conn = get_connection()
+    c = conn.cursor()
+    if score_min is None and score_max is None and not recommandation and since_days is None:
+        # Sans filtre fin, les agrégats maintenus par offre suffisent
+        where, params = ("WHERE job_offer_id = ?", (job_offer_id,)) if job_offer_id else ("", ())
+        c.execute(f'''
+            SELECT COALESCE(SUM(nb_analyses), 0),
+                   CASE WHEN SUM(nb_scored) > 0 THEN SUM(score_sum) * 1.0 / SUM(nb_scored) END,
+                   MAX(score_max)
+            FROM job_offer_stats
+            {where}
+        ''', params)
+        return c.fetchone()
+    clauses, params = _history_where(job_offer_id, score_min, score_max, recommandation, since_days)
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    c.execute(f'''
+        SELECT COUNT(*), AVG(a.score_global), MAX(a.score_global)
+        FROM analyses a
+        {where}
+    ''', params)
+    return c.fetchone()
+
 def get_analyses_by_job_offer(job_offer_id):
     """Récupère toutes les analyses pour une offre d'emploi spécifique"""
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
         SELECT a.nom_prenom, a.score_global, a.score_technique, a.score_experience, 
@@ -168,59 +1087,185 @@ def get_analyses_by_job_offer(job_offer_id):
         ORDER BY a.score_global DESC
     ''', (job_offer_id,))
     rows = c.fetchall()
-    conn.close()
     return rows
 
-def get_all_job_offers():
-    """Récupère toutes les offres d'emploi avec le nombre d'analyses"""
-    conn = sqlite3.connect(DB_PATH)
+def get_all_job_offers(since_days=None):
+    """Récupère toutes les offres d'emploi (les plus récentes d'abord) avec le nombre d'analyses.
+    `since_days` limite aux offres créées dans les N derniers jours.
+    """
+    conn = get_connection()
     c = conn.cursor()
+    where, params = _since_clause("j.created_date", since_days)
     
     try:
-        # Vérifier si la table job_offers existe
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='job_offers'")
-        if not c.fetchone():
-            conn.close()
-            return []
-        
-        c.execute('''
-            SELECT j.id, j.title, j.created_date, COUNT(a.id) as nb_analyses
+        c.execute(f'''
+            SELECT j.id, j.title, j.created_date, COALESCE(s.nb_analyses, 0) as nb_analyses
             FROM job_offers j
-            LEFT JOIN analyses a ON j.id = a.job_offer_id
-            GROUP BY j.id, j.title, j.created_date
-            ORDER BY j.created_date DESC
-        ''')
+            LEFT JOIN job_offer_stats s ON s.job_offer_id = j.id
+            {where}
+            ORDER BY j.created_date DESC, j.id
+        ''', params)
         rows = c.fetchall()
-        conn.close()
         return rows
         
     except Exception as e:
         print(f"Erreur dans get_all_job_offers: {e}")
-        conn.close()
         return []
 
 def get_job_offer_stats(job_offer_id):
-    """Récupère les statistiques d'une offre d'emploi"""
-    conn = sqlite3.connect(DB_PATH)
+    """Récupère les statistiques d'une offre d'emploi (table job_offer_stats, sans parcourir les analyses).
+    Renvoie (total_cv, score_moyen, meilleur_score, score_min).
+    """
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
-        SELECT 
-            COUNT(*) as total_cv,
-            AVG(score_global) as score_moyen,
-            MAX(score_global) as meilleur_score,
-            MIN(score_global) as score_min
-        FROM analyses
+        SELECT nb_analyses,
+               CASE WHEN nb_scored > 0 THEN score_sum * 1.0 / nb_scored END,
+               score_max,
+               score_min
+        FROM job_offer_stats
         WHERE job_offer_id = ?
     ''', (job_offer_id,))
     row = c.fetchone()
-    conn.close()
-    return row
+    return row or (0, None, None, None)
+
+def get_job_offer_score_histogram(job_offer_id):
+    """Nombre de CV par tranche de 10 points de score global (liste de 10 entiers)"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT bucket, nb FROM job_offer_score_histogram
+        WHERE job_offer_id = ?
+    ''', (job_offer_id,))
+    histogram = [0] * 10
+    for bucket, nb in c.fetchall():
+        histogram[bucket] = nb
+    return histogram
+
+def get_analysis_details(analysis_id):
+    """Retourne l'analyse Gemini complète (dict) d'une ligne de la table analyses, ou None"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT analysis_json FROM analyses WHERE id = ?', (analysis_id,))
+    row = c.fetchone()
+    if not row or not row[0]:
+        return None
+    try:
+        return json.loads(row[0])
+    except json.JSONDecodeError:
+        return None
+
+def find_candidates_by_skill(skill, kind="matchee", min_score=None, job_offer_id=None, limit=200):
+    """Candidats ayant une compétence donnée (toutes offres par défaut), meilleurs scores d'abord.
+    `kind` : "matchee", "manquante" ou "deduite". Retourne des tuples
+    (analysis_id, nom_prenom, score_global, job_offer_id, job_title, date, filename).
+    """
+    clauses, params = ["s.name_norm = ?", "k.kind = ?"], [_skill_key(skill), kind]
+    if min_score is not None:
+        clauses.append("k.score_global >= ?")
+        params.append(min_score)
+    if job_offer_id:
+        clauses.append("k.job_offer_id = ?")
+        params.append(job_offer_id)
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT a.id, a.nom_prenom, a.score_global, a.job_offer_id, j.title, a.date, a.filename
+        FROM skills s
+        JOIN analysis_skills k ON k.skill_id = s.id
+        JOIN analyses a ON a.id = k.analysis_id
+        LEFT JOIN job_offers j ON j.id = a.job_offer_id
+        WHERE {" AND ".join(clauses)}
+        ORDER BY k.score_global DESC, a.id DESC
+        LIMIT ?
+    ''', (*params, limit))
+    return c.fetchall()
+
+def get_top_skills(job_offer_id=None, kind="manquante", limit=15):
+    """Compétences les plus fréquentes d'un type donné : [(libellé, nombre de CV)]"""
+    where, params = ("WHERE k.kind = ? AND k.job_offer_id = ?", (kind, job_offer_id)) if job_offer_id \
+        else ("WHERE k.kind = ?", (kind,))
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT s.label, COUNT(*) AS nb
+        FROM analysis_skills k
+        JOIN skills s ON s.id = k.skill_id
+        {where}
+        GROUP BY k.skill_id
+        ORDER BY nb DESC, s.label
+        LIMIT ?
+    ''', (*params, limit))
+    return c.fetchall()
+
+def _fts_query(text):
+    # Saisie libre -> requête FTS5 sûre : chaque mot est un préfixe, tous les mots sont requis
+    terms = [t.replace('"', '""') for t in str(text).split() if t.strip('"')]
+    return " ".join(f'"{t}"*' for t in terms)
+
+def search_analyses(query, job_offer_id=None, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Recherche classée (bm25) dans les noms, commentaires et compétences des candidats.
+    Retourne (rows, has_more) ; rows = (analysis_id, nom_prenom, score_global, job_title,
+    job_offer_id, date, extrait du passage trouvé).
+    """
+    match = _fts_query(query)
+    if not match:
+        return [], False
+    params = [match]
+    offer_clause = ""
+    if job_offer_id:
+        offer_clause = "AND a.job_offer_id = ?"
+        params.append(job_offer_id)
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        c.execute(f'''
+            SELECT a.id, a.nom_prenom, a.score_global, j.title, a.job_offer_id, a.date,
+                   snippet(analyses_fts, -1, '**', '**', '…', 12)
+            FROM analyses_fts
+            JOIN analyses a ON a.id = analyses_fts.rowid
+            LEFT JOIN job_offers j ON j.id = a.job_offer_id
+            WHERE analyses_fts MATCH ? {offer_clause}
+            ORDER BY bm25(analyses_fts, 10.0, 1.0, 4.0)
+            LIMIT ? OFFSET ?
+        ''', (*params, limit + 1, offset))
+        rows = c.fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Erreur dans search_analyses: {e}")
+        return [], False
+    return rows[:limit], len(rows) > limit
+
+def search_job_offers(query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """Recherche classée (bm25) dans les titres et contenus des offres.
+    Retourne (rows, has_more) ; rows = (id, title, created_date, nb_analyses, extrait).
+    """
+    match = _fts_query(query)
+    if not match:
+        return [], False
+    conn = get_connection()
+    c = conn.cursor()
+    try:
+        c.execute('''
+            SELECT j.id, j.title, j.created_date, COALESCE(s.nb_analyses, 0),
+                   snippet(job_offers_fts, 2, '**', '**', '…', 16)
+            FROM job_offers_fts
+            JOIN job_offers j ON j.id = job_offers_fts.id
+            LEFT JOIN job_offer_stats s ON s.job_offer_id = j.id
+            WHERE job_offers_fts MATCH ?
+            ORDER BY bm25(job_offers_fts, 0.0, 5.0, 1.0)
+            LIMIT ? OFFSET ?
+        ''', (match, limit + 1, offset))
+        rows = c.fetchall()
+    except sqlite3.OperationalError as e:
+        print(f"Erreur dans search_job_offers: {e}")
+        return [], False
+    return rows[:limit], len(rows) > limit
 
 def get_job_offer_by_id(job_offer_id: str):
     """Retourne une offre d'emploi par ID.
     Renvoie un tuple (id, title, content, created_date) ou None si introuvable.
     """
-    conn = sqlite3.connect(DB_PATH)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
         SELECT id, title, content, created_date
@@ -229,5 +1274,679 @@ def get_job_offer_by_id(job_offer_id: str):
         LIMIT 1
     ''', (job_offer_id,))
     row = c.fetchone()
-    conn.close()
     return row
+
+def make_analysis_cache_key(pdf_sha256, job_offer_id, model, prompt_hash):
+    """Clé de cache : combinaison du hash du PDF, de l'offre, du modèle et du prompt"""
+    raw = f"{pdf_sha256}|{job_offer_id}|{model}|{prompt_hash}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def get_cached_analysis(pdf_sha256, job_offer_id, model, prompt_hash, max_age_days=CACHE_MAX_AGE_DAYS):
+    """Retourne {"content", "tokens", "input_mode"} si une analyse identique est en cache, sinon None"""
+    key = make_analysis_cache_key(pdf_sha256, job_offer_id, model, prompt_hash)
+    now = time.time()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT content, prompt_tokens, completion_tokens, total_tokens, created_at, input_mode
+        FROM analysis_cache
+        WHERE cache_key = ?
+    ''', (key,))
+    row = c.fetchone()
+    if not row or row[4] < now - max_age_days * 86400:
+        return None
+    with conn:
+        c.execute('''
+            UPDATE analysis_cache SET last_used_at = ?, hits = hits + 1
+            WHERE cache_key = ?
+        ''', (now, key))
+    return {
+        "content": row[0],
+        "tokens": {"prompt": row[1], "completion": row[2], "total": row[3]},
+        "input_mode": row[5],
+    }
+
+def put_cached_analysis(pdf_sha256, job_offer_id, model, prompt_hash, content, tokens, input_mode=None):
+    """Enregistre (ou remplace) une réponse Gemini dans le cache puis applique l'éviction"""
+    key = make_analysis_cache_key(pdf_sha256, job_offer_id, model, prompt_hash)
+    tokens = tokens or {}
+    now = time.time()
+    conn = get_connection()
+    c = conn.cursor()
+    with conn:
+        c.execute('''
+            INSERT OR REPLACE INTO analysis_cache (
+                cache_key, pdf_sha256, job_offer_id, model, prompt_hash, content,
+                prompt_tokens, completion_tokens, total_tokens, size_bytes,
+                created_at, last_used_at, hits, input_mode
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 0, ?)
+        ''', (
+            key, pdf_sha256, job_offer_id, model, prompt_hash, content,
+            tokens.get("prompt"), tokens.get("completion"), tokens.get("total"),
+            len(content.encode("utf-8")), now, now, input_mode,
+        ))
+    evict_analysis_cache()
+
+def evict_analysis_cache(max_age_days=CACHE_MAX_AGE_DAYS, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+    """Supprime les entrées expirées puis les moins récemment utilisées au-delà des limites.
+    Retourne le nombre d'entrées supprimées.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    with conn:
+        c.execute('DELETE FROM analysis_cache WHERE created_at < ?', (time.time() - max_age_days * 86400,))
+        removed = c.rowcount
+        # Au-delà du nombre maximal d'entrées (LRU)
+        c.execute('''
+            DELETE FROM analysis_cache WHERE cache_key IN (
+                SELECT cache_key FROM analysis_cache
+                ORDER BY last_used_at DESC
+                LIMIT -1 OFFSET ?
+            )
+        ''', (max_entries,))
+        removed += c.rowcount
+        # Au-delà de la taille maximale cumulée (LRU)
+        c.execute('''
+            DELETE FROM analysis_cache WHERE cache_key IN (
+                SELECT cache_key FROM (
+                    SELECT cache_key,
+                           SUM(size_bytes) OVER (ORDER BY last_used_at DESC, cache_key) AS cumul
+                    FROM analysis_cache
+                )
+                WHERE cumul > ?
+            )
+        ''', (max_bytes,))
+        removed += c.rowcount
+    return removed
+
+# États d'un item de lot ; "running" restant après un arrêt brutal est repris comme "pending"
+BATCH_ITEM_STATUSES = ("pending", "running", "done", "failed", "skipped")
+
+# File d'attente (worker.py) : durée du bail d'un item réservé et nombre maximal de tentatives
+BATCH_ITEM_LEASE_SECONDS = 600
+BATCH_MAX_ATTEMPTS = 3
+
+def create_batch_job(job_offer_id, source, items, options=None):
+    """Crée un lot et ses items ; `items` : liste de (filename, path). Retourne l'id du lot"""
+    now = _now()
+    conn = get_connection()
+    c = conn.cursor()
+    with conn:
+        c.execute('''
+            INSERT INTO batch_jobs (job_offer_id, source, status, options_json, created_at, updated_at)
+            VALUES (?, ?, 'pending', ?, ?, ?)
+        ''', (job_offer_id, source, json.dumps(options or {}, ensure_ascii=False), now, now))
+        job_id = c.lastrowid
+        c.executemany('''
+            INSERT OR IGNORE INTO batch_items (job_id, filename, path, updated_at) VALUES (?, ?, ?, ?)
+        ''', [(job_id, filename, path, now) for filename, path in items])
+    return job_id
+
+def add_batch_items(job_id, items):
+    """Ajoute à un lot existant les fichiers qui n'y sont pas encore ; retourne le nombre ajouté"""
+    now = _now()
+    conn = get_connection()
+    with conn:
+        before = conn.total_changes
+        conn.executemany('''
+            INSERT OR IGNORE INTO batch_items (job_id, filename, path, updated_at) VALUES (?, ?, ?, ?)
+        ''', [(job_id, filename, path, now) for filename, path in items])
+        return conn.total_changes - before
+
+def get_batch_job(job_id):
+    """Retourne le lot sous forme de dict (avec le décompte des items par état), ou None"""
+    conn = get_connection()
+    row = conn.execute('''
+        SELECT id, job_offer_id, source, status, options_json, created_at, updated_at
+        FROM batch_jobs WHERE id = ?
+    ''', (job_id,)).fetchone()
+    if not row:
+        return None
+    counts = dict(conn.execute(
+        'SELECT status, COUNT(*) FROM batch_items WHERE job_id = ? GROUP BY status', (job_id,)
+    ).fetchall())
+    return {
+        "id": row[0], "job_offer_id": row[1], "source": row[2], "status": row[3],
+        "options": json.loads(row[4] or "{}"), "created_at": row[5], "updated_at": row[6],
+        "counts": {status: counts.get(status, 0) for status in BATCH_ITEM_STATUSES},
+    }
+
+def find_batch_job(job_offer_id, source):
+    """Dernier lot pour cette offre et ce dossier (reprise), ou None"""
+    row = get_connection().execute('''
+        SELECT id FROM batch_jobs
+        WHERE job_offer_id = ? AND source = ?
+        ORDER BY id DESC LIMIT 1
+    ''', (job_offer_id, source)).fetchone()
+    return row[0] if row else None
+
+def list_batch_jobs(limit=20):
+    """Derniers lots : (id, job_offer_id, source, status, created_at, total, done, failed)"""
+    return get_connection().execute('''
+        SELECT j.id, j.job_offer_id, j.source, j.status, j.created_at,
+               COUNT(i.id),
+               COALESCE(SUM(i.status = 'done'), 0),
+               COALESCE(SUM(i.status = 'failed'), 0)
+        FROM batch_jobs j
+        LEFT JOIN batch_items i ON i.job_id = j.id
+        GROUP BY j.id
+        ORDER BY j.id DESC
+        LIMIT ?
+    ''', (limit,)).fetchall()
+
+def get_batch_items(job_id, statuses=("pending", "running")):
+    """Items d'un lot dans les états donnés : (id, filename, path, status, attempts)"""
+    placeholders = ", ".join("?" for _ in statuses)
+    return get_connection().execute(f'''
+        SELECT id, filename, path, status, attempts
+        FROM batch_items
+        WHERE job_id = ? AND status IN ({placeholders})
+        ORDER BY id
+    ''', (job_id, *statuses)).fetchall()
+
+def set_batch_job_status(job_id, status):
+    conn = get_connection()
+    with conn:
+        conn.execute('UPDATE batch_jobs SET status = ?, updated_at = ? WHERE id = ?', (status, _now(), job_id))
+
+def start_batch_items(item_ids):
+    """Marque des items en cours et compte la tentative"""
+    now = _now()
+    conn = get_connection()
+    with conn:
+        conn.executemany('''
+            UPDATE batch_items SET status = 'running', attempts = attempts + 1, error = NULL, updated_at = ?
+            WHERE id = ?
+        ''', [(now, item_id) for item_id in item_ids])
+
+def complete_batch_item(item_id, filename=None, analysis=None, job_offer_id=None, input_mode=None, error=None,
+                        content=None, cached=False, cost_usd=None, pdf_sha256=None):
+    """Clôt un item : "done" (avec insertion de l'analyse si fournie) ou "failed" si `error`.
+    L'analyse et l'état de l'item sont écrits dans la même transaction : un arrêt brutal
+    ne peut pas laisser une analyse enregistrée sur un item encore à refaire.
+    `content` (réponse JSON), `cached` et `cost_usd` sont conservés pour le suivi du lot ;
+    le PDF stocké en base est libéré une fois l'item réussi.
+    """
+    conn = get_connection()
+    c = conn.cursor()
+    analysis_id = None
+    with conn:
+        if analysis is not None and error is None:
+            c.execute(_INSERT_ANALYSIS_SQL, _analysis_row(filename, analysis, job_offer_id, input_mode, pdf_sha256))
+            analysis_id = c.lastrowid
+        c.execute('''
+            UPDATE batch_items
+            SET status = ?, error = ?, analysis_id = COALESCE(?, analysis_id), updated_at = ?,
+                completed_at = ?, result_json = ?, cached = ?, cost_usd = ?, input_mode = ?,
+                claimed_by = NULL,
+                pdf_blob = CASE WHEN ? IS NULL THEN NULL ELSE pdf_blob END
+            WHERE id = ?
+        ''', ("failed" if error else "done", error, analysis_id, _now(), time.time(), content,
+              int(bool(cached)), cost_usd, input_mode, error, item_id))
+    if analysis_id is not None:
+        bump_generation("analyses")
+    return analysis_id
+
+def skip_batch_items(skipped):
+    """Écarte des items sans analyse (pré-sélection) ; `skipped` : liste de (item_id, motif)"""
+    now = _now()
+    conn = get_connection()
+    with conn:
+        conn.executemany('''
+            UPDATE batch_items SET status = 'skipped', error = ?, claimed_by = NULL, completed_at = ?, updated_at = ?
+            WHERE id = ?
+        ''', [(reason, time.time(), now, item_id) for item_id, reason in skipped])
+
+def enqueue_batch_job(job_offer_id, files, options=None, source="interface"):
+    """Met un lot en file pour worker.py ; `files` : liste de (filename, pdf_bytes).
+    Les PDF sont stockés en base ; un nom de fichier en double est suffixé. Retourne l'id du lot.
+    """
+    now = _now()
+    seen = {}
+    rows = []
+    for filename, pdf_bytes in files:
+        seen[filename] = seen.get(filename, 0) + 1
+        name = filename if seen[filename] == 1 else f"{filename} ({seen[filename]})"
+        rows.append((name, sqlite3.Binary(pdf_bytes), hashlib.sha256(pdf_bytes).hexdigest(), now))
+    conn = get_connection()
+    c = conn.cursor()
+    with conn:
+        c.execute('''
+            INSERT INTO batch_jobs (job_offer_id, source, status, options_json, created_at, updated_at, runner)
+            VALUES (?, ?, 'queued', ?, ?, ?, 'worker')
+        ''', (job_offer_id, source, json.dumps(options or {}, ensure_ascii=False), now, now))
+        job_id = c.lastrowid
+        c.executemany('''
+            INSERT INTO batch_items (job_id, filename, pdf_blob, pdf_sha256, updated_at) VALUES (?, ?, ?, ?, ?)
+        ''', [(job_id, *row) for row in rows])
+    return job_id
+
+# Réservation équitable : l'item suivant est pris dans le lot actif qui a le moins d'items
+# en cours, de sorte que plusieurs lots soumis en même temps avancent au même rythme
+_CLAIM_BATCH_ITEM_SQL = '''
+    WITH next_job AS (
+        SELECT j.id FROM batch_jobs j
+        WHERE j.runner = 'worker' AND j.status IN ('queued', 'running')
+          AND EXISTS (SELECT 1 FROM batch_items p WHERE p.job_id = j.id AND p.status = 'pending')
+        ORDER BY (SELECT COUNT(*) FROM batch_items r WHERE r.job_id = j.id AND r.status = 'running'), j.id
+        LIMIT 1
+    )
+    UPDATE batch_items
+    SET status = 'running', attempts = attempts + 1, error = NULL,
+        claimed_by = ?, claimed_at = ?, updated_at = ?
+    WHERE id = (
+        SELECT id FROM batch_items
+        WHERE job_id = (SELECT id FROM next_job) AND status = 'pending'
+        ORDER BY id LIMIT 1
+    )
+    RETURNING id, job_id, filename, path, attempts, pdf_blob
+'''
+
+def claim_batch_item(worker):
+    """Réserve atomiquement le prochain item en file pour `worker`.
+    Retourne un dict (item, offre et options du lot) ou None si la file est vide.
+    """
+    conn = get_connection()
+    with conn:
+        row = conn.execute(_CLAIM_BATCH_ITEM_SQL, (worker, time.time(), _now())).fetchone()
+        if not row:
+            return None
+        conn.execute('''
+            UPDATE batch_jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'
+        ''', (_now(), row[1]))
+        job_offer_id, options_json = conn.execute(
+            'SELECT job_offer_id, options_json FROM batch_jobs WHERE id = ?', (row[1],)
+        ).fetchone()
+    return {
+        "id": row[0], "job_id": row[1], "filename": row[2], "path": row[3], "attempts": row[4],
+        "pdf_bytes": bytes(row[5]) if row[5] is not None else None,
+        "job_offer_id": job_offer_id, "options": json.loads(options_json or "{}"),
+    }
+
+def release_batch_items(worker):
+    """Remet en file les items réservés par un worker qui s'arrête proprement"""
+    conn = get_connection()
+    with conn:
+        c = conn.execute('''
+            UPDATE batch_items SET status = 'pending', attempts = MAX(attempts - 1, 0),
+                claimed_by = NULL, updated_at = ?
+            WHERE status = 'running' AND claimed_by = ?
+        ''', (_now(), worker))
+        return c.rowcount
+
+def requeue_stale_batch_items(lease_seconds=BATCH_ITEM_LEASE_SECONDS, max_attempts=BATCH_MAX_ATTEMPTS):
+    """Reprend les items dont le worker a disparu (bail expiré) : remis en file,
+    ou en échec au-delà de `max_attempts`. Retourne le nombre d'items repris.
+    """
+    conn = get_connection()
+    now = time.time()
+    with conn:
+        # Un item abandonné est terminé (completed_at) : le suivi des lots doit le voir
+        rows = conn.execute('''
+            UPDATE batch_items
+            SET status = CASE WHEN attempts >= ?1 THEN 'failed' ELSE 'pending' END,
+                error = CASE WHEN attempts >= ?1 THEN 'Abandonné : délai de traitement dépassé' END,
+                completed_at = CASE WHEN attempts >= ?1 THEN ?2 END,
+                claimed_by = NULL, updated_at = ?3
+            WHERE status = 'running' AND claimed_at < ?4
+              AND job_id IN (SELECT id FROM batch_jobs WHERE runner = 'worker')
+            RETURNING job_id, status
+        ''', (max_attempts, now, _now(), now - lease_seconds)).fetchall()
+    for job_id in {job_id for job_id, status in rows if status == "failed"}:
+        finish_batch_job_if_complete(job_id)
+    return len(rows)
+
+def finish_batch_job_if_complete(job_id):
+    """Passe le lot à "done" (ou "failed" s'il reste des échecs) quand plus rien n'est en file"""
+    conn = get_connection()
+    with conn:
+        conn.execute('''
+            UPDATE batch_jobs
+            SET status = CASE WHEN EXISTS (SELECT 1 FROM batch_items WHERE job_id = ?1 AND status = 'failed')
+                              THEN 'failed' ELSE 'done' END,
+                updated_at = ?2
+            WHERE id = ?1 AND status IN ('queued', 'running')
+              AND NOT EXISTS (SELECT 1 FROM batch_items WHERE job_id = ?1 AND status IN ('pending', 'running'))
+        ''', (job_id, _now()))
+
+def get_batch_item_results(job_id, since=None, since_id=0):
+    """Items terminés d'un lot (les plus anciens d'abord), strictement après le curseur
+    (`since`, `since_id`) = (completed_at, id) du dernier item déjà lu :
+    (id, filename, status, error, result_json, cached, cost_usd, input_mode, completed_at)
+    """
+    return get_connection().execute('''
+        SELECT id, filename, status, error, result_json, cached, cost_usd, input_mode, completed_at
+        FROM batch_items
+        WHERE job_id = ?1 AND (completed_at > ?2 OR (completed_at = ?2 AND id > ?3))
+        ORDER BY completed_at, id
+    ''', (job_id, since or 0.0, since_id or 0)).fetchall()
+
+def acquire_rate_token(name, rate_per_minute, burst=None):
+    """Seau à jetons stocké en base, partagé par tous les processus.
+    Consomme un jeton et retourne 0, ou retourne le délai (s) avant qu'un jeton soit disponible.
+    """
+    rate = rate_per_minute / 60.0
+    capacity = float(burst or max(1, int(rate_per_minute // 10)))
+    now = time.time()
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        row = c.execute('SELECT tokens, updated_at FROM rate_limits WHERE name = ?', (name,)).fetchone()
+        tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        c.execute('INSERT OR REPLACE INTO rate_limits (name, tokens, updated_at) VALUES (?, ?, ?)',
+                  (name, tokens, now))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return wait
+
+def put_cv_fingerprint(job_offer_id, pdf_sha256, filename, signature, buckets):
+    """Enregistre l'empreinte d'un CV pour une offre ; `buckets` : liste de (bande, seau)"""
+    conn = get_connection()
+    with conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO cv_fingerprints (job_offer_id, pdf_sha256, filename, signature, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (job_offer_id, pdf_sha256, filename, signature, _now()))
+        conn.executemany('''
+            INSERT OR IGNORE INTO cv_lsh_buckets (job_offer_id, band, bucket, pdf_sha256) VALUES (?, ?, ?, ?)
+        ''', [(job_offer_id, band, bucket, pdf_sha256) for band, bucket in buckets])
+
+def find_fingerprint_candidates(job_offer_id, buckets):
+    """CV déjà vus pour cette offre partageant au moins une bande LSH : (pdf_sha256, filename, signature)"""
+    if not buckets:
+        return []
+    values = ", ".join("(?, ?)" for _ in buckets)
+    return get_connection().execute(f'''
+        SELECT f.pdf_sha256, f.filename, f.signature
+        FROM cv_fingerprints f
+        WHERE f.job_offer_id = ? AND f.pdf_sha256 IN (
+            SELECT b.pdf_sha256 FROM cv_lsh_buckets b
+            WHERE b.job_offer_id = ? AND (b.band, b.bucket) IN (VALUES {values})
+        )
+    ''', [job_offer_id, job_offer_id] + [v for pair in buckets for v in pair]).fetchall()
+
+def get_analysis_by_pdf(job_offer_id, pdf_sha256):
+    """Dernière analyse complète d'un PDF pour une offre : (id, filename, analysis_json) ou None"""
+    return get_connection().execute('''
+        SELECT id, filename, analysis_json
+        FROM analyses
+        WHERE job_offer_id = ? AND pdf_sha256 = ? AND analysis_json IS NOT NULL
+        ORDER BY id DESC LIMIT 1
+    ''', (job_offer_id, pdf_sha256)).fetchone()
+
+def save_prescreen_scores(job_offer_id, results, params=None):
+    """Enregistre un passage de pré-sélection (résultats de prescreen_batch) ; retourne son run_id"""
+    run_id = uuid.uuid4().hex[:12]
+    now = _now()
+    params_json = json.dumps(params or {}, ensure_ascii=False)
+    conn = get_connection()
+    with conn:
+        conn.executemany('''
+            INSERT INTO prescreen_scores (
+                run_id, job_offer_id, filename, pdf_sha256, score, bm25, keyword_hits, keywords_total,
+                rank, selected, reason, params_json, created_at
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(run_id, job_offer_id, r["filename"], r["pdf_sha256"], r["score"], r["bm25"], r["keyword_hits"],
+               r["keywords_total"], r["rank"], int(r["selected"]), r["reason"], params_json, now) for r in results])
+    bump_generation("prescreen")
+    return run_id
+
+def get_prescreen_runs(job_offer_id, limit=20):
+    """Derniers passages de pré-sélection d'une offre : (run_id, created_at, params_json, total, retenus)"""
+    return get_connection().execute('''
+        SELECT run_id, MIN(created_at), MIN(params_json), COUNT(*), SUM(selected)
+        FROM prescreen_scores
+        WHERE job_offer_id = ?
+        GROUP BY run_id
+        ORDER BY MIN(id) DESC
+        LIMIT ?
+    ''', (job_offer_id, limit)).fetchall()
+
+def get_prescreen_scores(run_id):
+    """Scores d'un passage, rang croissant (non notés en fin), avec le score Gemini s'il existe :
+    (filename, score, bm25, keyword_hits, keywords_total, rank, selected, reason, score_global)
+    """
+    return get_connection().execute('''
+        SELECT p.filename, p.score, p.bm25, p.keyword_hits, p.keywords_total, p.rank, p.selected, p.reason,
+               (SELECT a.score_global FROM analyses a
+                WHERE a.job_offer_id = p.job_offer_id AND a.pdf_sha256 = p.pdf_sha256
+                ORDER BY a.id DESC LIMIT 1)
+        FROM prescreen_scores p
+        WHERE p.run_id = ?
+        ORDER BY p.rank IS NULL, p.rank, p.id
+    ''', (run_id,)).fetchall()
+
+_INSERT_MODEL_CALL_SQL = '''
+    INSERT INTO model_calls (
+        ts, created_at, job_offer_id, model, kind, cvs, outcome, cache_hit, context_cached, input_mode,
+        prompt_tokens, completion_tokens, cached_tokens, total_tokens, cost_usd,
+        latency_ms, duration_ms, attempts, wait_ms, error, streamed, first_chunk_ms,
+        parse_status
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def record_model_call(job_offer_id, model, kind, outcome, cvs=1, cache_hit=False, context_cached=False,
+                      input_mode=None, tokens=None, cost_usd=None, latency_ms=None, duration_ms=None,
+                      attempts=None, wait_ms=None, error=None, streamed=False, first_chunk_ms=None,
+                      parse_status=None):
+    """Met en file une ligne de télémétrie (écrite par lots avec les analyses).
+    `outcome` : "ok", "invalid_json", "partial", "error", "cache" ou "duplicate".
+    `first_chunk_ms` : délai avant le premier fragment d'une réponse en streaming.
+    `parse_status` : "strict", "repaired" (réparé localement) ou "failed" ; kind "repair"
+    pour l'appel de correction qui suit un échec.
+    """
+    tokens = tokens or {}
+    row = (
+        time.time(), _now(), job_offer_id, model, kind, cvs, outcome, int(bool(cache_hit)), int(bool(context_cached)),
+        input_mode, tokens.get("prompt"), tokens.get("completion"), tokens.get("cached"), tokens.get("total"),
+        cost_usd, latency_ms, duration_ms, attempts, wait_ms, (str(error)[:500] if error else None),
+        int(bool(streamed)), first_chunk_ms, parse_status,
+    )
+    return get_analysis_writer().submit(row, _INSERT_MODEL_CALL_SQL)
+
+def _telemetry_where(since_days=None, job_offer_id=None, prefix=""):
+    clauses, params = [], []
+    if since_days is not None:
+        clauses.append(f"{prefix}ts >= ?")
+        params.append(time.time() - int(since_days) * 86400)
+    if job_offer_id:
+        clauses.append(f"{prefix}job_offer_id = ?")
+        params.append(job_offer_id)
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+def _telemetry_percentiles(conn, column, where, params):
+    # (p50, p95) d'une colonne de durée, None si aucune valeur
+    where = f"{where} {'AND' if where else 'WHERE'} {column} IS NOT NULL"
+    return conn.execute(f'''
+        WITH ranked AS (
+            SELECT {column} AS value,
+                   ROW_NUMBER() OVER (ORDER BY {column}) AS rn,
+                   COUNT(*) OVER () AS n
+            FROM model_calls {where}
+        )
+        SELECT MIN(CASE WHEN rn >= 0.50 * n THEN value END),
+               MIN(CASE WHEN rn >= 0.95 * n THEN value END)
+        FROM ranked
+    ''', params).fetchone()
+
+def get_telemetry_summary(since_days=None, job_offer_id=None):
+    """Indicateurs globaux : appels réels au modèle, CV, issues, tentatives, attentes, coût,
+    latence p50/p95, délai médian avant le premier fragment en streaming (ms) et lecture
+    des réponses : réparées localement, corrigées par un appel dédié, échecs restants.
+    Les CV servis par le cache ou un doublon comptent dans `cvs` et `served_without_call`,
+    pas dans `calls`.
+    """
+    where, params = _telemetry_where(since_days, job_offer_id)
+    conn = get_connection()
+    row = conn.execute(f'''
+        SELECT COALESCE(SUM(outcome NOT IN ('cache', 'duplicate')), 0),
+               COALESCE(SUM(cvs), 0),
+               COALESCE(SUM(outcome = 'ok'), 0),
+               COALESCE(SUM(outcome IN ('error', 'invalid_json', 'partial')), 0),
+               COALESCE(SUM(outcome IN ('cache', 'duplicate')), 0),
+               COALESCE(SUM(MAX(attempts - 1, 0)), 0),
+               COALESCE(SUM(wait_ms), 0) / 1000.0,
+               COALESCE(SUM(cost_usd), 0),
+               COALESCE(SUM(total_tokens), 0),
+               COALESCE(SUM(cached_tokens), 0),
+               MIN(ts), MAX(ts),
+               COALESCE(SUM(kind != 'repair' AND parse_status = 'repaired'), 0),
+               COALESCE(SUM(kind != 'repair' AND parse_status = 'failed'), 0),
+               COALESCE(SUM(kind = 'repair' AND outcome = 'ok'), 0),
+               COALESCE(SUM(kind != 'repair' AND parse_status IS NOT NULL), 0)
+        FROM model_calls {where}
+    ''', params).fetchone()
+    p50, p95 = _telemetry_percentiles(conn, "latency_ms", where, params)
+    first_chunk_p50, _ = _telemetry_percentiles(conn, "first_chunk_ms", where, params)
+    return {
+        "calls": row[0], "cvs": row[1], "ok": row[2], "errors": row[3], "served_without_call": row[4],
+        "retries": row[5], "wait_s": row[6], "cost_usd": row[7], "total_tokens": row[8],
+        "cached_tokens": row[9], "first_ts": row[10], "last_ts": row[11], "p50_ms": p50, "p95_ms": p95,
+        "first_chunk_p50_ms": first_chunk_p50, "parse_repaired": row[12], "parse_fixed": row[14],
+        "parse_failed": max(row[13] - row[14], 0),
+        "parse_failure_rate": max(row[13] - row[14], 0) / row[15] if row[15] else None,
+    }
+
+def get_telemetry_timeseries(since_days=None, job_offer_id=None, bucket="day"):
+    """Série par jour (ou par heure) : (période, appels, CV, erreurs, p50 ms, p95 ms, attente s, coût)"""
+    where, params = _telemetry_where(since_days, job_offer_id)
+    fmt = "%Y-%m-%d %H:00" if bucket == "hour" else "%Y-%m-%d"
+    return get_connection().execute(f'''
+        WITH calls AS (
+            SELECT strftime('{fmt}', ts, 'unixepoch', 'localtime') AS period, cvs, outcome, latency_ms, wait_ms, cost_usd,
+                   ROW_NUMBER() OVER (PARTITION BY strftime('{fmt}', ts, 'unixepoch', 'localtime')
+                                      ORDER BY latency_ms IS NULL, latency_ms) AS rn,
+                   COUNT(latency_ms) OVER (PARTITION BY strftime('{fmt}', ts, 'unixepoch', 'localtime')) AS n
+            FROM model_calls {where}
+        )
+        SELECT period, SUM(outcome NOT IN ('cache', 'duplicate')), SUM(cvs),
+               SUM(outcome IN ('error', 'invalid_json', 'partial')),
+               MIN(CASE WHEN latency_ms IS NOT NULL AND rn >= 0.50 * n THEN latency_ms END),
+               MIN(CASE WHEN latency_ms IS NOT NULL AND rn >= 0.95 * n THEN latency_ms END),
+               COALESCE(SUM(wait_ms), 0) / 1000.0,
+               COALESCE(SUM(cost_usd), 0)
+        FROM calls
+        GROUP BY period
+        ORDER BY period
+    ''', params).fetchall()
+
+def get_cost_by_job_offer(since_days=None):
+    """Coût par offre : (job_offer_id, titre, appels, CV, tokens, coût $), le plus cher d'abord"""
+    where, params = _telemetry_where(since_days, prefix="m.")
+    return get_connection().execute(f'''
+        SELECT m.job_offer_id, COALESCE(j.title, '—'), SUM(m.outcome NOT IN ('cache', 'duplicate')), SUM(m.cvs),
+               COALESCE(SUM(m.total_tokens), 0), COALESCE(SUM(m.cost_usd), 0)
+        FROM model_calls m
+        LEFT JOIN job_offers j ON j.id = m.job_offer_id
+        {where}
+        GROUP BY m.job_offer_id
+        ORDER BY 6 DESC
+    ''', params).fetchall()
+
+# Export de l'historique : lignes lues par paquets, mémoire constante quel que soit le volume
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+EXPORT_COLUMNS = (
+    "id", "date", "job_offer_id", "job_title", "filename", "nom_prenom", "score_global", "score_technique",
+    "score_experience", "score_formation", "score_soft_skills", "recommandation", "input_mode",
+    "pdf_sha256", "duplicate_of", "commentaire", "analysis_json",
+)
+
+def iter_analyses_export(job_offer_id=None, date_from=None, date_to=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Analyses à exporter (colonnes EXPORT_COLUMNS) par paquets de `chunk_size` lignes, des plus
+    anciennes aux plus récentes. `date_from` / `date_to` : jours "AAAA-MM-JJ" (ou date), inclus.
+    Le curseur est parcouru au fil de l'eau sur une connexion dédiée, fermée en fin de lecture.
+    """
+    clauses, params = _history_where(job_offer_id)
+    if date_from:
+        clauses.append("a.date >= ?")
+        params.append(str(date_from))
+    if date_to:
+        clauses.append("a.date < date(?, '+1 day')")
+        params.append(str(date_to))
+    where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+    conn = _open_connection(DB_PATH)
+    try:
+        c = conn.execute(f'''
+            SELECT a.id, a.date, a.job_offer_id, j.title, a.filename, a.nom_prenom, a.score_global,
+                   a.score_technique, a.score_experience, a.score_formation, a.score_soft_skills,
+                   a.recommandation, a.input_mode, a.pdf_sha256, a.duplicate_of, a.commentaire, a.analysis_json
+            FROM analyses a
+            LEFT JOIN job_offers j ON a.job_offer_id = j.id
+            {where}
+            ORDER BY a.date, a.id
+        ''', params)
+        while True:
+            rows = c.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+def _export_csv(chunks, out):
+    writer = csv.writer(out)
+    writer.writerow(EXPORT_COLUMNS)
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+def _export_ndjson(chunks, out):
+    # Une analyse par ligne ; le JSON complet de l'analyse est imbriqué sous "analysis"
+    count = 0
+    for rows in chunks:
+        lines = []
+        for row in rows:
+            record = dict(zip(EXPORT_COLUMNS, row))
+            raw = record.pop("analysis_json")
+            record["analysis"] = json.loads(raw) if raw else None
+            lines.append(json.dumps(record, ensure_ascii=False))
+        out.write("\n".join(lines) + "\n")
+        count += len(rows)
+    return count
+
+def _export_parquet(chunks, out, pa, pq):
+    # Un groupe de lignes Parquet par paquet lu ; scores en flottants : d'anciennes lignes
+    # peuvent porter un score REAL (55.5), conservé tel quel comme en CSV/NDJSON
+    schema = pa.schema([
+        (name, pa.float64() if name.startswith("score_")
+         else pa.int64() if name in ("id", "duplicate_of") else pa.string())
+        for name in EXPORT_COLUMNS
+    ])
+    count = 0
+    with pq.ParquetWriter(out, schema) as writer:
+        for rows in chunks:
+            writer.write_table(pa.Table.from_pylist([dict(zip(EXPORT_COLUMNS, row)) for row in rows], schema=schema))
+            count += len(rows)
+    return count
+
+def export_analyses(out, fmt="csv", job_offer_id=None, date_from=None, date_to=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """Exporte l'historique filtré (offre, période) en CSV, NDJSON ou Parquet.
+    `out` : chemin du fichier ou fichier ouvert (texte pour csv/ndjson, binaire pour parquet).
+    Retourne le nombre d'analyses exportées, ou None si l'export est impossible.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Format d'export inconnu : {fmt} (attendu : {', '.join(EXPORT_FORMATS)})")
+    chunks = iter_analyses_export(job_offer_id, date_from, date_to, chunk_size)
+    if fmt == "parquet":
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            print("⚠️ Export Parquet indisponible : installez pyarrow (pip install pyarrow).")
+            return None
+        return _export_parquet(chunks, out, pa, pq)
+    if hasattr(out, "write"):
+        return (_export_csv if fmt == "csv" else _export_ndjson)(chunks, out)
+    with open(out, "w", encoding="utf-8", newline="") as f:
+        return (_export_csv if fmt == "csv" else _export_ndjson)(chunks, f)
@@ -0,0 +1,201 @@
+# Client Gemini simulé, sans réseau : même interface que genai.Client pour les
+# appels utilisés par l'application (models.generate_content, caches.create/delete).
+# Sert aux essais hors ligne et à vérifier la réutilisation du préfixe de requête.
+# Les appels de correction du JSON (texte brut seul) renvoient la réponse réparée.
+import json
+import time
+import random
+import hashlib
+import threading
+from types import SimpleNamespace
+from json_stream import repair_json
+
+
+def _estimate_tokens(part):
+    # Approximation : ~4 caractères par token pour le texte, ~1 token / 100 octets de PDF
+    text = getattr(part, "text", None)
+    if text is not None:
+        return max(1, len(text) // 4)
+    inline = getattr(part, "inline_data", None)
+    if inline is not None and getattr(inline, "data", None):
+        return max(1, len(inline.data) // 100)
+    if isinstance(part, str):
+        return max(1, len(part) // 4)
+    return 0
+
+def _count_tokens(contents):
+    total = 0
+    for item in contents or []:
+        parts = getattr(item, "parts", None)
+        total += sum(_estimate_tokens(p) for p in parts) if parts is not None else _estimate_tokens(item)
+    return total
+
+def _cv_text(contents):
+    # Dernière partie texte commençant par l'en-tête du CV, sinon None (CV envoyé en PDF)
+    for item in contents or []:
+        text = getattr(item, "text", None)
+        if text and text.startswith("Voici le CV"):
+            return text
+    return None
+
+def _packed_cvs(contents):
+    # Mode groupé : parties "=== CV : <fichier> ===" → [(fichier, texte)]
+    packed = []
+    for item in contents or []:
+        text = getattr(item, "text", None)
+        if text and text.startswith("=== CV : "):
+            header, _, body = text.partition("\n")
+            packed.append((header[len("=== CV : "):].partition(" ===")[0], body))
+    return packed
+
+def fake_analysis(seed_text: str):
+    """Analyse déterministe dérivée du contenu du CV"""
+    digest = hashlib.sha256(seed_text.encode("utf-8", "ignore")).digest()
+    technique, experience = digest[0] % 41, digest[1] % 31
+    formation, soft = digest[2] % 16, digest[3] % 16
+    score = technique + experience + formation + soft
+    lines = [l.strip() for l in seed_text.splitlines() if l.strip() and not l.startswith(("Voici", "---"))]
+    recommandation = "Recommandé" if score >= 70 else "À considérer" if score >= 50 else "Non recommandé"
+    return {
+        "nom_prenom": (lines[0][:60] if lines else f"Candidat {digest.hex()[:6]}"),
+        "score_technique": technique,
+        "score_experience": experience,
+        "score_formation": formation,
+        "score_soft_skills": soft,
+        "score_global": score,
+        "points_forts": ["Profil simulé"],
+        "points_faibles": [],
+        "competences_matchees": ["Python"] if digest[4] % 2 else ["SQL"],
+        "competences_manquantes": ["Kubernetes"] if digest[5] % 2 else [],
+        "competences_deduites": [],
+        "experience_pertinente": "Réponse simulée (client Gemini factice)",
+        "recommandation": recommandation,
+        "commentaires": "Analyse générée hors ligne par le client simulé.",
+        "pages_analysees": 1,
+        "methode_analyse": "GEMINI ",
+    }
+
+class _FakeModels:
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        return self._client._generate(model, contents, config)
+
+    def generate_content_stream(self, model, contents, config=None):
+        return self._client._generate_stream(model, contents, config)
+
+class _FakeCaches:
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, config=None):
+        return self._client._create_cache(model, config)
+
+    def delete(self, name):
+        self._client._delete_cache(name)
+
+class FakeGeminiClient:
+    """Client simulé configurable.
+
+    - `latency` : (min, max) en secondes, tirée uniformément à chaque appel
+    - `rate_limit_rate` : probabilité de lever une erreur 429 RESOURCE_EXHAUSTED
+    - `malformed_rate` : probabilité de renvoyer un JSON invalide
+    - `min_cache_tokens` : taille minimale d'un préfixe accepté par caches.create
+    - `stream_chunk_chars` : taille des fragments de generate_content_stream ; le premier
+      arrive après `first_chunk_ratio` de la latence tirée, les suivants se partagent le reste
+    """
+
+    def __init__(self, latency=(0.0, 0.0), rate_limit_rate=0.0, malformed_rate=0.0,
+                 min_cache_tokens=0, seed=None, stream_chunk_chars=48, first_chunk_ratio=0.3):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.min_cache_tokens = min_cache_tokens
+        self.stream_chunk_chars = max(1, int(stream_chunk_chars))
+        self.first_chunk_ratio = first_chunk_ratio
+        self.models = _FakeModels(self)
+        self.caches = _FakeCaches(self)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._caches = {}
+        self.stats = {"calls": 0, "rate_limited": 0, "malformed": 0, "caches_created": 0,
+                      "prompt_tokens": 0, "cached_tokens": 0}
+
+    def _draw(self):
+        with self._lock:
+            return (self._random.uniform(*self.latency), self._random.random(), self._random.random())
+
+    def _create_cache(self, model, config):
+        tokens = _count_tokens(getattr(config, "contents", None)) + _estimate_tokens(
+            getattr(config, "system_instruction", "") or "")
+        if tokens < self.min_cache_tokens:
+            raise ValueError(f"400 INVALID_ARGUMENT: cached content is too small ({tokens} tokens)")
+        with self._lock:
+            name = f"cachedContents/fake-{len(self._caches) + 1}"
+            self._caches[name] = tokens
+            self.stats["caches_created"] += 1
+        return SimpleNamespace(name=name)
+
+    def _delete_cache(self, name):
+        with self._lock:
+            self._caches.pop(name, None)
+
+    def _generate(self, model, contents, config):
+        latency, rate_draw, malformed_draw = self._draw()
+        if latency:
+            time.sleep(latency)
+        return self._respond(contents, config, rate_draw, malformed_draw)
+
+    def _generate_stream(self, model, contents, config):
+        latency, rate_draw, malformed_draw = self._draw()
+        if latency:
+            time.sleep(latency * self.first_chunk_ratio)
+        resp = self._respond(contents, config, rate_draw, malformed_draw)
+        size = self.stream_chunk_chars
+        chunks = [resp.text[i:i + size] for i in range(0, len(resp.text), size)] or [""]
+        delay = latency * (1 - self.first_chunk_ratio) / len(chunks)
+        for n, chunk in enumerate(chunks):
+            if n and delay:
+                time.sleep(delay)
+            # Comme l'API : les compteurs de tokens complets accompagnent le dernier fragment
+            last = n == len(chunks) - 1
+            yield SimpleNamespace(text=chunk, usage_metadata=resp.usage_metadata if last else None)
+
+    def _respond(self, contents, config, rate_draw, malformed_draw):
+        with self._lock:
+            self.stats["calls"] += 1
+            if rate_draw < self.rate_limit_rate:
+                self.stats["rate_limited"] += 1
+                raise RuntimeError("429 RESOURCE_EXHAUSTED (client simulé)")
+            cached_name = getattr(config, "cached_content", None)
+            if cached_name and cached_name not in self._caches:
+                raise RuntimeError(f"404 NOT_FOUND: {cached_name}")
+            cached_tokens = self._caches.get(cached_name, 0)
+        system = getattr(config, "system_instruction", None) or ""
+        prompt_tokens = _count_tokens(contents) + _estimate_tokens(system) + cached_tokens
+        packed = _packed_cvs(contents)
+        if contents and all(isinstance(item, str) for item in contents):
+            # Appel de correction : la réponse abîmée seule, renvoyée réparée
+            payload = repair_json(contents[0]) or fake_analysis(contents[0])
+        elif packed:
+            payload = [dict(fake_analysis(body), filename=filename) for filename, body in packed]
+        else:
+            cv_text = _cv_text(contents)
+            payload = fake_analysis(cv_text if cv_text is not None else repr(contents))
+        text = json.dumps(payload, ensure_ascii=False)
+        if malformed_draw < self.malformed_rate:
+            with self._lock:
+                self.stats["malformed"] += 1
+            text = text[:-20]
+        completion_tokens = max(1, len(text) // 4)
+        with self._lock:
+            self.stats["prompt_tokens"] += prompt_tokens
+            self.stats["cached_tokens"] += cached_tokens
+        usage = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=completion_tokens,
+            cached_content_token_count=cached_tokens or None,
+            total_token_count=prompt_tokens + completion_tokens,
+        )
+        return SimpleNamespace(text=text, usage_metadata=usage)
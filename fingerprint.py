@@ -0,0 +1,143 @@
+import re
+import random
+import hashlib
+import unicodedata
+from array import array
+from db import (
+    put_cv_fingerprint, find_fingerprint_candidates, get_analysis_by_pdf,
+    put_job_offer_fingerprint, get_unindexed_job_offers, find_job_offer_candidates,
+)
+
+# MinHash : NUM_PERM permutations, découpées en LSH_BANDS bandes de NUM_PERM // LSH_BANDS lignes.
+# 8 bandes × 8 lignes : deux CV deviennent candidats à partir d'une similarité de Jaccard ~0,77
+NUM_PERM = 64
+LSH_BANDS = 8
+SHINGLE_SIZE = 5
+# Similarité estimée au-delà de laquelle deux CV sont traités comme le même candidat
+NEAR_DUPLICATE_THRESHOLD = 0.85
+# Offres : au-delà de cette similarité, une offre republiée (retouchée) est la même offre
+OFFER_NEAR_DUPLICATE_THRESHOLD = 0.8
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(20240611)   # graine fixe : les empreintes stockées restent comparables
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+_PAGE_MARKER = re.compile(r"^--- page \d+ ---$", re.MULTILINE)
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def shingles(text: str):
+    """Ensemble des n-grammes de mots du texte normalisé (casse, accents, marqueurs de page)"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    words = _WORD.findall(_PAGE_MARKER.sub(" ", text))
+    if len(words) < SHINGLE_SIZE:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+def minhash(text: str):
+    """Signature MinHash (NUM_PERM entiers 32 bits), ou None si le texte est vide"""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little")
+              for s in shingles(text)]
+    if not hashes:
+        return None
+    return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) & 0xFFFFFFFF for a, b in _PERMUTATIONS]
+
+def lsh_buckets(signature):
+    """(bande, seau) de la signature : deux CV proches partagent au moins un seau"""
+    rows = NUM_PERM // LSH_BANDS
+    buckets = []
+    for band in range(LSH_BANDS):
+        chunk = array("I", signature[band * rows:(band + 1) * rows]).tobytes()
+        buckets.append((band, int.from_bytes(hashlib.blake2b(chunk, digest_size=8).digest(), "little", signed=True)))
+    return buckets
+
+def similarity(sig_a, sig_b):
+    """Similarité de Jaccard estimée entre deux signatures"""
+    return sum(a == b for a, b in zip(sig_a, sig_b)) / NUM_PERM
+
+def _to_blob(signature):
+    return array("I", signature).tobytes()
+
+def _from_blob(blob):
+    return array("I", bytes(blob)).tolist()
+
+def remember_cv(job_offer_id: str, pdf_sha256: str, filename: str, signature):
+    """Indexe l'empreinte d'un CV analysé pour les lots suivants de la même offre"""
+    if signature is None or not job_offer_id:
+        return
+    try:
+        put_cv_fingerprint(job_offer_id, pdf_sha256, filename, _to_blob(signature), lsh_buckets(signature))
+    except Exception as e:
+        print(f"⚠️ Empreinte non enregistrée pour {filename} : {e}")
+
+def find_near_duplicate(job_offer_id: str, signature, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+    """Analyse existante d'un quasi-doublon pour cette offre.
+    Retourne {"analysis_id", "filename", "analysis_json", "similarite"} ou None.
+    """
+    if signature is None or not job_offer_id:
+        return None
+    try:
+        candidates = find_fingerprint_candidates(job_offer_id, lsh_buckets(signature))
+        scored = sorted(((similarity(signature, _from_blob(blob)), pdf_sha256)
+                         for pdf_sha256, _, blob in candidates), reverse=True)
+        for score, pdf_sha256 in scored:
+            if score < threshold:
+                break
+            row = get_analysis_by_pdf(job_offer_id, pdf_sha256)
+            if row:
+                return {"analysis_id": row[0], "filename": row[1], "analysis_json": row[2], "similarite": score}
+    except Exception as e:
+        print(f"⚠️ Recherche de doublons impossible : {e}")
+    return None
+
+def cluster_near_duplicates(signatures, threshold: float = NEAR_DUPLICATE_THRESHOLD):
+    """Regroupe les CV d'un même lot : `signatures` {clé: signature}.
+    Retourne {clé du doublon: (clé du représentant, similarité)} ; le représentant est
+    le premier CV du groupe dans l'ordre des clés.
+    """
+    buckets = {}
+    for key in sorted(signatures):
+        if signatures[key] is not None:
+            for bucket in lsh_buckets(signatures[key]):
+                buckets.setdefault(bucket, []).append(key)
+    duplicates = {}
+    for key in sorted(signatures):
+        signature = signatures[key]
+        if signature is None or key in duplicates:
+            continue
+        for bucket in lsh_buckets(signature):
+            for other in buckets[bucket]:
+                if other > key and other not in duplicates:
+                    score = similarity(signature, signatures[other])
+                    if score >= threshold:
+                        duplicates[other] = (key, score)
+    return duplicates
+
+def remember_job_offer(job_offer_id: str, content: str):
+    """Indexe l'empreinte du texte d'une offre (recherche des offres republiées)"""
+    signature = minhash(content or "")
+    try:
+        put_job_offer_fingerprint(job_offer_id, _to_blob(signature) if signature else None,
+                                  lsh_buckets(signature) if signature else [])
+    except Exception as e:
+        print(f"⚠️ Empreinte de l'offre {job_offer_id} non enregistrée : {e}")
+
+def find_similar_job_offer(content: str, threshold: float = OFFER_NEAR_DUPLICATE_THRESHOLD):
+    """Offre existante au texte quasi identique : {"id", "title", "similarite"} ou None.
+    Les offres créées avant l'indexation sont indexées au premier appel.
+    """
+    signature = minhash(content or "")
+    if signature is None:
+        return None
+    try:
+        for job_offer_id, offer_content in get_unindexed_job_offers():
+            remember_job_offer(job_offer_id, offer_content)
+        scored = sorted(((similarity(signature, _from_blob(blob)), job_offer_id, title)
+                         for job_offer_id, title, blob in find_job_offer_candidates(lsh_buckets(signature))),
+                        reverse=True)
+        if scored and scored[0][0] >= threshold:
+            score, job_offer_id, title = scored[0]
+            return {"id": job_offer_id, "title": title, "similarite": score}
+    except Exception as e:
+        print(f"⚠️ Recherche d'offres similaires impossible : {e}")
+    return None
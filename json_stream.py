@@ -0,0 +1,169 @@
+import re
+import json
+
+
+class IncrementalJSONParser:
+    """Lecture au fil de l'eau d'un objet JSON plat reçu par fragments (réponse en streaming).
+
+    `feed(fragment)` retourne les clés de premier niveau dont la valeur vient d'être
+    complétée ; `fields` contient toutes les valeurs complètes. Une chaîne encore en cours
+    de réception est disponible via `pending()`. Le texte avant la première accolade
+    (ex. ```json) est ignoré ; la validation finale reste celle de la réponse complète.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect_key = True
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+
+    def feed(self, fragment: str):
+        self.text += fragment or ""
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self.done:
+                break
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect_key and self._key_start is not None:
+                        self._key = self._decode(text[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                continue
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect_key:
+                    self._key_start = i
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._complete(text[self._value_start:i] if self._value_start is not None else None, completed)
+                    self.done = True
+            elif self._depth == 1 and ch == ":" and self._expect_key:
+                self._expect_key = False
+                self._value_start = i + 1
+            elif self._depth == 1 and ch == ",":
+                self._complete(text[self._value_start:i] if self._value_start is not None else None, completed)
+        self._pos = len(text)
+        return completed
+
+    def pending(self):
+        """(clé, début du texte) de la chaîne de premier niveau en cours de réception, ou None"""
+        if self.done or self._expect_key or self._value_start is None or self._depth != 1 or not self._in_string:
+            return None
+        raw = self.text[self._value_start:].lstrip()
+        if self._escape:
+            raw = raw[:-1]   # échappement coupé entre deux fragments
+        value = self._decode(raw + '"')
+        return (self._key, value) if isinstance(value, str) else None
+
+    def _complete(self, raw, completed):
+        if isinstance(self._key, str) and raw is not None:
+            value = self._decode(raw.strip())
+            if value is not _INVALID:
+                self.fields[self._key] = value
+                completed.append(self._key)
+        self._key = None
+        self._value_start = None
+        self._expect_key = True
+
+    @staticmethod
+    def _decode(raw):
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return _INVALID
+
+_INVALID = object()
+
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def _close_truncated(text):
+    # Referme une sortie coupée : chaîne ouverte, puis conteneurs ouverts. Un littéral
+    # inachevé en fin de texte (nombre, true…) est retiré avec sa clé : sa valeur est douteuse.
+    stack, in_string, escape, last_structural = [], False, False, -1
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+                last_structural = i
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append([ch, i, None])
+            last_structural = i
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            last_structural = i
+        elif ch in ",:":
+            if ch == "," and stack:
+                stack[-1][2] = i
+            last_structural = i
+    if in_string:
+        text = (text[:-1] if escape else text) + '"'
+    elif text[last_structural + 1:].strip() and stack:
+        text = text[:stack[-1][2]] if stack[-1][2] is not None else text[:stack[-1][1] + 1]
+    closers = "".join("}" if opener == "{" else "]" for opener, _, _ in reversed(stack))
+    return text, closers, stack
+
+
+def repair_json(text: str):
+    """Objet ou tableau JSON récupéré d'une réponse abîmée, ou None.
+
+    Tolère le texte autour du JSON (balises ```json, phrases), les virgules finales, les
+    caractères de contrôle dans les chaînes et une sortie tronquée : la chaîne en cours est
+    refermée, et la dernière paire incomplète d'un conteneur est abandonnée si besoin.
+    """
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return None
+    body = text[min(starts):].strip()
+    decoder = json.JSONDecoder(strict=False)
+    for candidate in (body, _TRAILING_COMMA.sub(r"\1", body)):
+        try:
+            return decoder.raw_decode(candidate)[0]
+        except ValueError:
+            pass
+    body, closers, stack = _close_truncated(body.rstrip("`").rstrip())
+    # Si la dernière paire reste invalide (clé sans valeur…), on la retire, conteneur par conteneur
+    for _ in range(len(stack) + 1):
+        candidate = _TRAILING_COMMA.sub(r"\1", body.rstrip().rstrip(",:").rstrip() + closers)
+        try:
+            return decoder.raw_decode(candidate)[0]
+        except ValueError:
+            pass
+        if not stack:
+            break
+        opener, start, comma = stack[-1]
+        if comma is not None and comma < len(body):
+            body = body[:comma]
+            stack[-1][2] = None
+        else:
+            body = body[:start + 1]
+    return None
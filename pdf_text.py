@@ -0,0 +1,59 @@
+import io
+import re
+import unicodedata
+from PyPDF2 import PdfReader
+
+# Seuils de qualité : en dessous, le PDF est probablement scanné / image et part tel quel à Gemini
+MIN_TEXT_CHARS = 300
+MIN_CHARS_PER_PAGE = 150
+MIN_LETTER_RATIO = 0.55
+MAX_GARBAGE_RATIO = 0.02
+
+_CONTROL_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+_HYPHEN_BREAK = re.compile(r"(\w)-\n(\w)")
+_SPACES = re.compile(r"[ \t]+")
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+def normalize_cv_text(text: str) -> str:
+    """Normalise le texte extrait : Unicode NFKC, césures, espaces et lignes vides"""
+    text = unicodedata.normalize("NFKC", text)
+    text = _CONTROL_CHARS.sub(" ", text.replace("\r\n", "\n").replace("\r", "\n"))
+    text = _HYPHEN_BREAK.sub(r"\1\2", text)
+    lines = [_SPACES.sub(" ", line).strip() for line in text.split("\n")]
+    return _BLANK_LINES.sub("\n\n", "\n".join(lines)).strip()
+
+def _text_quality(text: str, pages: int):
+    """Retourne (ok, raison) selon la quantité et la lisibilité du texte extrait"""
+    compact = "".join(text.split())
+    if len(compact) < MIN_TEXT_CHARS:
+        return False, f"texte trop court ({len(compact)} caractères)"
+    if pages and len(compact) / pages < MIN_CHARS_PER_PAGE:
+        return False, f"trop peu de texte par page ({len(compact) // pages} caractères/page)"
+    letters = sum(ch.isalpha() for ch in compact)
+    if letters / len(compact) < MIN_LETTER_RATIO:
+        return False, f"proportion de lettres trop faible ({letters / len(compact):.0%})"
+    garbage = compact.count("�") + compact.count("(cid:") * 5
+    if garbage / len(compact) > MAX_GARBAGE_RATIO:
+        return False, "encodage de police illisible"
+    return True, "ok"
+
+def extract_cv_text(pdf_bytes: bytes):
+    """Extrait le texte d'un CV PDF en local (PyPDF2).
+
+    Retourne {"text", "pages", "ok", "reason"} : `ok` indique si le texte est
+    assez fiable pour remplacer l'envoi du PDF (sinon : PDF scanné/image, chiffré, illisible).
+    """
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        if reader.is_encrypted:
+            reader.decrypt("")
+        page_texts = [page.extract_text() or "" for page in reader.pages]
+    except Exception as e:
+        return {"text": "", "pages": 0, "ok": False, "reason": f"extraction impossible : {e}"}
+    pages = len(page_texts)
+    text = "\n\n".join(
+        f"--- Page {i} ---\n{normalize_cv_text(t)}" for i, t in enumerate(page_texts, start=1)
+    )
+    ok, reason = _text_quality("\n".join(page_texts), pages)
+    return {"text": text, "pages": pages, "ok": ok, "reason": reason}
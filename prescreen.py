@@ -0,0 +1,119 @@
+import re
+import hashlib
+import unicodedata
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pdf_text import extract_cv_text
+
+# BM25 : saturation de la fréquence des termes (k1) et normalisation par la longueur (b)
+PRESCREEN_BM25_K1 = 1.5
+PRESCREEN_BM25_B = 0.75
+# Part des mots-clés obligatoires dans le score final (le reste : BM25 relatif au meilleur CV)
+PRESCREEN_KEYWORD_WEIGHT = 0.3
+# Extraction parallèle (threads) à partir de ce nombre de CV
+PRESCREEN_PARALLEL_MIN = 20
+PRESCREEN_WORKERS = 4
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9+#.]*[a-z0-9+#]|[a-z0-9]")
+_STOPWORDS = set("""
+a au aux avec ce ces dans de des du elle en et eux il je la le les leur lui ma mais me meme mes moi mon ne nos
+notre nous on ou par pas pour qu que qui sa se ses son sur ta te tes toi ton tu un une vos votre vous c d j l m n
+s t y ete etre avoir est sont sera plus tres afin ainsi chez comme dont leurs cette cet tout tous toute toutes
+the of and to in for on with at by from an or as is are be this that your our you we will page
+""".split())
+
+
+def tokenize(text: str):
+    """Mots normalisés (minuscules, sans accents, sans mots vides)"""
+    text = unicodedata.normalize("NFKD", (text or "").lower())
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    return [w for w in _WORD.findall(text) if w not in _STOPWORDS]
+
+def parse_keywords(raw: str):
+    """Mots-clés obligatoires saisis séparés par des virgules ou des retours à la ligne"""
+    return [k.strip() for k in re.split(r"[,;\n]", raw or "") if k.strip()]
+
+def _keyword_hits(doc_tokens, keywords):
+    text = f" {' '.join(doc_tokens)} "
+    return [k for k in keywords if tokenize(k) and f" {' '.join(tokenize(k))} " in text]
+
+def _extract_all(pdfs):
+    # Threads et non processus : l'appelant (Streamlit) est lui-même multi-thread, un fork y est risqué
+    if len(pdfs) < PRESCREEN_PARALLEL_MIN:
+        return [extract_cv_text(pdf) for pdf in pdfs]
+    with ThreadPoolExecutor(max_workers=PRESCREEN_WORKERS, thread_name_prefix="prescreen") as pool:
+        return list(pool.map(extract_cv_text, pdfs))
+
+def bm25_scores(docs, query_terms):
+    """Scores BM25 (vectorisés) des documents tokenisés pour les termes de la requête"""
+    vocab = {term: j for j, term in enumerate(sorted(set(query_terms)))}
+    if not docs or not vocab:
+        return np.zeros(len(docs))
+    tf = np.zeros((len(docs), len(vocab)), dtype=np.float64)
+    for d, tokens in enumerate(docs):
+        for term, count in Counter(tokens).items():
+            j = vocab.get(term)
+            if j is not None:
+                tf[d, j] = count
+    lengths = np.array([len(tokens) for tokens in docs], dtype=np.float64)
+    avgdl = lengths.mean() or 1.0
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1.0 + (len(docs) - df + 0.5) / (df + 0.5))
+    norm = PRESCREEN_BM25_K1 * (1 - PRESCREEN_BM25_B + PRESCREEN_BM25_B * lengths / avgdl)
+    return (tf * (PRESCREEN_BM25_K1 + 1) / (tf + norm[:, None])) @ idf
+
+def prescreen_batch(files, job_offer_text: str, keywords=(), top_k: int = None, min_score: float = None):
+    """Pré-sélection locale d'un lot, sans appel au modèle.
+
+    `files` : liste de (filename, pdf_bytes). Score sur 100 : BM25 du texte extrait face à
+    l'offre (relatif au meilleur CV du lot) et part des `keywords` présents. Sont retenus
+    les `top_k` premiers et/ou ceux dont le score atteint `min_score` ; un CV sans texte
+    exploitable (scanné) ne peut pas être noté et est toujours retenu.
+    Retourne un dict par fichier, dans l'ordre de `files` : index, filename, pdf_sha256,
+    score, bm25, keyword_hits, keywords_total, rank, selected, reason, et extraction
+    (résultat d'extract_cv_text, à transmettre à analyze_batch via extractions_by_sha).
+    """
+    keywords = list(keywords or [])
+    extractions = _extract_all([pdf_bytes for _, pdf_bytes in files])
+    results = []
+    scorable = []
+    for index, ((filename, pdf_bytes), extraction) in enumerate(zip(files, extractions)):
+        row = {"index": index, "filename": filename, "pdf_sha256": hashlib.sha256(pdf_bytes).hexdigest(),
+               "score": None, "bm25": None, "keyword_hits": None, "keywords_total": len(keywords),
+               "rank": None, "selected": True, "reason": f"texte non exploitable ({extraction['reason']})",
+               "extraction": extraction}
+        results.append(row)
+        if extraction["ok"]:
+            scorable.append((row, tokenize(extraction["text"])))
+    if scorable:
+        bm25 = bm25_scores([tokens for _, tokens in scorable], tokenize(job_offer_text))
+        best = float(bm25.max()) or 1.0
+        for (row, tokens), value in zip(scorable, bm25):
+            hits = _keyword_hits(tokens, keywords)
+            relevance = float(value) / best
+            keyword_ratio = len(hits) / len(keywords) if keywords else relevance
+            row["bm25"] = round(float(value), 4)
+            row["keyword_hits"] = len(hits)
+            row["score"] = round(100 * ((1 - PRESCREEN_KEYWORD_WEIGHT) * relevance
+                                        + PRESCREEN_KEYWORD_WEIGHT * keyword_ratio), 1)
+        ranked = sorted((row for row, _ in scorable), key=lambda r: (-r["score"], r["index"]))
+        for rank, row in enumerate(ranked, start=1):
+            row["rank"] = rank
+            if top_k and rank > top_k:
+                row["selected"], row["reason"] = False, f"hors des {top_k} premiers"
+            elif min_score is not None and row["score"] < min_score:
+                row["selected"], row["reason"] = False, f"score < {min_score:g}"
+            else:
+                row["reason"] = "retenu"
+    return results
+
+def extractions_by_sha(results):
+    """Textes extraits par sha256 du PDF, pour éviter une seconde extraction dans analyze_batch"""
+    return {r["pdf_sha256"]: r["extraction"] for r in results}
+
+def summarize(results):
+    """(retenus, écartés, non notés)"""
+    kept = sum(1 for r in results if r["selected"])
+    unscored = sum(1 for r in results if r["score"] is None)
+    return kept, len(results) - kept, unscored
@@ -0,0 +1,75 @@
+import time
+import threading
+from db import acquire_rate_token
+
+
+class TokenBucket:
+    """Seau à jetons : au plus `rate_per_minute` appels par minute, avec une rafale de `burst`"""
+
+    def __init__(self, rate_per_minute: float, burst: int = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(burst or max(1, int(rate_per_minute // 10)))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Bloque jusqu'à obtenir un jeton ; retourne le temps d'attente en secondes"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class SharedTokenBucket:
+    """Seau à jetons stocké en base (table rate_limits) : tous les processus worker.py
+    qui utilisent le même `name` se partagent la même capacité d'appels
+    """
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int = None):
+        self.name = name
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            delay = acquire_rate_token(self.name, self.rate_per_minute, self.burst)
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+class _RateLimitedModels:
+    def __init__(self, models, bucket):
+        self._models = models
+        self._bucket = bucket
+        self._local = threading.local()
+
+    def generate_content(self, **kwargs):
+        self._local.waited = self._bucket.acquire()
+        return self._models.generate_content(**kwargs)
+
+    def generate_content_stream(self, **kwargs):
+        self._local.waited = self._bucket.acquire()
+        return self._models.generate_content_stream(**kwargs)
+
+    def last_wait(self):
+        """Attente (s) imposée par le seau au dernier appel de ce thread (télémétrie)"""
+        return getattr(self._local, "waited", 0.0)
+
+class RateLimitedClient:
+    """Enveloppe d'un client Gemini : chaque generate_content(_stream) consomme un jeton du seau.
+    Les retries sur 429 d'analyze_cv_with_gemini repassent aussi par le seau.
+    """
+
+    def __init__(self, client, bucket: TokenBucket):
+        self.models = _RateLimitedModels(client.models, bucket)
+        self.caches = client.caches
@@ -0,0 +1,174 @@
+"""Workers de la file d'attente d'analyses (lots mis en file depuis l'interface).
+
+    python worker.py [--processes 2] [--threads 4] [--rpm 60] [--fake-model]
+
+Chaque processus réserve les items un par un dans la base (claim_batch_item), en servant
+équitablement les lots actifs ; la limite --rpm est commune à tous les processus.
+"""
+import os
+import sys
+import time
+import signal
+import argparse
+import threading
+import multiprocessing
+from pathlib import Path
+from dotenv import load_dotenv
+import db
+from db import (
+    init_db, get_job_offer_by_id, claim_batch_item, complete_batch_item, release_batch_items,
+    requeue_stale_batch_items, finish_batch_job_if_complete, close_connection,
+)
+from analyzer import DEFAULT_MAX_IN_FLIGHT, analyze_cv_with_gemini, estimate_cost, make_context_cache, _parse_analysis_json
+from rate_limit import SharedTokenBucket, RateLimitedClient
+
+load_dotenv()
+
+# Attente entre deux consultations d'une file vide
+WORKER_POLL_SECONDS = 1.0
+# Fréquence de reprise des items dont le worker a disparu
+WORKER_REQUEUE_INTERVAL = 30.0
+# Nom du seau à jetons partagé (table rate_limits)
+WORKER_RATE_LIMIT_NAME = "gemini"
+
+
+def _make_client(fake_model: bool):
+    if fake_model:
+        from fake_gemini import FakeGeminiClient
+        return FakeGeminiClient(latency=(0.2, 1.0))
+    from google import genai
+    return genai.Client()
+
+def _process_item(item, client, context_cache, name, max_retries, offers):
+    job_offer_id = item["job_offer_id"]
+    if job_offer_id not in offers:
+        offers[job_offer_id] = get_job_offer_by_id(job_offer_id)
+    offer = offers[job_offer_id]
+    filename = item["filename"]
+    if not offer:
+        complete_batch_item(item["id"], error=f"Offre {job_offer_id} introuvable")
+        return
+    try:
+        pdf_bytes = item["pdf_bytes"] if item["pdf_bytes"] is not None else Path(item["path"]).read_bytes()
+    except (OSError, TypeError) as e:
+        complete_batch_item(item["id"], error=f"Lecture impossible : {e}")
+        return
+    options = item["options"]
+    notify = lambda level, message: print(f"[{name}] {filename} : {message}")
+    try:
+        result = analyze_cv_with_gemini(pdf_bytes, offer[2], client, max_retries, notify=notify,
+                                        job_offer_id=job_offer_id, force=options.get("force", False),
+                                        prefer_text=options.get("prefer_text", True),
+                                        context_cache=context_cache, dedupe=options.get("dedupe", True),
+                                        filename=filename)
+        error = None if result else "Échec de l'appel Gemini"
+    except Exception as e:
+        result, error = None, str(e)
+    parsed = _parse_analysis_json(result["content"]) if result else None
+    if parsed is None:
+        complete_batch_item(item["id"], error=error or "Réponse JSON invalide",
+                            content=result["content"] if result else None)
+        print(f"[{name}] ❌ {filename} : {error or 'réponse JSON invalide'}")
+        return
+    cached = result.get("cached", False)
+    # Même règle que l'interface : un résultat en cache est déjà enregistré pour l'offre,
+    # sauf si une tentative précédente a été interrompue avant l'enregistrement
+    record = not cached or item["attempts"] > 1
+    complete_batch_item(item["id"], filename, parsed if record else None, job_offer_id,
+                        result.get("input_mode"), content=result["content"], cached=cached,
+                        cost_usd=0.0 if cached else estimate_cost(result["tokens"]),
+                        pdf_sha256=result.get("pdf_sha256"))
+    print(f"[{name}] ✅ {filename} — {parsed.get('score_global', '?')}/100" + (" (cache)" if cached else ""))
+
+def _work_loop(name, client, context_cache, stop, max_retries):
+    offers = {}
+    try:
+        while not stop.is_set():
+            item = claim_batch_item(name)
+            if item is None:
+                stop.wait(WORKER_POLL_SECONDS)
+                continue
+            try:
+                _process_item(item, client, context_cache, name, max_retries, offers)
+            except Exception as e:
+                complete_batch_item(item["id"], error=str(e))
+            finish_batch_job_if_complete(item["job_id"])
+    finally:
+        close_connection()
+
+def run_worker_process(index, db_path, threads, rpm, fake_model, max_retries):
+    """Point d'entrée d'un processus : `threads` boucles de réservation sur un client partagé"""
+    db.DB_PATH = db_path
+    signal.signal(signal.SIGINT, signal.SIG_IGN)   # l'arrêt est piloté par le processus parent
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    client = _make_client(fake_model)
+    if rpm:
+        client = RateLimitedClient(client, SharedTokenBucket(WORKER_RATE_LIMIT_NAME, rpm))
+    # Un cache de préfixe par processus, réutilisé d'un lot à l'autre pour une même offre
+    context_cache = make_context_cache(client)
+    base = f"w{index}-{os.getpid()}"
+    loops = [threading.Thread(target=_work_loop, args=(f"{base}-{t}", client, context_cache, stop, max_retries),
+                              name=f"{base}-{t}", daemon=True) for t in range(threads)]
+    for loop in loops:
+        loop.start()
+    last_requeue = 0.0
+    while not stop.is_set():
+        if index == 0 and time.monotonic() - last_requeue > WORKER_REQUEUE_INTERVAL:
+            if requeue_stale_batch_items():
+                print("🔁 Items abandonnés remis en file")
+            last_requeue = time.monotonic()
+        stop.wait(1.0)
+    for loop in loops:
+        loop.join(timeout=60)
+    for t, loop in enumerate(loops):
+        # Un thread encore dans un appel Gemini garde son item : le remettre en file ferait
+        # analyser (et facturer) le CV une seconde fois. Son bail expirera, puis
+        # requeue_stale_batch_items le reprendra.
+        if loop.is_alive():
+            print(f"⏳ {loop.name} : analyse toujours en cours, item repris à l'expiration du bail")
+        else:
+            release_batch_items(f"{base}-{t}")
+    context_cache.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Workers de la file d'attente d'analyses de CV")
+    parser.add_argument("--db", help=f"base SQLite (défaut {db.DB_PATH})")
+    parser.add_argument("--processes", type=int, default=2, help="nombre de processus (défaut 2)")
+    parser.add_argument("--threads", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help=f"appels simultanés par processus (défaut {DEFAULT_MAX_IN_FLIGHT})")
+    parser.add_argument("--rpm", type=float, default=0, help="limite d'appels Gemini par minute, tous processus confondus")
+    parser.add_argument("--max-retries", dest="max_retries", type=int, default=4,
+                        help="tentatives par appel, au moins 1 (défaut 4)")
+    parser.add_argument("--fake-model", dest="fake_model", action="store_true", help="client Gemini simulé, sans réseau")
+    args = parser.parse_args(argv)
+    if args.max_retries < 1:
+        parser.error("--max-retries doit valoir au moins 1")
+    if args.db:
+        db.DB_PATH = args.db
+    if not args.fake_model and not os.getenv("GEMINI_API_KEY"):
+        print("⚠️ Clé API GEMINI_API_KEY non configurée (ou utilisez --fake-model).")
+        return 2
+    init_db()
+    processes = [
+        multiprocessing.Process(target=run_worker_process, name=f"cv-worker-{i}",
+                                args=(i, db.DB_PATH, args.threads, args.rpm, args.fake_model, args.max_retries))
+        for i in range(max(1, args.processes))
+    ]
+    for p in processes:
+        p.start()
+    print(f"👷 {len(processes)} processus × {args.threads} appels simultanés — Ctrl+C pour arrêter")
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        print("\n⏹️ Arrêt : fin des analyses en cours, les items restants sont remis en file…")
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        for p in processes:
+            p.terminate()   # SIGTERM : arrêt propre dans run_worker_process
+        for p in processes:
+            p.join()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())